@@ -0,0 +1,221 @@
+"""
+HTTP/JSON API that serves the app's data without the Streamlit interface.
+
+The API uses the same loading functions as the app. Each LGU's data is loaded once per
+process and shared by all requests. Responses have ETags, so clients can send
+If-None-Match and get a 304 response when nothing changed, and are gzipped when the
+client accepts it.
+
+Endpoints:
+
+    GET /lgus
+    GET /lgus/{lgu}/variables?sector=...&element=...&hazard=...&aspect=...&detail=...
+    GET /lgus/{lgu}/values?variable=...&variable=...
+    GET /lgus/{lgu}/barangays
+    GET /lgus/{lgu}/barangays/{barangay}/summary?element=...&hazard=...
+    GET /lgus/{lgu}/locate?lat=...&lon=...
+
+Example:
+
+    python api_server.py --port 8502
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+
+import tornado.ioloop
+import tornado.web
+
+from app_data import load_lgu_data, MAX_CACHED_LGUS
+from app_barangay_summary import make_hierarchical, get_eh_categories, get_key_categories, get_key_scores
+from lgu_registry import read_lgu_registry
+from spatial_index import BarangayIndex
+from label_registry import make_flat_keys
+
+PORT = 8502
+
+# Query parameters of the variables endpoint and the hierarchy levels they filter.
+LEVEL_PARAMS = {
+    "sector": "Sector",
+    "element": "Element",
+    "hazard": "Hazard",
+    "aspect": "Disaster Risk Aspect",
+    "detail": "Detail",
+}
+
+class APIData:
+    """Data of one LGU, loaded once and shared by all requests."""
+
+    def __init__(self, lgu):
+        self.mi_df, self.flat_df, self.db, self.gdf = load_lgu_data(lgu)
+
+        self.orig_df = make_hierarchical(self.flat_df, self.mi_df)
+        self.barangay_index = BarangayIndex(self.gdf)
+
+        # Version of the data files. It is part of every ETag, so ETags change when the data changes.
+        file_stats = [os.stat(lgu[key]) for key in ["db_path", "geo_path"]]
+        self.version = ";".join("{}-{}".format(stat.st_mtime_ns, stat.st_size) for stat in file_stats)
+
+@functools.lru_cache(maxsize = MAX_CACHED_LGUS)
+def get_api_data(lgu_key):
+    """Load the data of an LGU. At most MAX_CACHED_LGUS LGUs are kept, like in the app."""
+    return APIData(read_lgu_registry()[lgu_key])
+
+def frame_to_records(df):
+    """Convert a DataFrame to a list of dicts, with missing values as None."""
+    return json.loads(df.to_json(orient = "records"))
+
+class JSONHandler(tornado.web.RequestHandler):
+    """Base handler that answers with JSON and supports conditional requests."""
+
+    def get_lgu_data(self, lgu_key):
+        if lgu_key not in read_lgu_registry():
+            raise tornado.web.HTTPError(404, reason = "Unknown LGU")
+        return get_api_data(lgu_key)
+
+    async def respond(self, version, build_body):
+        """Send the JSON returned by build_body(), unless the client already has the current version.
+
+The ETag is computed from the data version and the request URI, so a 304 response
+can be sent without building the body."""
+
+        etag = '"{}"'.format(hashlib.sha1("{} {}".format(version, self.request.uri).encode()).hexdigest())
+        self.set_header("Etag", etag)
+        self.set_header("Cache-Control", "no-cache")
+
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        # Build the body in a thread so that the event loop can keep serving other requests.
+        body = await tornado.ioloop.IOLoop.current().run_in_executor(None, build_body)
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(body)
+
+    def compute_etag(self):
+        # ETags are set in respond(), so Tornado does not need to hash the body.
+        return None
+
+class LGUsHandler(JSONHandler):
+    async def get(self):
+        registry = read_lgu_registry()
+        body = json.dumps([{"key": key, "name": lgu["name"]} for key, lgu in registry.items()])
+        await self.respond("registry", lambda: body)
+
+class VariablesHandler(JSONHandler):
+    async def get(self, lgu_key):
+        data = self.get_lgu_data(lgu_key)
+
+        def build_body():
+            variables = data.mi_df.loc[data.mi_df["Sector"] != "(Barangay)"]
+            for param, mi_level in LEVEL_PARAMS.items():
+                value = self.get_query_argument(param, None)
+                if value is not None:
+                    variables = variables.loc[variables[mi_level] == value]
+
+            variables = variables.assign(label = make_flat_keys(variables))
+            return json.dumps(frame_to_records(variables))
+
+        await self.respond(data.version, build_body)
+
+class ValuesHandler(JSONHandler):
+    async def get(self, lgu_key):
+        data = self.get_lgu_data(lgu_key)
+        variables = self.get_query_arguments("variable")
+
+        unknown = [label for label in variables if label not in data.flat_df.columns]
+        if unknown:
+            raise tornado.web.HTTPError(404, reason = "Unknown variable: {}".format(unknown[0]))
+
+        def build_body():
+            cols = ["(Barangay)"] + [label for label in variables if label != "(Barangay)"]
+            return data.flat_df[cols].to_json(orient = "split", index = False)
+
+        await self.respond(data.version, build_body)
+
+class BarangaysHandler(JSONHandler):
+    async def get(self, lgu_key):
+        data = self.get_lgu_data(lgu_key)
+        await self.respond(data.version, lambda: json.dumps(data.flat_df["(Barangay)"].tolist()))
+
+class SummaryHandler(JSONHandler):
+    async def get(self, lgu_key, barangay):
+        data = self.get_lgu_data(lgu_key)
+
+        if barangay not in data.orig_df.index:
+            raise tornado.web.HTTPError(404, reason = "Unknown barangay")
+
+        def build_body():
+            eh_combos = get_eh_categories(data.orig_df, data.db, barangay)
+            summary = {
+                "barangay": barangay,
+                "element_hazard_categories": frame_to_records(eh_combos),
+            }
+
+            element = self.get_query_argument("element", None)
+            hazard = self.get_query_argument("hazard", None)
+
+            # Key categories and scores are given for one element and hazard, like in the app.
+            if element is not None and hazard is not None:
+                combo = eh_combos.loc[(eh_combos["Element"] == element) & (eh_combos["Hazard"] == hazard)]
+                if combo.empty:
+                    raise tornado.web.HTTPError(404, reason = "No data on this element and hazard for this barangay")
+
+                key_categories = get_key_categories(data.orig_df, barangay, element, hazard)
+                key_score_df, key_score_cols = get_key_scores(data.orig_df, barangay, element, hazard)
+
+                summary["key_categories"] = json.loads(key_categories.to_json())
+                summary["key_scores"] = json.loads(key_score_df.to_json(orient = "index"))
+
+            return json.dumps(summary)
+
+        await self.respond(data.version, build_body)
+
+class LocateHandler(JSONHandler):
+    async def get(self, lgu_key):
+        data = self.get_lgu_data(lgu_key)
+
+        try:
+            lat = float(self.get_query_argument("lat"))
+            lon = float(self.get_query_argument("lon"))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason = "lat and lon must be numbers")
+
+        def build_body():
+            return json.dumps({"lat": lat, "lon": lon, "barangay": data.barangay_index.locate(lon, lat)})
+
+        await self.respond(data.version, build_body)
+
+def make_app():
+    """Make the Tornado application with gzip compression."""
+
+    return tornado.web.Application(
+        [
+            (r"/lgus", LGUsHandler),
+            (r"/lgus/([^/]+)/variables", VariablesHandler),
+            (r"/lgus/([^/]+)/values", ValuesHandler),
+            (r"/lgus/([^/]+)/barangays", BarangaysHandler),
+            (r"/lgus/([^/]+)/barangays/([^/]+)/summary", SummaryHandler),
+            (r"/lgus/([^/]+)/locate", LocateHandler),
+        ],
+        compress_response = True,
+    )
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Serve the app's data as a JSON API.")
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--preload", nargs = "*", default = [], help = "Keys of LGUs to load before serving requests.")
+    args = parser.parse_args()
+
+    for lgu_key in args.preload:
+        get_api_data(lgu_key)
+
+    app = make_app()
+    app.listen(args.port)
+    print("Serving the API on port {}".format(args.port))
+    tornado.ioloop.IOLoop.current().start()
@@ -1,44 +1,83 @@
+import copy
+import math
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 import altair as alt
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from label_registry import make_column_index, make_flat_keys
+from lgu_registry import read_lgu_registry, get_vintage_db_path
+from disk_cache import cached, hash_files
+
 # For matplotlib charts
 from matplotlib.backends.backend_agg import RendererAgg
 from io import BytesIO
 
-@st.cache_data(ttl = None)
-def make_hierarchical(flat_df, mi_df):
-    """Recreate the original hierarchical DataFrame."""
+# Dictionaries to convert risk categories to numbers.
+risk_cat_to_num = {
+    "Low Risk": 1,
+    "Moderate Risk": 3,
+    "High Risk": 5,
+    "Very High Risk": 6,
+}
+vulnerability_cat_to_num = {
+    "Low": 1,
+    "Medium Low": 2,
+    "Medium": 3,
+    "Medium High": 4,
+    "High": 5,
+}
+
+# List of key categories
+cat_list = [
+    "Degree Of Impact Category",
+    "Vulnerability Category",
+    "Risk Category",
+]
+
+# List of all possible score labels. This is here for ordering the df rows.
+all_score_labels = [
+    "Likelihood Of Occurrence",
+    "Exposure Score",
+    "Sensitivity Score",
+    "Degree Of Impact Score",
+    "Adaptive Capacity Score",
+    "Vulnerability Score",
+    "Severity Of Consequence Score",
+    "Risk Score",
+]
+
+# Largest number of bins in a score histogram, as with Altair's bin = True.
+MAX_HISTOGRAM_BINS = 10
 
-    orig_df = flat_df.copy().set_index("(Barangay)")
-    mi_df = mi_df.drop(0, axis = 0)
-    orig_df.columns = pd.MultiIndex.from_frame(mi_df)
+def make_hierarchical(flat_df, mi_df):
+    """Recreate the original hierarchical DataFrame.
+It shares the arrays of flat_df instead of copying them, so it is cheap to make on every rerun."""
 
-    return orig_df
+    # A shallow copy has new blocks that point to the same arrays. Popping (Barangay) off it
+    # only rebuilds the text block, while set_index() would copy every column.
+    orig_df = flat_df.copy(deep = False)
+    orig_df.index = pd.Index(orig_df.pop("(Barangay)"))
 
-def barangay_summary_feature(mi_df, flat_df, db):
-    """Barangay Data Summary feature."""
+    # Match each column to its row of mi_df by its flat key, since the columns are not always
+    # in the order of mi_df. For example, data attached from shared memory is grouped by type.
+    positions = pd.Index(make_flat_keys(mi_df)).get_indexer(orig_df.columns)
 
-    # Make a hierarchically labeled DataFrame again.
-    orig_df = make_hierarchical(flat_df, mi_df)
+    # A column without a row of mi_df would get the labels of its last row, so it is an error.
+    if (positions == -1).any():
+        raise ValueError("Columns of flat_df that are not in mi_df: {}".format(orig_df.columns[positions == -1].tolist()))
 
-    st.title("Barangay Data Summaries")
-    st.markdown("""This feature lets you select one barangay and get a summary of the most important data on agricultural disaster risk. Select a barangay from the options, or search for one by typing inside the box.""")
-    st.caption("Only barangays where data is available can be selected.")
+    # Build the column MultiIndex from the label registry's integer codes.
+    orig_df.columns = make_column_index(mi_df.iloc[positions])
 
-    # This only contains the barangays in the Sparta open data,
-    # and not the ones from GADM.
-    open_data_barangays = flat_df["(Barangay)"].tolist()
+    return orig_df
 
-    # Let the user select a barangay.
-    barangay = st.selectbox(
-        label = "Select barangay",
-        options = open_data_barangays,
-    )
+def get_geo_areas(orig_df, barangay):
+    """Return a list of the geological areas in a barangay that are affected by hazards."""
 
-    # Geological areas affected by hazards
     geo_areas_list = list(
         orig_df
         .loc[
@@ -49,14 +88,10 @@ def barangay_summary_feature(mi_df, flat_df, db):
         .unique()
     )
 
-    # Join the list into a string to be displayed on screen.
-    geo_areas_str = "- " + "\n- ".join(geo_areas_list)
-    geo_message = "Geological areas affected by hazards\n" + geo_areas_str
-
-    st.markdown(geo_message)
+    return geo_areas_list
 
-    #---
-    # Identify the element-hazard combinations of the barangay.
+def get_eh_categories(orig_df, db, barangay):
+    """Return a DataFrame of the element-hazard combinations of a barangay and their key categories."""
 
     # DataFrame of element and hazard combinations
     eh_combos = db["library"][["Element", "Hazard"]].drop_duplicates()
@@ -89,10 +124,10 @@ def barangay_summary_feature(mi_df, flat_df, db):
 
     eh_combos = eh_combos.dropna(subset = ["Vulnerability Category", "Risk Category"])
 
-    # Create separate Series of elements and hazards.
-    # This is done after dropping rows with nulls in Vulnerability Category and Risk Category.
-    elements = eh_combos["Element"].copy()
-    hazards = eh_combos["Hazard"].copy()
+    return eh_combos
+
+def make_heatmap_frames(eh_combos):
+    """Take the element-hazard combinations and return the DataFrames displayed and plotted in the heatmap."""
 
     # This df is the version displayed on screen.
     # Duplicate elements are not shown so it looks hierarchical.
@@ -102,30 +137,16 @@ def barangay_summary_feature(mi_df, flat_df, db):
         "Element"
     ] = ""
 
-    # Dictionaries to convert risk categories to numbers.
-    risk_cat_to_num = {
-        "Low Risk": 1,
-        "Moderate Risk": 3,
-        "High Risk": 5,
-        "Very High Risk": 6,
-    }
-    vulnerability_cat_to_num = {
-        "Low": 1,
-        "Medium Low": 2,
-        "Medium": 3,
-        "Medium High": 4,
-        "High": 5,
-    }
-
     # This df contains numbers only. It is for the heatmap.
     eh_grid = eh_display.copy()
     eh_grid["Vulnerability Category"] = eh_display["Vulnerability Category"].replace(vulnerability_cat_to_num)
     eh_grid["Risk Category"] = eh_display["Risk Category"].replace(risk_cat_to_num)
     eh_grid.loc[:, ["Element", "Hazard"]] = 0
 
+    return eh_display, eh_grid
 
-    st.markdown("Agricultural elements and the hazards affecting them")
-    st.markdown("")
+def make_heatmap(eh_display, eh_grid):
+    """Plot a heatmap of the risk category values and return it as a PNG image in a BytesIO object."""
 
     # Use matplotlib inside a lock because it is not thread-safe.
     _lock = RendererAgg.lock
@@ -168,42 +189,34 @@ def barangay_summary_feature(mi_df, flat_df, db):
         # If the figure is used, the chart will have a different size depending on the height-width proportion.
         chart = BytesIO()
         fig.savefig(chart, format = "png")
-        st.image(chart)
 
-    st.markdown("---")
-    st.markdown("# Agricultural Element and Hazard")
-    st.markdown("Select an element and hazard for more details about how these affect the barangay.")
+        # Close the figure so that figures do not pile up in memory.
+        plt.close(fig)
 
-    element_select = st.selectbox(
-        label = "Element",
-        options = elements.unique(),
-    )
+    return chart
 
-    hazard_select = st.selectbox(
-        label = "Hazard",
-        options = eh_combos.loc[
-            eh_combos["Element"] == element_select,
-            "Hazard"
-        ]
-    )
-
-    st.markdown("## Risk of {} Against {}".format(element_select, hazard_select))
+def hash_summary_data(lgu_key, vintage, *keys):
+    """Return a hash of an LGU's database for one vintage and of the keys of a summary artifact, such as a barangay.
+This keys the disk cache of the summaries without hashing their DataFrames."""
 
+    db_hash = hash_files([get_vintage_db_path(read_lgu_registry()[lgu_key], vintage)])
+    return " ".join([db_hash] + [str(key) for key in keys])
 
+# Rendering a heatmap takes a while, so each one is kept in memory and on disk.
+# The heatmap only depends on the data and the barangay, so the frames are not hashed.
+@st.cache_data(ttl = None)
+def get_heatmap(lgu_key, vintage, barangay, _eh_display, _eh_grid):
+    return cached("heatmap", hash_summary_data(lgu_key, vintage, barangay), make_heatmap, _eh_display, _eh_grid)
 
-    # List of key categories
-    cat_list = [
-        "Degree Of Impact Category",
-        "Vulnerability Category",
-        "Risk Category",
-    ]
+def get_key_categories(orig_df, barangay, element_select, hazard_select):
+    """Return a Series of the key categories of a barangay for one element and hazard."""
 
     # Boolean masks
     correct_element = (orig_df.columns.get_level_values("Element") == element_select)
     correct_hazard = (orig_df.columns.get_level_values("Hazard") == hazard_select)
 
     category_cols = (
-        correct_element 
+        correct_element
         & correct_hazard
         & pd.Series(orig_df.columns.get_level_values("Detail")).isin(cat_list).tolist()
     )
@@ -221,21 +234,28 @@ def barangay_summary_feature(mi_df, flat_df, db):
 
     key_categories = key_categories.loc[cat_list] # Reorder by label
 
-    st.markdown("### Key Categories")
-    st.dataframe(key_categories)
+    return key_categories
 
-    # Help box
-    with st.expander("Info on Categories", expanded = False):
-        st.markdown("""- Degree of Impact Category: This describes how greatly the element would be impacted if the hazard occurred. In other words, it describes potential damage.
+def get_brgy_percentile(col, barangay):
+    """Take a Series of scores and a barangay name, which is part of the Series index.
+Return the percentile of the barangay's score as a string."""
+    col = col.dropna()
+    num_brgys = len(col)
 
-- Vulnerability Category: This describes Degree of Impact while taking Adaptive Capacity into account. Vulnerability is lower if the barangay has better resources to prevent damage or recover from it.
+    barangay_value = col[barangay]
+    percentile = sum(col <= barangay_value) / num_brgys * 100
+    percentile = str(round(percentile, 2))
 
-- Risk Category: This describes how likely it is for the hazard to occur in the barangay, as well as how severe the consequence of the hazard may be.""")
-    
+    return percentile, num_brgys
 
-    # From here, we prepare to get the key scores.
+def get_key_scores(orig_df, barangay, element_select, hazard_select):
+    """Return a DataFrame of the key scores of a barangay and their percentiles,
+as well as a DataFrame of the key score columns of all barangays."""
 
     # Boolean masks
+    correct_element = (orig_df.columns.get_level_values("Element") == element_select)
+    correct_hazard = (orig_df.columns.get_level_values("Hazard") == hazard_select)
+
     hazard_specific_scores = correct_hazard & (
         pd.Series(orig_df.columns.get_level_values("Detail"))
         .isin([
@@ -278,18 +298,6 @@ def barangay_summary_feature(mi_df, flat_df, db):
 
     # Get percentile of selected barangay with respect to other barangays
 
-    def get_brgy_percentile(col, barangay):
-        """Take a Series of scores and a barangay name, which is part of the Series index.
-    Return the percentile of the barangay's score as a string."""
-        col = col.dropna()
-        num_brgys = len(col)
-
-        barangay_value = col[barangay]
-        percentile = sum(col <= barangay_value) / num_brgys * 100
-        percentile = str(round(percentile, 2))
-
-        return percentile, num_brgys
-
     percentile_rows = []
     for col_name in key_score_cols.columns:
         col = key_score_cols[col_name].copy()
@@ -309,18 +317,6 @@ def barangay_summary_feature(mi_df, flat_df, db):
         axis = 1,
     )
 
-    # List of ll possible score labels. This is here for ordering the df rows.
-    all_score_labels = [
-        "Likelihood Of Occurrence",
-        "Exposure Score",
-        "Sensitivity Score",
-        "Degree Of Impact Score",
-        "Adaptive Capacity Score",
-        "Vulnerability Score",
-        "Severity Of Consequence Score",
-        "Risk Score",
-    ]
-
     # For scores that are missing for some reason, set their value to Unknown.
 
     for score_name in all_score_labels:
@@ -334,9 +330,212 @@ def barangay_summary_feature(mi_df, flat_df, db):
 
     key_score_df = key_score_df.loc[all_score_labels]
 
+    return key_score_df, key_score_cols
+
+def get_bin_step(span, max_bins = MAX_HISTOGRAM_BINS):
+    """Return a bin width of 1, 2, or 5 times a power of 10 that splits span into at most max_bins bins,
+like the bins that Vega-Lite makes in the browser."""
+
+    if span <= 0:
+        return 1
+
+    raw_step = span / max_bins
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+
+    for multiple in [1, 2, 5, 10]:
+        if multiple * magnitude >= raw_step:
+            return multiple * magnitude
+
+def make_score_bins(key_score_cols, max_bins = MAX_HISTOGRAM_BINS):
+    """Return the histogram bins of every key score in one DataFrame,
+with the columns Score, Bin Start, Bin End, and Count."""
+
+    bin_frames = []
+
+    for score_name in key_score_cols.columns:
+        values = key_score_cols[score_name].dropna().to_numpy(dtype = float)
+
+        if len(values) == 0:
+            continue
+
+        step = get_bin_step(values.max() - values.min(), max_bins)
+        start = math.floor(values.min() / step) * step
+        # The highest value starts a bin of its own, as in Vega-Lite.
+        num_bins = math.floor((values.max() - start) / step) + 1
+        # Round off floating point errors, such as 2.7000000000000002, which would show in the tooltips.
+        edges = np.round(start + step * np.arange(num_bins + 1), 12)
+
+        counts, edges = np.histogram(values, bins = edges)
+
+        bin_frames.append(pd.DataFrame({
+            "Score": score_name,
+            "Bin Start": edges[:-1],
+            "Bin End": edges[1:],
+            "Count": counts,
+        }))
+
+    return pd.concat(bin_frames, ignore_index = True)
+
+# The bins only depend on the data, the element, and the hazard, so they are shared by all barangays
+# and the frame is not hashed.
+@st.cache_data(ttl = None)
+def get_score_bins(lgu_key, vintage, element, hazard, _key_score_cols):
+    return cached("score_bins", hash_summary_data(lgu_key, vintage, element, hazard), make_score_bins, _key_score_cols)
+
+def make_histogram_template():
+    """Make the chart of a score histogram with a red line marking the selected barangay's score.
+The chart refers to its data by name, so one chart serves as the template of all scores."""
+
+    # Histogram layer
+    hist = (
+        alt.Chart(alt.NamedData(name = "score_bins"))
+        .mark_bar()
+        .encode(
+            x = alt.X(
+                "Bin Start",
+                type = "quantitative",
+                bin = "binned",
+            ),
+            x2 = "Bin End",
+            y = alt.Y(
+                "Count",
+                type = "quantitative",
+                title = "Count",
+            ),
+        )
+    )
+
+    # Red line layer
+    line = (
+        alt.Chart(alt.NamedData(name = "score_value"))
+        .mark_rule(
+            color = "red",
+            size = 5,
+        )
+        .encode(
+            x = alt.X("Bin Start", type = "quantitative"),
+        )
+    )
+
+    # Combined layers
+    chart = (
+        (hist + line)
+        .properties(height = 200)
+    )
+
+    return chart
+
+# Altair validates the spec against the Vega-Lite schema, which takes far longer than
+# building it. The template is validated once per process and only copied afterwards.
+@st.cache_resource
+def get_histogram_template():
+    return make_histogram_template().to_dict()
+
+def make_histogram_specs(key_score_df, score_bins, template):
+    """Return a dict of the Vega-Lite specs of the score histograms, by score name.
+Each spec is a copy of the template with the bins of one score. Scores that are Unknown have no spec."""
+
+    specs = {}
+
+    for score_name, score_value in key_score_df.loc[key_score_df["Score"] != "Unknown", "Score"].items():
+        spec = copy.deepcopy(template)
+        spec["layer"][0]["encoding"]["x"]["title"] = score_name
+
+        bins = score_bins.loc[score_bins["Score"] == score_name, ["Bin Start", "Bin End", "Count"]]
+        spec["datasets"] = {
+            "score_bins": bins.to_dict(orient = "records"),
+            "score_value": [{"Bin Start": score_value}],
+        }
+
+        specs[score_name] = spec
+
+    return specs
+
+def barangay_summary_feature(mi_df, flat_df, db, lgu, vintage = None):
+    """Barangay Data Summary feature."""
+
+    # Make a hierarchically labeled DataFrame again.
+    orig_df = make_hierarchical(flat_df, mi_df)
+
+    st.title("Barangay Data Summaries")
+    st.markdown("""This feature lets you select one barangay and get a summary of the most important data on agricultural disaster risk. Select a barangay from the options, or search for one by typing inside the box.""")
+    st.caption("Only barangays where data is available can be selected.")
+
+    # This only contains the barangays in the Sparta open data,
+    # and not the ones from GADM.
+    open_data_barangays = flat_df["(Barangay)"].tolist()
+
+    # Let the user select a barangay.
+    barangay = st.selectbox(
+        label = "Select barangay",
+        options = open_data_barangays,
+    )
+
+    # Geological areas affected by hazards
+    geo_areas_list = get_geo_areas(orig_df, barangay)
+
+    # Join the list into a string to be displayed on screen.
+    geo_areas_str = "- " + "\n- ".join(geo_areas_list)
+    geo_message = "Geological areas affected by hazards\n" + geo_areas_str
+
+    st.markdown(geo_message)
+
+    #---
+    # Identify the element-hazard combinations of the barangay.
+    eh_combos = get_eh_categories(orig_df, db, barangay)
+
+    # Create separate Series of elements and hazards.
+    # This is done after dropping rows with nulls in Vulnerability Category and Risk Category.
+    elements = eh_combos["Element"].copy()
+    hazards = eh_combos["Hazard"].copy()
+
+    eh_display, eh_grid = make_heatmap_frames(eh_combos)
+
+    st.markdown("Agricultural elements and the hazards affecting them")
+    st.markdown("")
+
+    chart = get_heatmap(lgu["key"], vintage, barangay, eh_display, eh_grid)
+    st.image(chart)
+
+    st.markdown("---")
+    st.markdown("# Agricultural Element and Hazard")
+    st.markdown("Select an element and hazard for more details about how these affect the barangay.")
+
+    element_select = st.selectbox(
+        label = "Element",
+        options = elements.unique(),
+    )
+
+    hazard_select = st.selectbox(
+        label = "Hazard",
+        options = eh_combos.loc[
+            eh_combos["Element"] == element_select,
+            "Hazard"
+        ]
+    )
+
+    st.markdown("## Risk of {} Against {}".format(element_select, hazard_select))
+
+    key_categories = get_key_categories(orig_df, barangay, element_select, hazard_select)
+
+    st.markdown("### Key Categories")
+    st.dataframe(key_categories)
+
+    # Help box
+    with st.expander("Info on Categories", expanded = False):
+        st.markdown("""- Degree of Impact Category: This describes how greatly the element would be impacted if the hazard occurred. In other words, it describes potential damage.
+
+- Vulnerability Category: This describes Degree of Impact while taking Adaptive Capacity into account. Vulnerability is lower if the barangay has better resources to prevent damage or recover from it.
+
+- Risk Category: This describes how likely it is for the hazard to occur in the barangay, as well as how severe the consequence of the hazard may be.""")
+
+
+    # From here, we prepare to get the key scores.
+    key_score_df, key_score_cols = get_key_scores(orig_df, barangay, element_select, hazard_select)
+
     # Display message and df of scores and percentiles.
     st.markdown("""### Key Scores""")
-   
+
     st.dataframe(key_score_df)
 
     # Help box
@@ -357,6 +556,10 @@ For each score, a percentile is given in comparison to other barangays (where ap
 
         st.markdown("The red line in each histogram represents the score of {}.\n\n---".format(barangay))
 
+        # Build all histograms before showing them, so that they appear together.
+        score_bins = get_score_bins(lgu["key"], vintage, element_select, hazard_select, key_score_cols)
+        histogram_specs = make_histogram_specs(key_score_df, score_bins, get_histogram_template())
+
         # Make a 4 x 2 grid of histograms for the 8 scores.
         for grid_row in range(4):
             grid_columns = st.columns(2)
@@ -368,7 +571,7 @@ For each score, a percentile is given in comparison to other barangays (where ap
 
             for score_name, row in df_part.iterrows():
                 col_num += 1
-                
+
                 with grid_columns[col_num]:
                     score_value = row["Score"]
                     perc = "{}%".format(row["Percentile"])
@@ -377,50 +580,10 @@ For each score, a percentile is given in comparison to other barangays (where ap
                         score_display = "Unknown"
                     else:
                         score_display = round(score_value, 2)
-                    
+
 
                     st.markdown("{}: {}".format(score_name, score_display))
                     st.metric("Percentile", perc)
 
                     if score_value != "Unknown":
-
-                        # Histogram layer
-                        hist = (
-                            alt.Chart(key_score_cols)
-                            .mark_bar()
-                            .encode(
-                                x = alt.X(
-                                    score_name,
-                                    type = "quantitative",
-                                    title = score_name,
-                                    bin = True,
-                                ),
-                                y = alt.Y(
-                                    "count()",
-                                    title = "Count",
-                                ),
-                            )
-                        )
-
-                        # Red line layer
-                        line = (
-                            alt.Chart(key_score_cols)
-                            .mark_rule(
-                                color = "red",
-                                size = 5,
-                            )
-                            .encode(
-                                x = alt.X(score_name),
-                            )
-                            .transform_filter(
-                                alt.datum[score_name] == score_value
-                            )
-                        )
-
-                        # Combined layers
-                        chart = (
-                            (hist + line)
-                            .properties(height = 200)
-                        )
-
-                        st.altair_chart(chart, use_container_width = True)
\ No newline at end of file
+                        st.vega_lite_chart(histogram_specs[score_name], use_container_width = True)
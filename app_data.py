@@ -0,0 +1,321 @@
+"""
+Functions that load and assemble the app's data.
+"""
+
+import os
+
+import pandas as pd
+import geopandas as gpd
+import streamlit as st
+
+from lgu_registry import read_lgu_registry, BASE_VINTAGE
+from spatial_index import BarangayIndex
+from label_registry import encode_labels, make_flat_keys
+from vintage_store import VintageStore
+from shared_data import attach_data
+from dataset import Dataset
+from disk_cache import cached, hash_files
+from barangay_gazetteer import bids_to_names
+from sqlite_database import is_sqlite_path, read_sqlite_database, write_sqlite_database
+
+# Default locations of the data files, used by scripts that run without the app.
+DB_PATH = "./cleaning_outputs/divided_database.xlsx"
+GEO_PATH = "./geodata/gadm_butuan_city_barangays.gpkg"
+
+# Maximum number of LGUs whose data is kept in the cache of one process.
+# When the cache is full, the least recently used LGU is evicted.
+MAX_CACHED_LGUS = int(os.environ.get("AGRIHANDA_MAX_CACHED_LGUS", 4))
+
+# Maximum number of vintages of each LGU whose data is kept in the cache of one process.
+MAX_CACHED_VINTAGES = int(os.environ.get("AGRIHANDA_MAX_CACHED_VINTAGES", 4))
+
+# If this is 1, the data is read from shared memory, where it was published by shared_data.py,
+# instead of being loaded by each process.
+USE_SHARED_DATA = os.environ.get("AGRIHANDA_SHARED_DATA") == "1"
+
+# Hierarchy labels of the row representing the Barangay variable.
+BRGY_DCT = {
+    "Sector": "(Barangay)",
+    "Element": "None",
+    "Hazard": "None",
+    "Disaster Risk Aspect": "None",
+    "Detail": "None",
+}
+
+# Categories of Degree of Impact, Vulnerability, and Risk, from lowest to highest.
+SCORE_CATEGORIES = ["Low", "Medium Low", "Medium", "Medium High", "High"]
+RISK_CATEGORIES = ["Low Risk", "Moderate Risk", "High Risk", "Very High Risk"]
+
+# Categorical types shared by all columns with the same values, so that each set of categories is stored once.
+YES_NO_DTYPE = pd.CategoricalDtype(["No", "Yes"])
+SCORE_CATEGORY_DTYPE = pd.CategoricalDtype(SCORE_CATEGORIES, ordered = True)
+CATEGORY_DTYPES = {
+    "Degree Of Impact Category": SCORE_CATEGORY_DTYPE,
+    "Vulnerability Category": SCORE_CATEGORY_DTYPE,
+    "Risk Category": pd.CategoricalDtype(RISK_CATEGORIES, ordered = True),
+}
+
+def read_database(db_path = DB_PATH):
+    """Read all sheets of the divided database into a dict of DataFrames.
+The database is an Excel file, a folder with one Parquet file per sheet, or a SQLite file."""
+
+    if is_sqlite_path(db_path):
+        db = read_sqlite_database(db_path)
+
+    elif os.path.isdir(db_path):
+        library = pd.read_parquet(os.path.join(db_path, "library.parquet"))
+        sheet_names = ["library", "barangay_id"] + library["SID"].astype(str).tolist()
+        sheet_paths = {sheet_name: os.path.join(db_path, "{}.parquet".format(sheet_name)) for sheet_name in sheet_names}
+
+        # Missing sheets are left out, as in an Excel file, so that validate_data.py can report them.
+        db = {
+            sheet_name: pd.read_parquet(sheet_path)
+            for sheet_name, sheet_path in sheet_paths.items()
+            if os.path.exists(sheet_path)
+        }
+
+    else:
+        db = pd.read_excel(
+            db_path,
+            # Get all sheets
+            sheet_name = None,
+        )
+
+    return db
+
+def write_database(db, db_path):
+    """Write a dict of DataFrames to an Excel file, to a SQLite file if db_path ends with .sqlite or .db,
+or to a folder of Parquet files otherwise."""
+
+    if is_sqlite_path(db_path):
+        write_sqlite_database(db, db_path)
+
+    elif db_path.endswith(".xlsx"):
+        with pd.ExcelWriter(path = db_path) as writer:
+            for sid, sheet in db.items():
+                sheet.to_excel(
+                    writer,
+                    sheet_name = sid,
+                    index = False,
+                )
+
+    else:
+        if not os.path.exists(db_path):
+            os.makedirs(db_path)
+
+        for sid, sheet in db.items():
+            sheet.to_parquet(
+                os.path.join(db_path, "{}.parquet".format(sid)),
+                index = False,
+            )
+
+def make_mi_df(db):
+    """Make a DataFrame where each row holds the hierarchy labels of one variable."""
+
+    mi_df_rows = []
+
+    # Add a row representing the Barangay variable.
+    brgy_row = pd.Series(
+        BRGY_DCT,
+        name = 0,
+    )
+
+    mi_df_rows.append(brgy_row)
+
+    for index, row in db["library"].iterrows():
+        first_four = row.loc[["Sector", "Element", "Hazard", "Disaster Risk Aspect"]]
+        sid = str(row["SID"])
+
+        # Get sheet associated with row. Do not include BID column.
+        sheet = db[sid].drop("BID", axis = 1)
+
+        # Make new rows showing the sheet's column names.
+        for detail_col in sheet.columns:
+            new_row = first_four.copy()
+            new_row["Detail"] = detail_col
+            mi_df_rows.append(new_row)
+
+    mi_df = pd.DataFrame(mi_df_rows).reset_index(drop = True)
+
+    return mi_df
+
+def make_flat_df(db):
+    """Combine the data sheets into one DataFrame with flattened hierarchical column names."""
+
+    flat_df = pd.DataFrame()
+
+    bid_tuple = tuple(BRGY_DCT.values())
+
+    for index, row in db["library"].iterrows():
+        first_four = row.loc[["Sector", "Element", "Hazard", "Disaster Risk Aspect"]]
+        sid = str(row["SID"])
+
+        sheet = db[sid].copy()
+
+        # Add MultiIndex
+        mi_rows = []
+
+        for col in sheet.columns:
+            if col == "BID":
+                new_mi_row = BRGY_DCT
+            else:
+                new_mi_row = {}
+                for i, item in first_four.items():
+                    new_mi_row[i] = item
+                new_mi_row["Detail"] = col
+            mi_rows.append(new_mi_row)
+
+        mi_rows_df = pd.DataFrame(mi_rows)
+
+        sheet.columns = pd.MultiIndex.from_frame(mi_rows_df)
+
+        if sid == "0":
+            flat_df = sheet.copy()
+        else:
+            flat_df = flat_df.merge(
+                sheet,
+                how = "outer",
+                # Put BID column tuple inside another tuple
+                # Otherwise, each item in the initial tuple is considered a separate column
+                on = (bid_tuple,),
+            )
+
+    flat_df[bid_tuple] = bids_to_names(flat_df[bid_tuple], db["barangay_id"])
+
+    flat_df.columns = ["/".join(tup) for tup in flat_df.columns]
+
+    flat_df = flat_df.rename(columns = {"(Barangay)/None/None/None/None": "(Barangay)"})
+
+    return flat_df
+
+def encode_columns(flat_df):
+    """Store the text columns of flat_df as categoricals, which use less memory than strings.
+
+Category columns, such as Risk Category, get ordered categories. Yes/No columns share one type.
+Other text columns get categories of their own. The (Barangay) column is kept as text."""
+
+    encoded = {}
+
+    for col in flat_df.columns:
+        if col == "(Barangay)" or flat_df[col].dtype != object:
+            continue
+
+        values = set(flat_df[col].dropna().unique())
+        detail = col.split("/")[-1]
+
+        if detail in CATEGORY_DTYPES and values <= set(CATEGORY_DTYPES[detail].categories):
+            encoded[col] = flat_df[col].astype(CATEGORY_DTYPES[detail])
+        elif values <= {"Yes", "No"}:
+            encoded[col] = flat_df[col].astype(YES_NO_DTYPE)
+        elif all(isinstance(value, str) for value in values):
+            encoded[col] = flat_df[col].astype("category")
+
+    return flat_df.assign(**encoded)
+
+def assemble_data(db):
+    """Make mi_df and flat_df from the sheets of a database."""
+
+    mi_df = encode_labels(make_mi_df(db))
+    flat_df = encode_columns(make_flat_df(db))
+
+    # Use the keys built from the label registry, so that each key is one shared string.
+    # Each column is matched by its own name, not by its position, since the columns of flat_df
+    # do not have to be in the order of mi_df, for example if BID is not the first column of a sheet.
+    # They are not reordered: a Dataset groups them by type anyway, and make_hierarchical() matches them by name.
+    flat_keys = {key: key for key in make_flat_keys(mi_df)}
+
+    unknown = [col for col in flat_df.columns if col not in flat_keys]
+    if len(unknown) > 0:
+        raise ValueError("Columns of flat_df that are not in mi_df: {}".format(unknown))
+
+    flat_df.columns = [flat_keys[col] for col in flat_df.columns]
+
+    return mi_df, flat_df
+
+def load_data(db_path = DB_PATH, geo_path = GEO_PATH):
+    """Load the data without using Streamlit's cache. This is also used by scripts that run without a browser."""
+
+    db = read_database(db_path)
+    mi_df, flat_df = assemble_data(db)
+
+    gdf = gpd.read_file(geo_path)
+
+    return mi_df, flat_df, db, gdf
+
+def load_lgu_data(lgu):
+    """Load the data of an LGU like load_data(). The assembled data is kept in the disk cache,
+so it is only assembled again when the data files or the code change."""
+    return cached("data", hash_files([lgu["db_path"], lgu["geo_path"]]), load_data, lgu["db_path"], lgu["geo_path"])
+
+def read_and_assemble(db_path):
+    """Read a database and make mi_df and flat_df from it. Return db, mi_df, and flat_df."""
+
+    db = read_database(db_path)
+    mi_df, flat_df = assemble_data(db)
+
+    return db, mi_df, flat_df
+
+# The dataset is cached as a resource, so it is loaded once per process and never copied.
+# Each LGU is cached separately, so a session only loads the partition of the LGU it selects.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS)
+def get_dataset(lgu_key):
+    if USE_SHARED_DATA:
+        try:
+            return Dataset(*attach_data(lgu_key), frozen = True)
+        except FileNotFoundError:
+            # The LGU was not published, for example because the loader is not running. Load it here instead.
+            pass
+
+    return Dataset(*load_lgu_data(read_lgu_registry()[lgu_key]))
+
+def get_data(lgu_key):
+    """Return mi_df, flat_df, db, and gdf of an LGU.
+These are views of the LGU's Dataset: they share its read-only arrays, so they are cheap to make on every rerun."""
+    return get_dataset(lgu_key).views()
+
+def load_vintages(lgu, base_data = None):
+    """Load all vintages of an LGU's data into a VintageStore.
+base_data is the output of load_data() for the base vintage, if it was already loaded."""
+
+    if base_data is None:
+        base_data = load_lgu_data(lgu)
+
+    store = VintageStore(lgu.get("vintage", BASE_VINTAGE), *base_data)
+
+    for vintage in lgu.get("vintages", []):
+        db, mi_df, flat_df = cached("vintage", hash_files([vintage["db_path"]]), read_and_assemble, vintage["db_path"])
+        store.add_vintage(vintage["name"], mi_df, flat_df, db)
+
+    return store
+
+# The vintage store is cached as a resource because it is built once and only read afterwards.
+# It holds the base vintage and the changed columns of the others, instead of a copy of each vintage.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS)
+def get_vintage_store(lgu_key):
+    return load_vintages(read_lgu_registry()[lgu_key], get_data(lgu_key))
+
+# Each vintage is cached as a read-only Dataset, like the base vintage, so it is only built once per process
+# and every rerun gets views of it.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS * MAX_CACHED_VINTAGES)
+def get_vintage_dataset(lgu_key, vintage):
+    lgu = read_lgu_registry()[lgu_key]
+
+    if vintage is None or vintage == lgu.get("vintage", BASE_VINTAGE):
+        return get_dataset(lgu_key)
+
+    return Dataset(*get_vintage_store(lgu_key).get_vintage(vintage))
+
+def get_vintage_data(lgu_key, vintage = None):
+    """Return the data of an LGU for one vintage, in the same form as get_data().
+These are views of the vintage's Dataset. The base vintage's Dataset is the one of get_data()."""
+    return get_vintage_dataset(lgu_key, vintage).views()
+
+def get_vintage_catalogue(lgu_key, vintage = None):
+    """Return the column catalogue of the flat_df of an LGU for one vintage. See column_catalogue.py."""
+    return get_vintage_dataset(lgu_key, vintage).catalogue
+
+# The spatial index is cached as a resource because it is built once and only read afterwards.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS)
+def get_barangay_index(lgu_key):
+    mi_df, flat_df, db, gdf = get_data(lgu_key)
+    return BarangayIndex(gdf)
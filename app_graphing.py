@@ -3,8 +3,122 @@ import streamlit as st
 
 # Import custom function
 from app_select_variable import selection_help_box, selection_feature
+from column_catalogue import get_column_info
 
-def graphing_feature(mi_df, flat_df):
+def make_display_table(flat_df, var_list):
+    """Return the table of the selected variables, sorted by the first variable."""
+
+    # Sort the first variable alone, then take the rows of all variables in that order at once.
+    order = flat_df[var_list[0]].sort_values().index
+    display_table = flat_df.loc[order, var_list]
+
+    return display_table
+
+def get_sort_order(catalogue, label):
+    """Return the categories of an ordered variable, such as Risk Category, from lowest to highest.
+Other variables, and aggregates such as count(), keep Altair's default order."""
+
+    if label in catalogue.index:
+        categories = get_column_info(catalogue, label)["categories"]
+        if categories is not None:
+            return categories
+
+    return alt.Undefined
+
+def make_chart(flat_df, catalogue, var_list, mark_type, x_label, x_encoding, y_label, y_encoding, height_px, show_points = False, bin_x = False):
+    """Make an Altair chart of the selected variables."""
+
+    num_vars = len(var_list)
+
+    subset = var_list.copy()
+
+    if "(Barangay)" not in subset:
+        subset.append("(Barangay)")
+
+    flat_df_subset = flat_df[subset].dropna() # Drop rows with nulls
+
+    # Make the chart object
+    chart = alt.Chart(flat_df_subset)
+
+    if mark_type == "Area":
+        chart = chart.mark_area(point = show_points)
+
+    elif mark_type == "Bar":
+        chart = chart.mark_bar()
+
+    elif mark_type == "Boxplot":
+        chart = chart.mark_boxplot(ticks = True)
+        # Set ticks to true so that even very short ranges, or single values, can be seen.
+
+    elif mark_type == "Line":
+        chart = chart.mark_line(point = show_points)
+
+    elif mark_type == "Point":
+        chart = chart.mark_point()
+
+    # Use Detail level as title.
+    x_title = x_label.split("/")[-1]
+
+    chart = chart.encode(
+        x = alt.X(
+            shorthand = x_label,
+            type = x_encoding,
+            bin = bin_x,
+            title = x_title,
+            sort = get_sort_order(catalogue, x_label),
+        ),
+    )
+
+    # List of variables to show in the tooltip
+    tooltip_list = []
+    if "(Barangay)" not in var_list:
+        tooltip_list.append(
+            alt.Tooltip("(Barangay)", type = "nominal")
+        )
+
+    tooltip_list.append(
+        alt.Tooltip(x_label, type = x_encoding, title = x_title)
+    )
+
+    # Do not encode the y variable if the chart is a univariate boxplot.
+    # This is done in order to avoid an error.
+    if not (mark_type == "Boxplot" and num_vars == 1):
+
+        # Use Detail level as title.
+        y_title = y_label.split("/")[-1]
+
+        chart = chart.encode(
+            y = alt.Y(
+                shorthand = y_label,
+                type = y_encoding,
+                title = y_title,
+                sort = get_sort_order(catalogue, y_label),
+            ),
+        )
+
+        tooltip_list.append(
+            alt.Tooltip(y_label, type = y_encoding, title = y_title)
+        )
+
+    # Do not use a tooltip if the graph is a univariate histogram.
+    # When a tooltip is used, the histogram is not drawn properly.
+    if not bin_x:
+        chart = chart.encode(
+            tooltip = tooltip_list
+        )
+
+    chart = (
+        chart
+        .properties(
+            title = "Chart Type: " + mark_type,
+            height = height_px,
+        )
+        .interactive()
+    )
+
+    return chart
+
+def graphing_feature(mi_df, flat_df, catalogue):
     """Graphing feature of app."""
 
     st.title("Graphing Tool")
@@ -48,12 +162,12 @@ def graphing_feature(mi_df, flat_df):
     cols = st.columns(num_vars)
 
     with cols[0]:
-        x_label, x_dtype, x_encoding = selection_feature(mi_df, flat_df, var_name = "x")
+        x_label, x_dtype, x_encoding = selection_feature(mi_df, flat_df, catalogue, var_name = "x")
         var_list = [x_label]
 
     if num_vars == 2:
         with cols[1]:
-            y_label, y_dtype, y_encoding = selection_feature(mi_df, flat_df, var_name = "y")
+            y_label, y_dtype, y_encoding = selection_feature(mi_df, flat_df, catalogue, var_name = "y")
             var_list.append(y_label)
     else:
         y_label = "count()"
@@ -76,10 +190,7 @@ def graphing_feature(mi_df, flat_df):
     )
 
     with table_expander:
-        display_table = (
-            flat_df[var_list].copy()
-            .sort_values(var_list[0])
-        )
+        display_table = make_display_table(flat_df, var_list)
 
         if st.checkbox("Remove null values"):
             display_table = display_table.dropna()
@@ -129,22 +240,12 @@ def graphing_feature(mi_df, flat_df):
             st.warning("Warning: You have selected a boxplot. Please ensure that at least one variable has both Numerical data type and Quantitative encoding type.")
             st.stop()
 
-        subset = var_list.copy()
-        
-        if "(Barangay)" not in subset:
-            subset.append("(Barangay)")
-        
-        flat_df_subset = flat_df[subset].dropna() # Drop rows with nulls
-
-        # Make the chart object
-        chart = alt.Chart(flat_df_subset)
-
-        # Whether to bin the x axis.
+        # Options that depend on the mark type.
+        show_points = False
         bin_x = False
 
-        if mark_type == "Area":
+        if mark_type in ["Area", "Line"]:
             show_points = st.checkbox("Show points on chart")
-            chart = chart.mark_area(point = show_points)
 
         elif mark_type == "Bar":
             if num_vars == 1 and x_encoding == "quantitative":
@@ -153,75 +254,18 @@ def graphing_feature(mi_df, flat_df):
                     value = True,
                 )
 
-            chart = chart.mark_bar()
-
-        elif mark_type == "Boxplot":
-            chart = chart.mark_boxplot(ticks = True)
-            # Set ticks to true so that even very short ranges, or single values, can be seen.
-
-        elif mark_type == "Line":
-            show_points = st.checkbox("Show points on chart")
-            chart = chart.mark_line(point = show_points)
-
-        elif mark_type == "Point":
-            chart = chart.mark_point()
-
-        # Use Detail level as title.
-        x_title = x_label.split("/")[-1]
-
-        chart = chart.encode(
-            x = alt.X(
-                shorthand = x_label,
-                type = x_encoding,
-                bin = bin_x,
-                title = x_title,
-            ),
-        )
-
-        # List of variables to show in the tooltip
-        tooltip_list = []
-        if "(Barangay)" not in var_list:
-            tooltip_list.append(
-                alt.Tooltip("(Barangay)", type = "nominal")
-            )
-
-        tooltip_list.append(
-            alt.Tooltip(x_label, type = x_encoding, title = x_title)
-        )
-
-        # Do not encode the y variable if the chart is a univariate boxplot.
-        # This is done in order to avoid an error.
-        if not (mark_type == "Boxplot" and num_vars == 1):
-            
-            # Use Detail level as title.
-            y_title = y_label.split("/")[-1]
-
-            chart = chart.encode(
-                y = alt.Y(
-                    shorthand = y_label,
-                    type = y_encoding,
-                    title = y_title,
-                ),
-            )
-
-            tooltip_list.append(
-                alt.Tooltip(y_label, type = y_encoding, title = y_title)
-            )
-
-        # Do not use a tooltip if the graph is a univariate histogram.
-        # When a tooltip is used, the histogram is not drawn properly.
-        if not bin_x:
-            chart = chart.encode(
-                tooltip = tooltip_list
-            )
-
-        chart = (
-            chart
-            .properties(
-                title = "Chart Type: " + mark_type,
-                height = height_px,
-            )
-            .interactive()
+        chart = make_chart(
+            flat_df,
+            catalogue,
+            var_list,
+            mark_type,
+            x_label,
+            x_encoding,
+            y_label,
+            y_encoding,
+            height_px,
+            show_points = show_points,
+            bin_x = bin_x,
         )
 
         st.altair_chart(chart, use_container_width = True)
\ No newline at end of file
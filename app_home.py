@@ -7,14 +7,16 @@ def home_feature():
 
 Use the buttons in the sidebar on the left to navigate the app. If this is your first time, we recommend reading the "Help: Variable Selection" page first.
 
-After that, you can use the 3 main features:
+After that, you can use the 4 main features:
 
 - Map of Butuan City
     - A map of Butuan city's barangays is shown. Select an agricultural variable to create a choropleth map where the barangays are colored based on value.
 - Barangay Data Summaries
     - Select a barangay to see a summary of its agricultural disaster risk. This includes key risk categories and scores for specific elements and hazards.
 - Graphing Tool
-    - Select a chart type, agricultural variables, and other options to make an interactive chart with tooltips."""
+    - Select a chart type, agricultural variables, and other options to make an interactive chart with tooltips.
+- Scenario Comparison
+    - Change component scores, such as Adaptive Capacity Scores, and see how vulnerability and risk would change on a map."""
 
     team_text = """## The Team
 
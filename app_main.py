@@ -4,122 +4,19 @@ Main script for the app.
 
 # Note: use streamlit_env, not base.
 
-import pandas as pd
-import geopandas as gpd
 import streamlit as st
 
 # Import from local scripts
+from app_data import get_vintage_data, get_vintage_catalogue
+from lgu_registry import read_lgu_registry, get_vintage_names
 from app_graphing import graphing_feature
 from app_map import map_feature
 from app_barangay_summary import barangay_summary_feature
 from app_home import home_feature
+from app_scenarios import scenario_feature
+from app_vintages import vintage_comparison_feature
 from app_select_variable import selection_help_page
-
-# Cache the function that gets the data.
-@st.cache_data(ttl = None)
-def get_data():
-
-    db = pd.read_excel(
-        "./cleaning_outputs/divided_database.xlsx",
-        # Get all sheets
-        sheet_name = None,
-    )
-
-    # Generate mi_df
-    mi_df_rows = []
-
-    # Add a row representing the Barangay variable.
-    brgy_dct = {
-        "Sector": "(Barangay)",
-        "Element": "None",
-        "Hazard": "None",
-        "Disaster Risk Aspect": "None",
-        "Detail": "None",
-    }
-    brgy_row = pd.Series(
-        brgy_dct,
-        name = 0,
-    )
-    brgy_tuple = tuple(brgy_dct.values())
-
-    mi_df_rows.append(brgy_row)
-
-    for index, row in db["library"].iterrows():
-        first_four = row.loc[["Sector", "Element", "Hazard", "Disaster Risk Aspect"]]
-        sid = str(row["SID"])
-
-        # Get sheet associated with row. Do not include BID column.
-        sheet = db[sid].drop("BID", axis = 1)
-
-        # Make new rows showing the sheet's column names.
-        for detail_col in sheet.columns:
-            new_row = first_four.copy()
-            new_row["Detail"] = detail_col
-            mi_df_rows.append(new_row)
-
-    mi_df = pd.DataFrame(mi_df_rows).reset_index(drop = True)
-
-    # Generate flat_df
-    flat_df = pd.DataFrame()
-
-    bid_row = {
-            "Sector": "(Barangay)",
-            "Element": "None",
-            "Hazard": "None",
-            "Disaster Risk Aspect": "None",
-            "Detail": "None",
-        }
-
-    bid_tuple = tuple(bid_row.values())
-
-    for index, row in db["library"].iterrows():
-        first_four = row.loc[["Sector", "Element", "Hazard", "Disaster Risk Aspect"]]
-        sid = str(row["SID"])
-        
-        sheet = db[sid].copy()
-
-        # Add MultiIndex
-        mi_rows = []
-        sheet_num_cols = sheet.shape[1]
-
-        for col in sheet.columns:
-            if col == "BID":
-                new_mi_row = bid_row
-            else:
-                new_mi_row = {}
-                for i, item in first_four.items():
-                    new_mi_row[i] = item
-                new_mi_row["Detail"] = col
-            mi_rows.append(new_mi_row)
-
-        mi_rows_df = pd.DataFrame(mi_rows)
-
-        sheet.columns = pd.MultiIndex.from_frame(mi_rows_df)
-
-        if sid == "0":
-            flat_df = sheet.copy()
-        else:
-            flat_df = flat_df.merge(
-                sheet,
-                how = "outer",
-                # Put BID column tuple inside another tuple
-                # Otherwise, each item in the initial tuple is considered a separate column
-                on = (bid_tuple,),
-            )
-
-    bid_to_brgy = {}
-    for index, row in db["barangay_id"].iterrows():
-        bid_to_brgy[row["BID"]] = row["NAME_3"]
-
-    flat_df[bid_tuple] = flat_df[bid_tuple].replace(bid_to_brgy)
-
-    flat_df.columns = ["/".join(tup) for tup in flat_df.columns]
-
-    flat_df = flat_df.rename(columns = {"(Barangay)/None/None/None/None": "(Barangay)"})
-
-    gdf = gpd.read_file("./geodata/gadm_butuan_city_barangays.gpkg")
-
-    return mi_df, flat_df, db, gdf
+from validate_data import get_vintage_problems
 
 if __name__ == "__main__":
 
@@ -129,34 +26,80 @@ if __name__ == "__main__":
         initial_sidebar_state = "expanded",
     )
 
-    st.title("agriHanda :ear_of_rice:")
-    st.caption("Agricultural Disaster Risk App for Butuan City")
+    # Registry of the LGUs that can be selected.
+    lgu_registry = read_lgu_registry()
 
-    # Get the data.
-    mi_df, flat_df, db, gdf = get_data()
+    # Let the user select an LGU if there is more than one.
+    if len(lgu_registry) > 1:
+        with st.sidebar:
+            lgu_key = st.selectbox(
+                "LGU",
+                options = list(lgu_registry.keys()),
+                format_func = lambda key: lgu_registry[key]["name"],
+            )
+    else:
+        lgu_key = list(lgu_registry.keys())[0]
+
+    lgu = lgu_registry[lgu_key]
+
+    # Let the user select a vintage of the data if the LGU has more than one. The latest is selected by default.
+    vintage_names = get_vintage_names(lgu)
+    if len(vintage_names) > 1:
+        with st.sidebar:
+            vintage = st.selectbox("Data vintage", options = vintage_names, index = len(vintage_names) - 1)
+    else:
+        vintage = None
+
+    st.title("agriHanda :ear_of_rice:")
+    st.caption("Agricultural Disaster Risk App for {}".format(lgu["name"]) + (" ({} data)".format(vintage) if vintage else ""))
+
+    # Check the databases of the selected LGU and vintage before assembling them, and stop with a list
+    # of the errors if they are malformed, instead of failing while assembling the data or later in a feature.
+    problems = get_vintage_problems(lgu_key, vintage)
+    if (problems["severity"] == "error").any():
+        st.error("The data of {} did not pass validation. Run validate_data.py for details.".format(lgu["name"]))
+        st.dataframe(problems.loc[problems["severity"] == "error"])
+        st.stop()
+
+    # Get the data of the selected LGU and vintage.
+    mi_df, flat_df, db, gdf = get_vintage_data(lgu_key, vintage)
+    catalogue = get_vintage_catalogue(lgu_key, vintage)
+
+    features = [
+        "Home Page",
+        "Map",
+        "Barangay Data Summaries",
+        "Graphing Tool",
+        "Scenario Comparison",
+        "Help: Variable Selection"
+    ]
+
+    # The Vintage Comparison feature is only available for LGUs with more than one vintage.
+    if len(vintage_names) > 1:
+        features.insert(5, "Vintage Comparison")
 
     # Sidebar to choose which feature of the app to use.
     with st.sidebar:
         st.markdown("# App Features")
         feature = st.radio(
             "App Features",
-            [
-                "Home Page",
-                "Map of Butuan City",
-                "Barangay Data Summaries",
-                "Graphing Tool",
-                "Help: Variable Selection"
-            ],
+            features,
+            # Show the name of the LGU in the label of the map feature.
+            format_func = lambda option: "Map of {}".format(lgu["name"]) if option == "Map" else option,
             label_visibility = "hidden"
         )
 
     if feature == "Home Page":
         home_feature()
-    elif feature == "Map of Butuan City":
-        map_feature(mi_df, flat_df, gdf)
+    elif feature == "Map":
+        map_feature(mi_df, flat_df, db, gdf, catalogue, lgu)
     elif feature == "Barangay Data Summaries":
-        barangay_summary_feature(mi_df, flat_df, db)
+        barangay_summary_feature(mi_df, flat_df, db, lgu, vintage)
     elif feature == "Graphing Tool":
-        graphing_feature(mi_df, flat_df)
+        graphing_feature(mi_df, flat_df, catalogue)
+    elif feature == "Scenario Comparison":
+        scenario_feature(mi_df, flat_df, gdf, lgu, vintage)
+    elif feature == "Vintage Comparison":
+        vintage_comparison_feature(lgu)
     elif feature == "Help: Variable Selection":
-        selection_help_page(mi_df, flat_df)
\ No newline at end of file
+        selection_help_page(mi_df, flat_df, catalogue)
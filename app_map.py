@@ -1,16 +1,230 @@
+import os
+import json
+
 import pandas as pd
 import numpy as np
 import streamlit as st
+import altair as alt
 from PIL import Image
 import plotly.express as px
+import plotly.graph_objects as go
+
+from app_select_variable import selection_help_box, selection_feature, get_selectable_rows, get_level_options, narrow_down_level
+from app_barangay_summary import make_hierarchical, get_eh_categories
+from app_data import get_data, get_barangay_index, MAX_CACHED_LGUS
+from lgu_registry import get_map_view, read_lgu_registry
+from label_registry import find_siblings, make_flat_keys
+from column_catalogue import get_column_info
+from disk_cache import cached, hash_files
+
+# Number of maps in each row of the small multiples.
+PANEL_COLUMNS = 3
+
+def make_geojson(lgu_key):
+    """Encode the barangay boundaries of an LGU as GeoJSON."""
+    mi_df, flat_df, db, gdf = get_data(lgu_key)
+    return json.loads(gdf[["NAME_3", "geometry"]].to_json())
+
+# The GeoJSON of an LGU is encoded once and shared by all maps.
+# It is also kept in the disk cache until the LGU's geodata changes.
+@st.cache_data(ttl = None, max_entries = MAX_CACHED_LGUS)
+def get_geojson(lgu_key):
+    lgu = read_lgu_registry()[lgu_key]
+    return cached("geojson", hash_files([lgu["geo_path"]]), make_geojson, lgu_key)
+
+def make_map_figure(map_df, map_var, geojson, center, zoom):
+    """Make a Plotly choropleth map of one variable."""
+
+    # Get the text from the lowest level in the hierarchy.
+    map_detail = map_var.split("/")[-1]
+
+    fig = px.choropleth_mapbox(
+        map_df,
+        geojson = geojson,
+        featureidkey = "properties.NAME_3",
+        locations = "(Barangay)",
+        color = map_var,
+        color_continuous_scale = "Viridis",
+        range_color = None,
+        mapbox_style = "carto-positron",
+        zoom = zoom,
+        # Center the map on the LGU's coordinates.
+        center = center,
+        opacity = 0.5,
+        hover_name = "(Barangay)",
+        hover_data = [map_var],
+        # Shorten the chosen variable to just its Detail level
+        # when displaying it in the map.
+        labels = {map_var: map_detail},
+    )
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+    return fig
+
+def get_subtree_variables(mi_df, catalogue, element, hazard):
+    """Return the flat keys of the numerical variables under an element and hazard in the hierarchy."""
+
+    subtree = mi_df.loc[(mi_df["Element"] == element) & (mi_df["Hazard"] == hazard)]
+    labels = make_flat_keys(subtree)
+
+    is_number = catalogue.loc[labels, "data_type"] == "number"
+
+    return [label for label, number in zip(labels, is_number) if number]
+
+def make_switchable_map(flat_df, labels, geojson, center, zoom, active = 0):
+    """Make a Plotly map with a menu that switches between the variables in labels.
+
+The geometry is sent to the browser once, in the map's trace. Each option of the menu only holds
+the values of one variable, so switching variables does not need the server."""
+
+    # Barangays without data on any of the variables are left out of the table.
+    values = flat_df.set_index("(Barangay)")[labels].dropna(how = "all")
+
+    buttons = []
+    for label in labels:
+        # Label each option with its aspect and detail, since the element and hazard are the same for all.
+        aspect, detail = label.split("/")[-2:]
+        buttons.append(dict(
+            label = "{}: {}".format(aspect, detail),
+            method = "restyle",
+            args = [{
+                "z": [values[label].to_numpy()],
+                "colorbar.title.text": detail,
+                "hovertemplate": "<b>%{location}</b><br>" + detail + ": %{z}<extra></extra>",
+            }],
+        ))
+
+    active_detail = labels[active].split("/")[-1]
+
+    fig = go.Figure(go.Choroplethmapbox(
+        geojson = geojson,
+        featureidkey = "properties.NAME_3",
+        locations = values.index,
+        z = values[labels[active]].to_numpy(),
+        colorscale = "Viridis",
+        colorbar = dict(title = dict(text = active_detail)),
+        marker_opacity = 0.5,
+        hovertemplate = "<b>%{location}</b><br>" + active_detail + ": %{z}<extra></extra>",
+    ))
+    fig.update_layout(
+        mapbox_style = "carto-positron",
+        mapbox_zoom = zoom,
+        mapbox_center = center,
+        margin = {"r":0,"t":0,"l":0,"b":0},
+        updatemenus = [dict(buttons = buttons, active = active, x = 0, y = 1, xanchor = "left", yanchor = "top")],
+    )
+
+    return fig
+
+def make_small_multiples(flat_df, catalogue, labels, titles, geojson, panel_width = 220):
+    """Make a grid of Altair maps, one for each variable in labels, with the given titles.
+
+The grid is one faceted chart. The geometry is stored once in the chart's data and looked up by
+barangay name for every map. The values of all maps are taken from flat_df in one selection."""
+
+    names = [feature["properties"]["NAME_3"] for feature in geojson["features"]]
+
+    # Table with one row per map and barangay. Every barangay in the geodata is included,
+    # so that barangays without data are still drawn.
+    values = (
+        flat_df
+        .set_index("(Barangay)")[labels]
+        .reindex(names)
+        .set_axis(titles, axis = 1)
+        .rename_axis("barangay")
+        .reset_index()
+        .melt(id_vars = "barangay", var_name = "panel", value_name = "value")
+    )
+
+    # The chart refers to the geometry and the values by name.
+    # Both datasets are added to the chart once.
+    datasets = {
+        "barangay_shapes": geojson["features"],
+        "map_values": json.loads(values.to_json(orient = "records")),
+    }
+
+    info = get_column_info(catalogue, labels[0])
+    detail = labels[0].split("/")[-1]
+
+    if info["data_type"] == "number":
+        color = alt.Color("value", type = "quantitative", title = detail)
+    elif info["encoding"] == "ordinal":
+        # Keep categories such as Low Risk to Very High Risk in order.
+        color = alt.Color("value", type = "ordinal", title = detail, sort = info["categories"])
+    else:
+        color = alt.Color("value", type = "nominal", title = detail)
+
+    chart = (
+        alt.Chart(alt.NamedData(name = "map_values"))
+        .mark_geoshape(stroke = "white")
+        .project(type = "mercator")
+        .transform_lookup(
+            lookup = "barangay",
+            from_ = alt.LookupData(alt.NamedData(name = "barangay_shapes"), "properties.NAME_3", ["type", "geometry"]),
+        )
+        .encode(
+            # Barangays without data are gray.
+            color = alt.condition("isValid(datum.value)", color, alt.value("lightgray")),
+            tooltip = [
+                alt.Tooltip("barangay", type = "nominal", title = "Barangay"),
+                alt.Tooltip("value", type = color.type, title = detail),
+            ],
+        )
+        .properties(width = panel_width, height = panel_width)
+        .facet(
+            facet = alt.Facet("panel", type = "nominal", title = None, sort = titles),
+            columns = PANEL_COLUMNS,
+        )
+    )
+
+    # Set the datasets directly, because properties() would validate every coordinate against the schema.
+    chart.datasets = datasets
+
+    return chart
+
+def switchable_map_section(mi_df, flat_df, catalogue, map_var, geojson, center, zoom):
+    """Map with a menu of all numerical variables under one element and hazard."""
+
+    narrow_down = get_selectable_rows(mi_df)
+
+    # Start from the element and hazard of the selected variable.
+    if map_var == "(Barangay)":
+        default_labels = {}
+    else:
+        default_labels = dict(zip(mi_df.columns, map_var.split("/")))
+
+    selections = {}
+    cols = st.columns(2)
+    for col, mi_level in zip(cols, ["Element", "Hazard"]):
+        options = get_level_options(narrow_down, mi_level)
+        default = default_labels.get(mi_level)
+        with col:
+            selections[mi_level] = st.selectbox(
+                mi_level,
+                options = options,
+                index = options.index(default) if default in options else 0,
+                key = "switch_{}".format(mi_level.lower()),
+            )
+        narrow_down = narrow_down_level(narrow_down, mi_level, selections[mi_level])
 
-from app_select_variable import selection_help_box, selection_feature
+    labels = get_subtree_variables(mi_df, catalogue, selections["Element"], selections["Hazard"])
 
-def map_feature(mi_df, flat_df, gdf):
-    """Map of Butuan City feature."""
+    if len(labels) == 0:
+        st.markdown("There are no numerical variables under this element and hazard.")
+        return
+
+    active = labels.index(map_var) if map_var in labels else 0
+
+    st.markdown("Use the menu at the top left of the map to switch between the {} numerical variables under `{}` and `{}`. Switching happens in your browser, so the page does not reload.".format(len(labels), selections["Element"], selections["Hazard"]))
+
+    fig = make_switchable_map(flat_df, labels, geojson, center, zoom, active)
+    st.plotly_chart(fig)
+
+def map_feature(mi_df, flat_df, db, gdf, catalogue, lgu):
+    """Map of the LGU feature."""
 
     st.title("Interactive Map")
-    st.markdown("""This feature provides an interactive map of Butuan City and its barangays. Use the sidebar on the left to select a variable. This will be used to color-code the barangays.""")
+    st.markdown("""This feature provides an interactive map of {} and its barangays. Use the sidebar on the left to select a variable. This will be used to color-code the barangays.""".format(lgu["name"]))
 
     # In the sidebar, let the user select
     with st.sidebar:
@@ -19,49 +233,114 @@ def map_feature(mi_df, flat_df, gdf):
 
         selection_help_box()
 
-        map_var, map_dtype, map_encoding = selection_feature(mi_df, flat_df, var_name = "Map")
+        map_var, map_dtype, map_encoding = selection_feature(mi_df, flat_df, catalogue, var_name = "Map")
 
     # Get the text from the lowest level in the hierarchy.
     map_detail = map_var.split("/")[-1]
 
     st.markdown("## Map")
 
+    map_mode = st.radio(
+        "Map mode",
+        options = ["Single map", "Small multiples", "Switch in map"],
+        horizontal = True,
+        help = "Small multiples show the selected variable for every hazard or element side by side. Switch in map lets you switch between the variables of one element and hazard without reloading the page.",
+    )
+
+    geojson = get_geojson(lgu["key"])
+
     with st.expander("How to Use Map"):
         help_text = f"Colored areas indicate barangays where data is available. The hue of each barangay indicates how high the value of `{map_detail}` is. Refer to the legend.\n\nHover over a city to see its name and the exact value of `{map_detail}`. Pan by dragging with the left mouse button. Zoom in and out with the scroll wheel. To save a photo, adjust the pan and zoom to the desired area. Then, hover over the top right of the image and click the camera button (Download plot as a png)."
         st.markdown(help_text)
 
-    map_df = flat_df.copy()
+    # Only the barangay names and the chosen variable are mapped.
+    map_cols = ["(Barangay)"] if map_var == "(Barangay)" else ["(Barangay)", map_var]
+    map_df = flat_df[map_cols]
 
     # If the chosen variable contains strings, drop rows with missing values in that variable.
     # This will prevent an error from occurring.
-    object_col_df = map_df.select_dtypes(include = "object")
-    if map_var in object_col_df.columns:
+    if map_dtype == "text" and get_column_info(catalogue, map_var)["null_count"] > 0:
         map_df = map_df.dropna(axis = 0, subset = [map_var])
 
-    fig = px.choropleth_mapbox(
-        map_df,
-        geojson = gdf.set_index("NAME_3").geometry,
-        locations = "(Barangay)",
-        color = map_var,
-        color_continuous_scale = "Viridis",
-        range_color = None,
-        mapbox_style = "carto-positron",
-        zoom = 9.7,
-        # Center the map on Butuan City's coordinates.
-        center = {"lat": 8.94917, "lon": 125.54361},
-        opacity = 0.5,
-        hover_name = "(Barangay)",
-        hover_data = [map_var],
-        # Shorten the chosen variable to just its Detail level
-        # when displaying it in the map.
-        labels = {map_var: map_detail},
-    )
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    
-    st.plotly_chart(fig)
+    center, zoom = get_map_view(lgu, gdf)
+
+    if map_mode == "Single map":
+        fig = make_map_figure(map_df, map_var, geojson, center, zoom)
+        st.plotly_chart(fig)
+
+    elif map_mode == "Switch in map":
+        switchable_map_section(mi_df, flat_df, catalogue, map_var, geojson, center, zoom)
+
+    elif map_var == "(Barangay)":
+        st.markdown("Select a variable other than Barangay to see small multiples.")
+
+    else:
+        level = st.selectbox("Compare across", options = ["Hazard", "Element"])
+        labels = find_siblings(mi_df, map_var, level)
+
+        # Title each map with its label at the compared level, such as the name of the hazard.
+        level_num = mi_df.columns.get_loc(level)
+        titles = [label.split("/")[level_num] for label in labels]
 
-    # Open data maps
-    st.markdown("## Open Data Maps\n\nThese are more detailed maps about specific hazards in Butuan City.")
+        st.markdown("Each map shows `{}` for one {}. All maps use the same color scale. Gray barangays have no data.".format(map_detail, level.lower()))
+        chart = make_small_multiples(flat_df, catalogue, labels, titles, geojson)
+        st.altair_chart(chart)
+
+    location_lookup_section(mi_df, flat_df, db, lgu, map_var, center)
+
+    # Open data maps. These are only available for some LGUs.
+    if "open_data_maps" in lgu:
+        open_data_maps_section(lgu)
+
+    # External map websites
+    st.markdown("""---
+
+## Other Map Websites
+
+- [Google Maps](https://www.google.com/maps/search/?api=1&query={})
+- [UP NOAH (Nationwide Operational Assessment of Hazards)](http://noah.up.edu.ph/#/)
+- [PHIVOLCS FaultFinder](https://faultfinder.phivolcs.dost.gov.ph/)""".format(lgu["name"].replace(" ", "+")))
+
+def location_lookup_section(mi_df, flat_df, db, lgu, map_var, center):
+    """Let the user enter coordinates and display a summary of the barangay at that location."""
+
+    st.markdown("## Find a Barangay by Location")
+    st.markdown("Enter the coordinates of a location to see which barangay it is in, as well as a summary of that barangay's risk categories.")
+
+    lookup_cols = st.columns(2)
+    with lookup_cols[0]:
+        lat = st.number_input("Latitude", value = float(center["lat"]), format = "%.5f")
+    with lookup_cols[1]:
+        lon = st.number_input("Longitude", value = float(center["lon"]), format = "%.5f")
+
+    # The index is built once per LGU and reused for every lookup.
+    barangay_index = get_barangay_index(lgu["key"])
+    barangay = barangay_index.locate(lon, lat)
+
+    if barangay is None:
+        st.markdown("No barangay was found at this location.")
+        return
+
+    st.markdown("This location is in **{}**.".format(barangay))
+
+    if barangay not in flat_df["(Barangay)"].tolist():
+        st.markdown("No data is available for this barangay.")
+        return
+
+    map_detail = map_var.split("/")[-1]
+    map_value = flat_df.loc[flat_df["(Barangay)"] == barangay, map_var].iloc[0]
+    st.markdown("{}: {}".format(map_detail, map_value))
+
+    orig_df = make_hierarchical(flat_df, mi_df)
+    eh_combos = get_eh_categories(orig_df, db, barangay)
+
+    st.dataframe(eh_combos.reset_index(drop = True))
+    st.caption("For more details, select this barangay in the Barangay Data Summaries feature.")
+
+def open_data_maps_section(lgu):
+    """Display the open data maps of an LGU."""
+
+    st.markdown("## Open Data Maps\n\nThese are more detailed maps about specific hazards in {}.".format(lgu["name"]))
     with st.expander("See Open Data Maps"):
         od_map = st.selectbox(
             "Subject",
@@ -78,17 +357,8 @@ def map_feature(mi_df, flat_df, gdf):
         )
 
         try:
-            img = Image.open("./open_data_maps/{}.jpg".format(od_map))
+            img = Image.open(os.path.join(lgu["open_data_maps"], "{}.jpg".format(od_map)))
         except IOError:
             st.markdown("An error occurred in retrieving the map.")
 
         st.image(img)
-
-    # External map websites
-    st.markdown("""---
-
-## Other Map Websites
-
-- [Google Maps](https://www.google.com.ph/maps/place/Butuan+City,+Agusan+Del+Norte/@8.8955225,125.442357,11z/data=!3m1!4b1!4m5!3m4!1s0x3301e998b1704fcf:0x85e95810384ea2d6!8m2!3d8.9475377!4d125.5406234)
-- [UP NOAH (Nationwide Operational Assessment of Hazards)](http://noah.up.edu.ph/#/)
-- [PHIVOLCS FaultFinder](https://faultfinder.phivolcs.dost.gov.ph/)""")
\ No newline at end of file
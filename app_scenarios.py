@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+import plotly.express as px
+
+from app_data import MAX_CACHED_LGUS, MAX_CACHED_VINTAGES
+from app_map import get_geojson
+from lgu_registry import get_map_view
+from risk_engine import RiskEngine, INPUTS, OUTPUTS
+
+# Maximum number of scenario results kept in the cache.
+MAX_CACHED_SCENARIOS = 32
+
+# The engine is cached as a resource because its arrays are only read after it is built.
+# It is cached per LGU and vintage. The frames are not hashed, since they are identified by the LGU and vintage.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS * MAX_CACHED_VINTAGES)
+def get_risk_engine(lgu_key, vintage, _mi_df, _flat_df):
+    return RiskEngine(_mi_df, _flat_df)
+
+# Results are cached per scenario, so switching between scenarios does not recompute them.
+@st.cache_data(ttl = None, max_entries = MAX_CACHED_SCENARIOS)
+def get_scenario_results(lgu_key, vintage, changes, _engine):
+    return _engine.compute_changes(_engine.baseline, _engine.change_inputs(changes))
+
+def make_comparison_df(engine, scenario_results, result_name, combo_num):
+    """Return a DataFrame of the baseline and scenario values of a result for one element-hazard combination."""
+
+    comparison_df = pd.DataFrame({
+        "(Barangay)": engine.barangays,
+        "Baseline": engine.baseline[result_name][:, combo_num],
+        "Scenario": scenario_results[result_name][:, combo_num],
+    })
+
+    # Only keep barangays with data on the element and hazard.
+    comparison_df = comparison_df.dropna(subset = ["Baseline", "Scenario"], how = "all")
+
+    if result_name.endswith("_category"):
+        comparison_df["Change"] = np.where(
+            comparison_df["Baseline"] == comparison_df["Scenario"],
+            "No change",
+            comparison_df["Baseline"].astype(str) + " to " + comparison_df["Scenario"].astype(str),
+        )
+    else:
+        comparison_df["Change"] = comparison_df["Scenario"].astype(float) - comparison_df["Baseline"].astype(float)
+
+    return comparison_df
+
+def count_category_changes(engine, scenario_results):
+    """Return a DataFrame of the number of barangays whose categories changed, per element and hazard."""
+
+    counts_df = engine.combos[["Element", "Hazard"]].copy()
+
+    for result_name in ["degree_of_impact_category", "vulnerability_category", "risk_category"]:
+        baseline = engine.baseline[result_name]
+        changed = pd.notna(baseline) & (baseline != scenario_results[result_name])
+        counts_df[OUTPUTS[result_name][2]] = changed.sum(axis = 0)
+
+    # Only show element-hazard combinations where something changed.
+    counts_df = counts_df.loc[counts_df.iloc[:, 2:].sum(axis = 1) > 0]
+
+    return counts_df.reset_index(drop = True)
+
+def scenario_definition_section(engine, scenarios):
+    """Let the user add changes to a scenario or delete a scenario."""
+
+    st.markdown("## Define a Scenario")
+    st.markdown("A scenario is a set of changes to component scores. For example, a scenario can raise the Adaptive Capacity Score of crops in some barangays by 1.")
+
+    scenario_name = st.text_input("Scenario name", value = "Scenario {}".format(len(scenarios) + 1))
+
+    component = st.selectbox(
+        "Score to change",
+        options = list(INPUTS.keys()),
+        format_func = lambda name: INPUTS[name][2],
+    )
+
+    element = st.selectbox("Element", options = engine.elements["Element"].tolist())
+
+    barangays = st.multiselect(
+        "Barangays",
+        options = engine.barangays.tolist(),
+        help = "Leave this empty to change the score in all barangays.",
+    )
+
+    amount = st.number_input(
+        "Amount added to the score",
+        min_value = -5.0,
+        max_value = 5.0,
+        value = 0.5,
+        step = 0.1,
+        help = "Use a negative amount to lower the score.",
+    )
+
+    if st.button("Add change to scenario"):
+        change = (component, element, tuple(barangays), amount)
+        scenarios[scenario_name] = scenarios.get(scenario_name, ()) + (change,)
+
+def scenario_feature(mi_df, flat_df, gdf, lgu, vintage = None):
+    """Scenario Comparison feature. The baseline is the data of the selected vintage."""
+
+    engine = get_risk_engine(lgu["key"], vintage, mi_df, flat_df)
+
+    st.title("Scenario Comparison")
+    st.markdown("""This feature lets you change component scores, such as Adaptive Capacity Scores, and see how Degree of Impact, Vulnerability, and Risk would change. Define a scenario, then compare it to the current data.""")
+
+    # Scenarios are kept for the session, separately for each LGU.
+    if "scenarios" not in st.session_state:
+        st.session_state["scenarios"] = {}
+    scenarios = st.session_state["scenarios"].setdefault(lgu["key"], {})
+
+    scenario_definition_section(engine, scenarios)
+
+    if len(scenarios) == 0:
+        st.markdown("No scenarios have been defined yet.")
+        return
+
+    st.markdown("---")
+
+    scenario_comparison_section(engine, lgu, vintage, gdf, scenarios)
+
+def scenario_comparison_section(engine, lgu, vintage, gdf, scenarios):
+    """Let the user select a scenario and compare its results to the baseline."""
+
+    st.markdown("## Compare a Scenario")
+
+    scenario_name = st.selectbox("Scenario", options = list(scenarios.keys()))
+    changes = scenarios[scenario_name]
+
+    # Display the changes in the scenario.
+    changes_df = pd.DataFrame(
+        [
+            [INPUTS[component][2], element, ", ".join(barangays) if barangays else "All", amount]
+            for component, element, barangays, amount in changes
+        ],
+        columns = ["Score", "Element", "Barangays", "Amount Added"],
+    )
+    st.dataframe(changes_df)
+
+    if st.button("Delete scenario"):
+        del scenarios[scenario_name]
+        st.experimental_rerun()
+
+    scenario_results = get_scenario_results(lgu["key"], vintage, changes, engine)
+
+    st.markdown("### Changed Categories")
+    st.markdown("Number of barangays whose categories changed, for each element and hazard.")
+    counts_df = count_category_changes(engine, scenario_results)
+    if len(counts_df) == 0:
+        st.markdown("No categories changed in this scenario.")
+    else:
+        st.dataframe(counts_df)
+
+    st.markdown("### Map of Changes")
+
+    combo_num = st.selectbox(
+        "Element and hazard",
+        options = list(range(len(engine.combos))),
+        format_func = lambda num: "{} - {}".format(engine.combos.at[num, "Element"], engine.combos.at[num, "Hazard"]),
+    )
+
+    result_name = st.selectbox(
+        "Result",
+        options = list(OUTPUTS.keys()),
+        format_func = lambda name: OUTPUTS[name][2],
+    )
+    result_label = OUTPUTS[result_name][2]
+
+    comparison_df = make_comparison_df(engine, scenario_results, result_name, combo_num)
+
+    center, zoom = get_map_view(lgu, gdf)
+
+    fig = px.choropleth_mapbox(
+        comparison_df,
+        geojson = get_geojson(lgu["key"]),
+        featureidkey = "properties.NAME_3",
+        locations = "(Barangay)",
+        color = "Change",
+        color_continuous_scale = "RdBu_r",
+        color_continuous_midpoint = 0,
+        mapbox_style = "carto-positron",
+        zoom = zoom,
+        center = center,
+        opacity = 0.5,
+        hover_name = "(Barangay)",
+        hover_data = ["Baseline", "Scenario"],
+        labels = {"Change": "Change in {}".format(result_label)},
+    )
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+    st.plotly_chart(fig)
+
+    st.markdown("### Barangays Affected")
+    changed_df = comparison_df.loc[comparison_df["Baseline"] != comparison_df["Scenario"]]
+    if len(changed_df) == 0:
+        st.markdown("{} did not change in any barangay.".format(result_label))
+    else:
+        st.dataframe(changed_df.reset_index(drop = True))
+
+    st.caption("Baseline values are recomputed from the component scores with the formulas in the Barangay Data Summaries feature, so they may differ slightly from the values in the data.")
@@ -1,9 +1,48 @@
 import streamlit as st
 
-from pandas.api.types import is_string_dtype
-from pandas.api.types import is_numeric_dtype
+from column_catalogue import get_column_info
+from label_registry import encode_label
+from variable_search import VariableIndex
+from disk_cache import cached, hash_frames
 
-def selection_feature(mi_df, flat_df, var_name = "x"):
+# The search index is built once for each mi_df and only read afterwards.
+# It is also kept in the disk cache, so it is not built again after a restart.
+@st.cache_resource
+def get_variable_index(mi_df):
+    return cached("variable_index", hash_frames(mi_df), VariableIndex, mi_df)
+
+def get_selectable_rows(mi_df):
+    """Return the rows of mi_df that can be selected in the hierarchy. The row for (Barangay) is dropped."""
+
+    # The row for (Barangay) is the first row of mi_df, so a slice drops it without copying.
+    return mi_df.iloc[1:]
+
+def get_level_options(narrow_down, mi_level):
+    """Return the options available at a level of the hierarchy."""
+
+    return list(narrow_down[mi_level].unique())
+
+def narrow_down_level(narrow_down, mi_level, selection):
+    """Keep only the rows of narrow_down where the given level matches the selection."""
+
+    # Compare the integer codes of the labels instead of the strings.
+    code = encode_label(narrow_down, mi_level, selection)
+
+    narrow_down = narrow_down.loc[
+        narrow_down[mi_level].cat.codes == code,
+        :
+    ]
+
+    return narrow_down
+
+def get_label_encoding(catalogue, label):
+    """Return the data type of a column of flat_df and its default encoding.
+These are looked up in the column catalogue, so the column itself is not read."""
+
+    info = get_column_info(catalogue, label)
+    return info["data_type"], info["encoding"]
+
+def selection_feature(mi_df, flat_df, catalogue, var_name = "x"):
 
     """Select a variable in the hierarchical system."""
     st.markdown("---\n\n#### {} Variable".format(var_name))
@@ -13,6 +52,7 @@ def selection_feature(mi_df, flat_df, var_name = "x"):
         options = [
             "Barangay",
             "Other variable",
+            "Search for a variable",
         ],
         key = f"{var_name} radio",
     )
@@ -21,15 +61,34 @@ def selection_feature(mi_df, flat_df, var_name = "x"):
         show_label = "(Barangay)"
         final_label = "(Barangay)"
 
+    elif first_radio == "Search for a variable":
+        variable_index = get_variable_index(mi_df)
+
+        query = st.text_input(
+            "Search",
+            help = "Type part of the name of a variable, such as Vulnerability Score or radio.",
+            key = f"{var_name} search",
+        )
+
+        positions, scores = variable_index.search(query)
+        matches = variable_index.get_flat_keys(positions)
+
+        if len(matches) > 0:
+            final_label = st.selectbox(
+                label = "Matching variables",
+                options = matches,
+                key = f"{var_name} search results",
+            )
+        else:
+            st.write("No variables were found. The Barangay variable is used until a variable is found.")
+            final_label = "(Barangay)"
+
+        show_label = final_label
+
     else:
         # Variable selection system for hierarchy of labels
 
-        narrow_down = (
-            mi_df
-            .copy()
-            # Drop the row for (Barangay).
-            .loc[mi_df["Sector"] != "(Barangay)"]
-        )
+        narrow_down = get_selectable_rows(mi_df)
 
         selection_list = []
 
@@ -48,7 +107,7 @@ def selection_feature(mi_df, flat_df, var_name = "x"):
             else:
                 prev_selections = "no selection"
 
-            options = narrow_down[mi_level].unique()
+            options = get_level_options(narrow_down, mi_level)
             
             selection = st.selectbox(
                 label = mi_level,
@@ -60,10 +119,7 @@ def selection_feature(mi_df, flat_df, var_name = "x"):
                 # when a higher level changes the options at a lower level.
             )
 
-            narrow_down = narrow_down.loc[
-                narrow_down[mi_level] == selection,
-                :
-            ]
+            narrow_down = narrow_down_level(narrow_down, mi_level, selection)
 
             selection_list.append(selection)
 
@@ -75,39 +131,44 @@ def selection_feature(mi_df, flat_df, var_name = "x"):
         show_label,
     ))
 
-    data_col = flat_df[final_label]
+    info = get_column_info(catalogue, final_label)
+    data_type = info["data_type"]
+    encoding = info["encoding"]
 
-    # Use Pandas API type-checking functions to determine encodings.
-    if is_string_dtype(data_col):
+    if data_type == "text":
         st.write("Data type: Text")
-        st.write("Encoding type: Nominal")
-
-        data_type = "text"
-        encoding = "nominal"
+        # Ordered categories, such as Risk Category, are ordinal. Other text is nominal.
+        st.write("Encoding type: {}".format(encoding.capitalize()))
 
-    elif is_numeric_dtype(data_col):
+    elif data_type == "number":
         st.write("Data type: Numerical")
 
+        if info["null_count"] < len(flat_df):
+            st.write("Range: {:g} to {:g}".format(info["min"], info["max"]))
+
         help_str = """'Quantitative' means that the variable represents a quantitative count or measurement. For example, 1, 1.1, and 1.25.
 
 'Ordinal' means that the variable is qualitative and ordered. For example, a rating from 1 to 5.
 
 'Nominal' means that the numbers represent qualitative unordered labels. For example, an ID number."""
 
-        data_type = "number"
+        encoding_options = [
+            "Quantitative",
+            "Ordinal",
+            "Nominal",
+        ]
 
         encoding = st.radio(
             label = "Encoding type:",
-            options = [
-                "Quantitative",
-                "Ordinal",
-                "Nominal",
-            ],
+            options = encoding_options,
+            index = encoding_options.index(encoding.capitalize()),
             help = help_str,
             key = f"{var_name} encoding",
         )
         encoding = encoding.lower()
 
+    st.write("Barangays with data: {} of {}".format(len(flat_df) - info["null_count"], len(flat_df)))
+
     st.markdown("---")
     return final_label, data_type, encoding
 
@@ -131,7 +192,7 @@ def selection_help_box():
 
 
 
-def selection_help_page(mi_df, flat_df):
+def selection_help_page(mi_df, flat_df, catalogue):
     """Display a page that explains how the variable selection system works."""
 
     st.markdown("""# Help: Variable Selection
@@ -170,6 +231,7 @@ First, you have to select "Barangay" or "Other variable".
 
 - Barangay: This variable contains the names of the barangays. This is useful for making bar charts.
 - Other variable: Select a variable in the hierarchy.
+- Search for a variable: Type part of the name of a variable, then select it from the matching variables.
     
 In the hierarchy, the option that you choose at a higher level will change the options available at a lower level. Because of this, it is good to answer the selectboxes from **top to bottom**.
 
@@ -191,7 +253,7 @@ Remember to answer the selectboxes from top to bottom. A message will appear at
 
     st.markdown(full_practice_text)
 
-    sample_label, sample_dtype, sample_encoding = selection_feature(mi_df, flat_df, var_name = "practice")
+    sample_label, sample_dtype, sample_encoding = selection_feature(mi_df, flat_df, catalogue, var_name = "practice")
     
     # Change the found variable based on whether the correct label was found.
     found = (sample_label == "Agriculture/Livestock/Flood/Overall Risk/Vulnerability Score")
@@ -0,0 +1,74 @@
+import streamlit as st
+import plotly.express as px
+
+from pandas.api.types import is_numeric_dtype
+
+from app_data import get_vintage_store
+from app_map import get_geojson
+from lgu_registry import get_map_view
+
+def vintage_comparison_feature(lgu):
+    """Vintage Comparison feature."""
+
+    store = get_vintage_store(lgu["key"])
+    names = store.names
+
+    st.title("Vintage Comparison")
+    st.markdown("""This feature compares two vintages of the data of {}, such as two yearly updates. Select two vintages to see which variables changed, then select a variable to see how it changed in each barangay.""".format(lgu["name"]))
+
+    cols = st.columns(2)
+    with cols[0]:
+        old_name = st.selectbox("Earlier vintage", options = names, index = 0)
+    with cols[1]:
+        new_name = st.selectbox("Later vintage", options = names, index = len(names) - 1)
+
+    if old_name == new_name:
+        st.markdown("Select two different vintages.")
+        return
+
+    # Only the columns that changed in either vintage are compared.
+    labels = store.differing_labels(old_name, new_name)
+
+    if len(labels) == 0:
+        st.markdown("No variables changed between {} and {}.".format(old_name, new_name))
+        return
+
+    st.markdown("{} variables changed between {} and {}.".format(len(labels), old_name, new_name))
+
+    label = st.selectbox("Variable", options = labels)
+    detail = label.split("/")[-1]
+
+    comparison_df = store.compare(old_name, new_name, label)
+
+    st.markdown("### Map of Changes")
+
+    center, zoom = get_map_view(lgu, store.gdf)
+
+    if is_numeric_dtype(comparison_df["Change"]):
+        color_args = dict(color_continuous_scale = "RdBu_r", color_continuous_midpoint = 0)
+    else:
+        color_args = {}
+
+    fig = px.choropleth_mapbox(
+        comparison_df,
+        geojson = get_geojson(lgu["key"]),
+        featureidkey = "properties.NAME_3",
+        locations = "(Barangay)",
+        color = "Change",
+        mapbox_style = "carto-positron",
+        zoom = zoom,
+        center = center,
+        opacity = 0.5,
+        hover_name = "(Barangay)",
+        hover_data = [old_name, new_name],
+        labels = {"Change": "Change in {}".format(detail)},
+        **color_args,
+    )
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+    st.plotly_chart(fig)
+
+    st.markdown("### Barangays Affected")
+    changed_df = comparison_df.loc[comparison_df[old_name].astype(str) != comparison_df[new_name].astype(str)]
+    st.markdown("{} changed in {} of {} barangays.".format(detail, len(changed_df), len(comparison_df)))
+    st.dataframe(changed_df.reset_index(drop = True))
@@ -0,0 +1,298 @@
+"""
+Gazetteer of barangays: normalizes barangay names and resolves them to GID_3 and BID.
+
+Names of the same barangay are spelled differently by different sources. For example, GADM has
+"Agao Poblacion" and "Santo Niño", while the Sparta data has "Agao" and "Santo Nino". Each name is
+reduced to a key: accents are removed, the text is lowercased, abbreviations such as "Sto." and
+"Brgy." are spelled out, punctuation is dropped, and spaces are collapsed. Keys are made once for
+each distinct name, so normalizing a column of names is vectorized.
+
+A Gazetteer indexes the keys of the barangays in a GADM table, scoped by LGU (GID_2), since many
+LGUs have a barangay with the same name. Their variant names (VARNAME_3) are indexed as well.
+A column of names is resolved with one lookup in the index. Names without a match fall back to their
+key without the word Poblacion, so "Agao" matches "Agao Poblacion", but "San Jose" still matches
+"San Jose" in an LGU that also has "San Jose Poblacion". A key shared by several barangays of an LGU
+is ambiguous, and is never matched. Names without any match fall back to the closest key of a barangay
+in the same LGU with the same numbers, using difflib, so "Barangay 3" never matches "Barangay 2".
+to_bids() only accepts these fuzzy matches if it is asked to.
+
+Example:
+
+    python barangay_gazetteer.py --names ./cleaning_inputs/barangay_GIDs_for_hierarchical_label_data.csv --gid-2 PHL.2.2_1
+    python barangay_gazetteer.py --names names.csv --column orig_name --geodata ./geodata/gadm36_PHL.gpkg --gid-2 PHL.2.2_1 --output gids.csv
+"""
+
+import argparse
+import difflib
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+GEO_PATH = "./geodata/gadm_butuan_city_barangays.gpkg"
+
+# Abbreviations that are spelled out in keys. Each pattern is matched against a lowercased word.
+ABBREVIATIONS = {
+    r"\bsto\b\.?": "santo",
+    r"\bsta\b\.?": "santa",
+    r"\b(brgy|bgy)\b\.?": "barangay",
+    r"\bpob\b\.?": "poblacion",
+}
+
+# Smallest similarity (from 0 to 1) of a fuzzy match, as computed by difflib.
+FUZZY_CUTOFF = 0.85
+
+def strip_accents(names):
+    """Replace accented letters in a Series of names with plain letters. For example, Niño becomes Nino."""
+    return names.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+
+def tidy_names(names):
+    """Strip a Series of names, collapse repeated spaces, and use title case. This is the form shown in the app."""
+    return names.str.strip().str.replace(r"\s+", " ", regex = True).str.title()
+
+def make_keys(names):
+    """Return the keys of a Series of distinct names. See normalize_names()."""
+
+    keys = strip_accents(names.astype(str)).str.lower()
+
+    for pattern, word in ABBREVIATIONS.items():
+        keys = keys.str.replace(pattern, word, regex = True)
+
+    return keys.str.replace(r"[^a-z0-9]+", " ", regex = True).str.strip()
+
+def normalize_names(names):
+    """Return the keys used to match a Series of names, such as "agao poblacion" for "Agao Pob." and
+"santo nino" for "Sto. Niño". Missing names get missing keys."""
+
+    names = pd.Series(names)
+
+    # Normalize each distinct name once, then spread the keys to all names.
+    codes, uniques = pd.factorize(names)
+    keys = make_keys(pd.Series(uniques, dtype = object)).to_numpy(dtype = object)
+
+    return pd.Series(
+        np.where(codes >= 0, keys[codes], np.nan),
+        index = names.index,
+        name = names.name,
+    )
+
+def drop_poblacion(keys):
+    """Drop the word Poblacion from a Series of keys, unless it is the whole key, as in barangays named Poblacion.
+For example, "agao poblacion" becomes "agao"."""
+
+    without_poblacion = keys.str.replace(r"\bpoblacion\b", " ", regex = True).str.split().str.join(" ")
+
+    return without_poblacion.where(without_poblacion != "", keys)
+
+def get_numbers(keys):
+    """Return the numbers in a Series of keys, as one string per key. For example, "barangay 2 poblacion" becomes "2"."""
+    return keys.str.findall(r"[0-9]+").str.join(" ")
+
+def make_key_table(entries, key_column):
+    """Return a DataFrame indexed by "GID_2|key", with the position and match of the barangay of each key.
+entries are in order of preference. A key is matched to the barangays of its best entries, and if these
+are several barangays, it is ambiguous: its position is -1 and its match is "ambiguous"."""
+
+    entries = entries.loc[entries[key_column].notna()]
+    keys = entries["gid_2"] + "|" + entries[key_column]
+
+    # Only the entries of the best type of match of each key count, so that an alias or a name
+    # is preferred to the variant name of another barangay.
+    is_best = (entries["match"] == entries.groupby(keys)["match"].transform("first")).to_numpy()
+    entries = entries.loc[is_best]
+    keys = keys.loc[is_best]
+
+    is_ambiguous = (entries.groupby(keys)["position"].transform("nunique") > 1).to_numpy()
+
+    table = pd.DataFrame({
+        "gid_2": entries["gid_2"].to_numpy(),
+        "name_key": entries[key_column].to_numpy(),
+        "position": np.where(is_ambiguous, -1, entries["position"]),
+        "match": np.where(is_ambiguous, "ambiguous", entries["match"]),
+    }, index = keys.to_numpy())
+
+    return table.loc[~table.index.duplicated()]
+
+def get_gid_2(gid_3):
+    """Return the GID_2 of the LGU of each barangay in a Series of GID_3. For example, PHL.2.2.15_1 becomes PHL.2.2_1."""
+    return gid_3.str.replace(r"\.[0-9]+(_[0-9]+)$", r"\1", regex = True)
+
+def get_bid(gid_3):
+    """Return the BID of each barangay in a Series of GID_3: its number within its LGU. For example, PHL.2.2.15_1 becomes 15."""
+    return gid_3.str.extract(r"\.([0-9]+)_[0-9]+$", expand = False).astype("int64")
+
+def bids_to_names(bids, barangay_sheet):
+    """Replace the BIDs in a Series with the names of the barangays in a barangay_id sheet.
+BIDs that are not in the sheet are kept."""
+
+    names = barangay_sheet.drop_duplicates("BID").set_index("BID")["NAME_3"]
+
+    return bids.map(names).where(bids.isin(names.index), bids)
+
+class Gazetteer:
+    """Index of barangay names, for resolving names to GID_3 and BID."""
+
+    def __init__(self, barangays, aliases = None):
+        """barangays is a DataFrame with the GID_3 and NAME_3 columns of GADM, and optionally VARNAME_3.
+aliases is a dict from other names to GID_3, for names that cannot be matched, such as former names."""
+
+        barangays = barangays.drop_duplicates("GID_3")
+
+        self.barangays = pd.DataFrame({
+            "GID_2": get_gid_2(barangays["GID_3"]).to_numpy(),
+            "GID_3": barangays["GID_3"].to_numpy(),
+            "NAME_3": barangays["NAME_3"].to_numpy(),
+            "BID": get_bid(barangays["GID_3"]).to_numpy(),
+        })
+
+        # Names to index, best first: aliases, then names, then variant names.
+        # GADM separates several variant names with "|".
+        positions = pd.Series(range(len(self.barangays)), index = self.barangays["GID_3"])
+        entries = [
+            pd.DataFrame({"position": np.arange(len(self.barangays)), "name": self.barangays["NAME_3"], "match": "exact"}),
+        ]
+        if "VARNAME_3" in barangays.columns:
+            variants = (
+                pd.Series(barangays["VARNAME_3"].to_numpy())
+                .str.split("|")
+                .explode()
+                .dropna()
+            )
+            entries.append(pd.DataFrame({"position": variants.index, "name": variants.to_numpy(), "match": "variant"}))
+        if aliases:
+            alias_gids = pd.Series(aliases)
+            alias_gids = alias_gids.loc[alias_gids.isin(positions.index)]
+            entries.insert(0, pd.DataFrame({"position": positions.loc[alias_gids].to_numpy(), "name": alias_gids.index, "match": "alias"}))
+
+        entries = pd.concat(entries, ignore_index = True)
+        entries["gid_2"] = self.barangays["GID_2"].to_numpy()[entries["position"]]
+        entries["name_key"] = normalize_names(entries["name"])
+        entries["short_key"] = drop_poblacion(entries["name_key"])
+
+        # Names are matched by their whole key first, and by their key without Poblacion otherwise.
+        self.keys = make_key_table(entries, "name_key")
+        self.short_keys = make_key_table(entries, "short_key")
+
+        # Rows of both tables, so that a match is one row number: the rows of self.short_keys follow those of self.keys.
+        self.rows = pd.concat([self.keys, self.short_keys])
+
+        # Keys of the names in each LGU, by the numbers in them, for fuzzy matching. Each key maps to its row.
+        candidates = self.rows.assign(row = np.arange(len(self.rows)))
+        candidates = candidates.drop_duplicates(["gid_2", "name_key"])
+        candidates["numbers"] = get_numbers(candidates["name_key"])
+
+        self.fuzzy_keys = {}
+        for lgu_gid_2, numbers, name_key, row in zip(candidates["gid_2"], candidates["numbers"], candidates["name_key"], candidates["row"]):
+            self.fuzzy_keys.setdefault((lgu_gid_2, numbers), {})[name_key] = row
+
+    def resolve(self, names, gid_2, cutoff = FUZZY_CUTOFF):
+        """Resolve a Series of barangay names. gid_2 is the GID_2 of their LGU, or a Series with the GID_2 of each name.
+Return a DataFrame with the same index as names, and the columns GID_3, NAME_3, BID, and match.
+match is "alias", "exact", "variant", or "fuzzy", depending on how the name was matched.
+Names that could not be matched have missing values. Names that match several barangays of their LGU
+have the match "ambiguous", and missing values in the other columns."""
+
+        names = pd.Series(names)
+        gid_2 = pd.Series(gid_2, index = names.index)
+        name_keys = normalize_names(names)
+        keys = gid_2 + "|" + name_keys
+
+        # Names are looked up by their whole key, then by their key without Poblacion. See self.rows.
+        rows = self.keys.index.get_indexer(keys)
+        short_rows = self.short_keys.index.get_indexer(gid_2 + "|" + drop_poblacion(name_keys))
+        rows = np.where((rows == -1) & (short_rows >= 0), short_rows + len(self.keys), rows)
+
+        # Fuzzy matching is slow, so it is only done for the distinct names without a match,
+        # and only against the names of the same LGU with the same numbers.
+        is_missing = (rows == -1) & name_keys.notna().to_numpy()
+        missing = pd.DataFrame({"gid_2": gid_2[is_missing], "name_key": name_keys[is_missing]}).drop_duplicates()
+
+        fuzzy = {}
+        for lgu_gid_2, name_key, numbers in zip(missing["gid_2"], missing["name_key"], get_numbers(missing["name_key"])):
+            lgu_keys = self.fuzzy_keys.get((lgu_gid_2, numbers), {})
+            closest = difflib.get_close_matches(name_key, list(lgu_keys), n = 1, cutoff = cutoff)
+            if len(closest) > 0:
+                fuzzy[lgu_gid_2 + "|" + name_key] = lgu_keys[closest[0]]
+
+        is_fuzzy = is_missing & keys.isin(fuzzy.keys()).to_numpy()
+        rows[is_fuzzy] = keys[is_fuzzy].map(fuzzy).to_numpy()
+
+        positions = np.where(rows >= 0, self.rows["position"].to_numpy()[rows], -1)
+        matches = np.where(rows >= 0, self.rows["match"].to_numpy()[rows], None)
+
+        is_found = positions >= 0
+        matches = np.where(is_fuzzy & is_found, "fuzzy", matches)
+        found = self.barangays.iloc[np.where(is_found, positions, 0)].reset_index(drop = True)
+
+        result = pd.DataFrame({
+            "GID_3": found["GID_3"].where(is_found),
+            "NAME_3": found["NAME_3"].where(is_found),
+            "BID": found["BID"].astype("Int64").where(is_found),
+            "match": pd.Series(matches, dtype = object),
+        })
+        result.index = names.index
+
+        return result
+
+    def to_bids(self, names, gid_2, cutoff = FUZZY_CUTOFF, allow_fuzzy = False):
+        """Return the BIDs of a Series of barangay names, as integers. gid_2 is as in resolve().
+Raise a ValueError listing the names that could not be matched, that are ambiguous, and, unless allow_fuzzy
+is True, that were only matched by fuzzy matching. Names with a wrong fuzzy match can be given as aliases."""
+
+        names = pd.Series(names)
+        result = self.resolve(names, gid_2, cutoff)
+
+        problems = []
+
+        unmatched = names.loc[result["match"].isna().to_numpy()]
+        if len(unmatched) > 0:
+            problems.append("Barangays not found: {}".format(sorted(unmatched.astype(str).unique())))
+
+        ambiguous = names.loc[(result["match"] == "ambiguous").to_numpy()]
+        if len(ambiguous) > 0:
+            problems.append("Barangays matching several barangays of their LGU: {}".format(sorted(ambiguous.astype(str).unique())))
+
+        is_fuzzy = (result["match"] == "fuzzy").to_numpy()
+        if not allow_fuzzy and is_fuzzy.any():
+            fuzzy = dict(zip(names.loc[is_fuzzy].astype(str), result.loc[is_fuzzy, "NAME_3"]))
+            problems.append("Barangays only matched by fuzzy matching: {}".format(fuzzy))
+
+        if len(problems) > 0:
+            raise ValueError("\n".join(problems))
+
+        return result["BID"].astype("int64")
+
+    def get_lgu(self, gid_2):
+        """Return the GID_3, NAME_3, and BID of the barangays of an LGU, like the barangay_id sheet."""
+        return self.barangays.loc[self.barangays["GID_2"] == gid_2, ["GID_3", "NAME_3", "BID"]].reset_index(drop = True)
+
+def read_gazetteer(geo_path = GEO_PATH, aliases = None):
+    """Make a Gazetteer from the barangays of a GADM GeoPackage. Geometries are not read."""
+
+    columns = ["GID_3", "NAME_3", "VARNAME_3"]
+    barangays = gpd.read_file(geo_path, ignore_geometry = True)
+
+    return Gazetteer(barangays[[col for col in columns if col in barangays.columns]], aliases)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Resolve barangay names to GID_3 and BID.")
+    parser.add_argument("--names", required = True, help = "CSV file of names. By default, its first column is used.")
+    parser.add_argument("--column", default = None, help = "Column of the CSV file with the names.")
+    parser.add_argument("--geodata", default = GEO_PATH, help = "GADM GeoPackage with the barangays.")
+    parser.add_argument("--gid-2", required = True, help = "GID_2 of the LGU of the barangays.")
+    parser.add_argument("--cutoff", type = float, default = FUZZY_CUTOFF, help = "Smallest similarity of a fuzzy match.")
+    parser.add_argument("--output", default = None, help = "CSV file where the matches are saved, with orig_name and GID_3 columns.")
+    args = parser.parse_args()
+
+    names_df = pd.read_csv(args.names, encoding = "utf-8-sig")
+    names = names_df[args.column or names_df.columns[0]].drop_duplicates()
+
+    result = read_gazetteer(args.geodata).resolve(names, args.gid_2, args.cutoff)
+    result.insert(0, "orig_name", names.to_numpy())
+
+    print(result.to_string(index = False))
+    print("Matched {} of {} names.".format(result["GID_3"].notna().sum(), len(result)))
+
+    if args.output is not None:
+        result[["orig_name", "GID_3"]].to_csv(args.output, index = False)
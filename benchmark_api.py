@@ -0,0 +1,130 @@
+"""
+Load generator for the JSON API in api_server.py.
+
+Sends requests to a running API server with a fixed number of concurrent clients,
+then reports the throughput and latency percentiles of each endpoint.
+
+Example:
+
+    python api_server.py --preload butuan_city
+    python benchmark_api.py --requests 2000 --concurrency 50 --conditional
+"""
+
+import argparse
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import tornado.ioloop
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+BASE_URL = "http://localhost:8502"
+
+def make_paths(base_url, lgu_key):
+    """Return the endpoint paths to request, using the API to find a variable and barangay."""
+
+    http_client = AsyncHTTPClient()
+
+    async def fetch_json(path):
+        response = await http_client.fetch(base_url + path)
+        return tornado.escape.json_decode(response.body)
+
+    async def build():
+        variables = await fetch_json("/lgus/{}/variables".format(lgu_key))
+        barangays = await fetch_json("/lgus/{}/barangays".format(lgu_key))
+
+        # Use the first Risk Score variable, and the first barangay with data on it.
+        variable = [row for row in variables if row["Detail"] == "Risk Score"][0]
+        values = await fetch_json("/lgus/{}/values?variable={}".format(lgu_key, urllib.parse.quote(variable["label"])))
+        barangay = urllib.parse.quote([row[0] for row in values["data"] if row[1] is not None][0])
+
+        return {
+            "variables": "/lgus/{}/variables?element={}".format(lgu_key, urllib.parse.quote(variable["Element"])),
+            "values": "/lgus/{}/values?variable={}".format(lgu_key, urllib.parse.quote(variable["label"])),
+            "summary": "/lgus/{}/barangays/{}/summary?element={}&hazard={}".format(
+                lgu_key,
+                barangay,
+                urllib.parse.quote(variable["Element"]),
+                urllib.parse.quote(variable["Hazard"]),
+            ),
+        }
+
+    return tornado.ioloop.IOLoop.current().run_sync(build)
+
+def run_load(url, num_requests, concurrency, conditional = False):
+    """Send num_requests GET requests to url with the given number of concurrent clients.
+Return a dict of results."""
+
+    AsyncHTTPClient.configure(None, max_clients = concurrency)
+    http_client = AsyncHTTPClient()
+
+    latencies = []
+    statuses = []
+    response_bytes = []
+    remaining = [num_requests]
+
+    async def client():
+        etag = None
+        while remaining[0] > 0:
+            remaining[0] -= 1
+
+            headers = {"Accept-Encoding": "gzip"}
+            if conditional and etag is not None:
+                headers["If-None-Match"] = etag
+
+            start = time.perf_counter()
+            try:
+                # Keep the body compressed, so that the size sent over the network is measured.
+                response = await http_client.fetch(url, headers = headers, decompress_response = False)
+                status = response.code
+                etag = response.headers.get("Etag", etag)
+                response_bytes.append(len(response.body))
+            except HTTPClientError as e:
+                status = e.code
+                response_bytes.append(0)
+
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+
+    async def run():
+        start = time.perf_counter()
+        await tornado.gen.multi([client() for i in range(concurrency)])
+        return time.perf_counter() - start
+
+    total = tornado.ioloop.IOLoop.current().run_sync(run)
+
+    latencies = np.array(latencies) * 1000
+    statuses = pd.Series(statuses)
+
+    return {
+        "requests": num_requests,
+        "seconds": total,
+        "requests_per_s": num_requests / total,
+        "p50_ms": np.percentile(latencies, 50),
+        "p95_ms": np.percentile(latencies, 95),
+        "p99_ms": np.percentile(latencies, 99),
+        "ok": int((statuses == 200).sum()),
+        "not_modified": int((statuses == 304).sum()),
+        "errors": int((statuses >= 400).sum()),
+        "mean_bytes": np.mean(response_bytes),
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark the JSON API with concurrent requests.")
+    parser.add_argument("--url", default = BASE_URL, help = "Base URL of the API server.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--requests", type = int, default = 1000, help = "Number of requests per endpoint.")
+    parser.add_argument("--concurrency", type = int, default = 20, help = "Number of concurrent clients.")
+    parser.add_argument("--conditional", action = "store_true", help = "Send If-None-Match with the last ETag received.")
+    args = parser.parse_args()
+
+    paths = make_paths(args.url, args.lgu)
+
+    results = []
+    for endpoint, path in paths.items():
+        result = run_load(args.url + path, args.requests, args.concurrency, args.conditional)
+        results.append({"endpoint": endpoint, **result})
+
+    print(pd.DataFrame(results).round(2).to_string(index = False))
@@ -0,0 +1,397 @@
+"""
+Benchmarks for the data functions behind the app's features.
+
+The benchmarks run without a browser. They use the shipped dataset as well as
+larger copies of it, where barangays and/or variables are repeated.
+
+Example:
+
+    python benchmark_app.py --scales 1x1 10x1 1x100 --repeat 5
+    python benchmark_app.py --scales 1x1 --synthetic 2000x3x5x20
+    python benchmark_app.py --compare old_results.json new_results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pickle
+import platform
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from app_data import load_data, read_database, make_mi_df, make_flat_df, encode_columns
+from label_registry import encode_labels, make_flat_keys
+from app_select_variable import get_selectable_rows, get_level_options, narrow_down_level, get_label_encoding
+from app_barangay_summary import (
+    make_hierarchical,
+    get_geo_areas,
+    get_eh_categories,
+    make_heatmap_frames,
+    make_heatmap,
+    get_key_categories,
+    get_key_scores,
+    make_score_bins,
+    make_histogram_template,
+    make_histogram_specs,
+)
+from app_graphing import make_display_table, make_chart
+from variable_search import VariableIndex
+from generate_synthetic_data import generate_database, generate_geodata
+from dataset import Dataset
+from column_catalogue import make_catalogue
+
+OUTPUT_DIR = "./benchmark_outputs"
+
+def time_function(func, repeat, *args, **kwargs):
+    """Run a function several times. Return its last result and a dict of timing statistics in seconds."""
+
+    times = []
+    result = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    stats = {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+    return result, stats
+
+def measure_memory(df):
+    """Return the memory used by a DataFrame in a process, and the size of the copy that
+Streamlit's cache gives each session, in megabytes."""
+
+    return {
+        "process_mb": df.memory_usage(deep = True).sum() / 1e6,
+        "session_copy_mb": len(pickle.dumps(df)) / 1e6,
+    }
+
+def scale_database(db, brgy_factor = 1, var_factor = 1):
+    """Make a larger copy of the database by repeating its barangays and its variables."""
+
+    # BIDs of repeated barangays are shifted so that they do not overlap.
+    bid_offset = int(db["barangay_id"]["BID"].max())
+
+    brgy_copies = []
+    for k in range(brgy_factor):
+        brgy_copy = db["barangay_id"].copy()
+        brgy_copy["BID"] = brgy_copy["BID"] + k * bid_offset
+        if k > 0:
+            brgy_copy["NAME_3"] = brgy_copy["NAME_3"] + " ({})".format(k + 1)
+            brgy_copy["GID_3"] = brgy_copy["GID_3"] + "_{}".format(k + 1)
+        brgy_copies.append(brgy_copy)
+
+    scaled_db = {
+        "library": db["library"].copy(),
+        "barangay_id": pd.concat(brgy_copies, ignore_index = True),
+    }
+
+    for sid in db["library"]["SID"].astype(str):
+        sheet = db[sid]
+
+        # Repeat the rows of the sheet for each copy of the barangays.
+        row_copies = [
+            sheet.assign(BID = sheet["BID"] + k * bid_offset)
+            for k in range(brgy_factor)
+        ]
+        sheet = pd.concat(row_copies, ignore_index = True)
+
+        # Repeat the variables of the sheet. The original columns keep their names.
+        if var_factor > 1:
+            value_cols = sheet.drop("BID", axis = 1)
+            col_copies = [sheet[["BID"]], value_cols] + [
+                value_cols.add_suffix(" ({})".format(k + 1))
+                for k in range(1, var_factor)
+            ]
+            sheet = pd.concat(col_copies, axis = 1)
+
+        scaled_db[sid] = sheet
+
+    return scaled_db
+
+def find_label(mi_df, detail, last = False):
+    """Return the flattened label of the first (or last) variable with the given Detail."""
+
+    matches = mi_df.loc[mi_df["Detail"] == detail]
+    row = matches.iloc[-1] if last else matches.iloc[0]
+
+    return "/".join(row)
+
+def walk_selection(mi_df, catalogue, final_label):
+    """Narrow down the hierarchy level by level, as selection_feature() does, until final_label is reached."""
+
+    narrow_down = get_selectable_rows(mi_df)
+
+    for mi_level, selection in zip(narrow_down.columns, final_label.split("/")):
+        options = get_level_options(narrow_down, mi_level)
+        narrow_down = narrow_down_level(narrow_down, mi_level, selection)
+
+    return get_label_encoding(catalogue, final_label)
+
+def summarize_barangay(orig_df, db, barangay):
+    """Compute everything shown in the barangay summary except for the charts."""
+
+    geo_areas_list = get_geo_areas(orig_df, barangay)
+    eh_combos = get_eh_categories(orig_df, db, barangay)
+    eh_display, eh_grid = make_heatmap_frames(eh_combos)
+
+    element_select, hazard_select = eh_combos.iloc[0][["Element", "Hazard"]]
+
+    key_categories = get_key_categories(orig_df, barangay, element_select, hazard_select)
+    key_score_df, key_score_cols = get_key_scores(orig_df, barangay, element_select, hazard_select)
+
+    return eh_display, eh_grid, key_score_df, key_score_cols
+
+def build_histogram_section(key_score_df, key_score_cols):
+    """Build the specs of the score histograms as the summary does when nothing is cached."""
+
+    template = make_histogram_template().to_dict()
+    return make_histogram_specs(key_score_df, make_score_bins(key_score_cols), template)
+
+def make_graphing_specs(flat_df, catalogue, x_label, y_label):
+    """Build the table and the Vega-Lite specs of a univariate and a bivariate chart."""
+
+    display_table = make_display_table(flat_df, [x_label, y_label])
+
+    univariate = make_chart(
+        flat_df, catalogue, [x_label], "Bar",
+        x_label, "quantitative", "count()", "quantitative",
+        500, bin_x = True,
+    )
+    bivariate = make_chart(
+        flat_df, catalogue, [x_label, y_label], "Point",
+        x_label, "quantitative", y_label, "quantitative",
+        500,
+    )
+
+    return [univariate.to_dict(), bivariate.to_dict()]
+
+def benchmark_dataset(db, repeat, from_files = False):
+    """Run all benchmarks on one database. Return a dict of results."""
+
+    timings = {}
+
+    if from_files:
+        # Time the full loading function, including reading the files.
+        (mi_df, flat_df, db, gdf), timings["get_data"] = time_function(load_data, repeat)
+
+    # Time assembling mi_df and flat_df from the sheets of the database.
+    text_mi_df, timings["make_mi_df"] = time_function(make_mi_df, repeat, db)
+    mi_df, timings["encode_labels"] = time_function(encode_labels, repeat, text_mi_df)
+    text_flat_df, timings["make_flat_df"] = time_function(make_flat_df, repeat, db)
+    flat_df, timings["encode_columns"] = time_function(encode_columns, repeat, text_flat_df)
+    # Match the columns to their keys by name, as assemble_data() does.
+    flat_keys = {key: key for key in make_flat_keys(mi_df)}
+    flat_df.columns = [flat_keys[col] for col in flat_df.columns]
+
+    # Memory used by mi_df and flat_df before and after text is stored as categoricals.
+    memory = {
+        "mi_df_text": measure_memory(text_mi_df),
+        "mi_df_encoded": measure_memory(mi_df),
+        "flat_df_text": measure_memory(text_flat_df),
+        "flat_df_encoded": measure_memory(flat_df),
+    }
+
+    # Cost of getting the data on each rerun. Streamlit's data cache unpickles a copy of everything,
+    # while a Dataset in the resource cache only makes views of its read-only DataFrames.
+    if not from_files:
+        gdf = generate_geodata(db["barangay_id"])
+    cached_bytes = pickle.dumps((mi_df, flat_df, db, gdf))
+    _, timings["rerun_cache_data"] = time_function(pickle.loads, repeat, cached_bytes)
+    dataset = Dataset(*pickle.loads(cached_bytes))
+    _, timings["rerun_dataset"] = time_function(dataset.views, repeat)
+
+    # The column catalogue is made once, when a Dataset is loaded.
+    catalogue, timings["column_catalogue"] = time_function(make_catalogue, repeat, flat_df)
+
+    orig_df, timings["make_hierarchical"] = time_function(
+        make_hierarchical, repeat, flat_df, mi_df,
+    )
+
+    # Walk to a variable at the end of the hierarchy, so that every level is narrowed down.
+    _, timings["selection_narrowing"] = time_function(
+        walk_selection, repeat, mi_df, catalogue, find_label(mi_df, "Vulnerability Score", last = True),
+    )
+
+    variable_index, timings["variable_index"] = time_function(VariableIndex, repeat, mi_df)
+    _, timings["variable_search"] = time_function(variable_index.search, repeat, "Vulnerability Score")
+
+    barangay = flat_df["(Barangay)"].iloc[0]
+    summary, timings["barangay_summary"] = time_function(
+        summarize_barangay, repeat, orig_df, db, barangay,
+    )
+    eh_display, eh_grid, key_score_df, key_score_cols = summary
+
+    _, timings["summary_heatmap"] = time_function(
+        make_heatmap, repeat, eh_display, eh_grid,
+    )
+    # With cold caches, the histogram section validates the template and computes the bins.
+    # With warm caches, it only fills in a copy of the template for each score.
+    _, timings["summary_histograms_cold"] = time_function(
+        build_histogram_section, repeat, key_score_df, key_score_cols,
+    )
+    score_bins = make_score_bins(key_score_cols)
+    template = make_histogram_template().to_dict()
+    _, timings["summary_histograms_warm"] = time_function(
+        make_histogram_specs, repeat, key_score_df, score_bins, template,
+    )
+
+    _, timings["graphing_chart"] = time_function(
+        make_graphing_specs, repeat, flat_df, catalogue,
+        find_label(mi_df, "Risk Score"),
+        find_label(mi_df, "Vulnerability Score"),
+    )
+
+    results = {
+        "num_barangays": int(flat_df.shape[0]),
+        "num_variables": int(mi_df.shape[0] - 1),
+        "num_sheets": int(db["library"].shape[0]),
+        "timings": timings,
+        "memory": memory,
+    }
+
+    print("mi_df memory per process: {:.2f} MB as text, {:.2f} MB encoded".format(
+        memory["mi_df_text"]["process_mb"],
+        memory["mi_df_encoded"]["process_mb"],
+    ))
+    print("flat_df memory per process: {:.2f} MB as text, {:.2f} MB encoded".format(
+        memory["flat_df_text"]["process_mb"],
+        memory["flat_df_encoded"]["process_mb"],
+    ))
+    print("flat_df memory per session: {:.2f} MB as text, {:.2f} MB encoded".format(
+        memory["flat_df_text"]["session_copy_mb"],
+        memory["flat_df_encoded"]["session_copy_mb"],
+    ))
+    print("Data per rerun: {:.1f} ms with the data cache, {:.1f} ms with a Dataset".format(
+        timings["rerun_cache_data"]["median"] * 1e3,
+        timings["rerun_dataset"]["median"] * 1e3,
+    ))
+
+    return results
+
+def run_benchmarks(scales, repeat, synthetic_specs = []):
+    """Run the benchmarks for each scale, given as (barangay factor, variable factor) pairs,
+and for each synthetic dataset, given as (barangays, elements, hazards, details) tuples."""
+
+    shipped_db = read_database()
+
+    all_results = {
+        "created": datetime.datetime.now().isoformat(timespec = "seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+        },
+        "repeat": repeat,
+        "datasets": {},
+    }
+
+    for brgy_factor, var_factor in scales:
+        name = "{}x_barangays_{}x_variables".format(brgy_factor, var_factor)
+        print("Running benchmarks on {}...".format(name))
+
+        if (brgy_factor, var_factor) == (1, 1):
+            db = shipped_db
+            results = benchmark_dataset(db, repeat, from_files = True)
+        else:
+            db = scale_database(shipped_db, brgy_factor, var_factor)
+            results = benchmark_dataset(db, repeat)
+
+        results["barangay_factor"] = brgy_factor
+        results["variable_factor"] = var_factor
+
+        all_results["datasets"][name] = results
+
+    for n_barangays, n_elements, n_hazards, n_details in synthetic_specs:
+        name = "synthetic_{}_barangays_{}_elements_{}_hazards_{}_details".format(
+            n_barangays, n_elements, n_hazards, n_details,
+        )
+        print("Running benchmarks on {}...".format(name))
+
+        db = generate_database(n_barangays, n_elements, n_hazards, n_details)
+        results = benchmark_dataset(db, repeat)
+
+        all_results["datasets"][name] = results
+
+    return all_results
+
+def compare_results(old_path, new_path):
+    """Print the median timings of two result files side by side."""
+
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    rows = []
+    for name, new_dataset in new["datasets"].items():
+        old_dataset = old["datasets"].get(name, {"timings": {}})
+        for step, new_stats in new_dataset["timings"].items():
+            old_stats = old_dataset["timings"].get(step)
+            old_median = old_stats["median"] if old_stats else np.nan
+            rows.append({
+                "dataset": name,
+                "step": step,
+                "old median (s)": old_median,
+                "new median (s)": new_stats["median"],
+                "speedup": old_median / new_stats["median"],
+            })
+
+    comparison = pd.DataFrame(rows)
+    print(comparison.to_string(index = False))
+
+    return comparison
+
+def parse_scale(text):
+    """Parse text such as 10x1 into a tuple of integers."""
+    return tuple(int(number) for number in text.lower().split("x"))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark the data functions behind the app's features.")
+    parser.add_argument(
+        "--scales",
+        nargs = "+",
+        default = ["1x1", "10x1", "1x100"],
+        help = "Scales of the datasets, written as BARANGAY_FACTORxVARIABLE_FACTOR. 1x1 is the shipped dataset.",
+    )
+    parser.add_argument(
+        "--synthetic",
+        nargs = "*",
+        default = [],
+        help = "Synthetic datasets, written as BARANGAYSxELEMENTSxHAZARDSxDETAILS.",
+    )
+    parser.add_argument("--repeat", type = int, default = 3, help = "Number of times each function is run.")
+    parser.add_argument("--output", default = None, help = "Path of the JSON file where results are saved.")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), help = "Compare two result files instead of running benchmarks.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        scales = [parse_scale(text) for text in args.scales]
+        synthetic_specs = [parse_scale(text) for text in args.synthetic]
+        all_results = run_benchmarks(scales, args.repeat, synthetic_specs)
+
+        output = args.output
+        if output is None:
+            if not os.path.exists(OUTPUT_DIR):
+                os.mkdir(OUTPUT_DIR)
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            output = os.path.join(OUTPUT_DIR, "benchmark_{}.json".format(timestamp))
+
+        with open(output, "w") as f:
+            json.dump(all_results, f, indent = 4)
+
+        print("Results saved to {}".format(output))
@@ -0,0 +1,151 @@
+"""
+Benchmark the storage backends in storage_backend.py on the queries that features make.
+
+The SQLite file of the LGU is made from its divided database if it does not exist yet. Each backend
+is opened, then each query is timed. The memory column is the memory that the backend keeps after it
+is opened, and the peak memory allocated by a query, as measured by tracemalloc. SQLite's own page
+cache is not included, since it is not allocated by Python. The results of the two backends are
+compared, so the benchmark also checks that the SQLite backend returns the same data.
+
+Example:
+
+    python benchmark_storage.py --lgu butuan_city --repeat 5
+    AGRIHANDA_LGU_REGISTRY=./synthetic_data/lgus.json python benchmark_storage.py --lgu synthetic_city
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+from app_data import read_database
+from lgu_registry import read_lgu_registry
+from sqlite_database import is_sqlite_path, write_sqlite_database
+from storage_backend import SQLiteBackend, open_backend
+
+def get_sqlite_path(lgu):
+    """Return the path of the SQLite file of an LGU: its db_path if that is already SQLite, or a file next to it."""
+
+    if is_sqlite_path(lgu["db_path"]):
+        return lgu["db_path"]
+
+    return os.path.splitext(lgu["db_path"].rstrip("/\\"))[0] + ".sqlite"
+
+def measure(func, repeat, *args, **kwargs):
+    """Run a function several times. Return its last result, the median time in ms, and the peak memory in MB of the last run."""
+
+    times = []
+
+    for i in range(repeat):
+        if i == repeat - 1:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, pd.Series(times).median() * 1000, peak / 1e6
+
+def open_measured(open_func, *args):
+    """Open a backend. Return it, the time in ms, and the memory in MB that it keeps."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    backend = open_func(*args)
+
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return backend, seconds * 1000, current / 1e6
+
+def make_queries(backend):
+    """Return the queries to benchmark, using the first Risk Score variable and the first barangay."""
+
+    mi_df = backend.get_variables()
+    row = mi_df.loc[mi_df["Detail"] == "Risk Score"].iloc[0]
+    element = row["Element"]
+    hazard = row["Hazard"]
+
+    label = "/".join(row.astype(str))
+    subtree = backend.find_variables({"Element": element})
+    barangay = backend.get_barangays()[0]
+
+    return {
+        "variables": ("get_variables", ()),
+        "find_variables": ("find_variables", ({"Element": element, "Hazard": hazard},)),
+        "one_column": ("get_columns", ([label],)),
+        "subtree_columns": ("get_columns", (subtree,)),
+        "one_barangay": ("get_columns", (subtree, [barangay])),
+    }
+
+def compare_results(expected, result):
+    """Return True if two query results hold the same data. Categorical columns are compared by their values."""
+
+    if isinstance(expected, list):
+        return expected == result
+
+    try:
+        pd.testing.assert_frame_equal(
+            expected.astype(str),
+            result.astype(str),
+            check_categorical = False,
+        )
+    except AssertionError:
+        return False
+
+    return True
+
+def run_benchmark(lgu, sqlite_path, repeat):
+    """Benchmark the memory and SQLite backends of an LGU. Return a DataFrame of results."""
+
+    memory, memory_open_ms, memory_open_mb = open_measured(open_backend, lgu, "memory")
+    sqlite, sqlite_open_ms, sqlite_open_mb = open_measured(SQLiteBackend, sqlite_path)
+
+    rows = [
+        {"query": "open", "memory_ms": memory_open_ms, "sqlite_ms": sqlite_open_ms, "memory_mb": memory_open_mb, "sqlite_mb": sqlite_open_mb, "same": True},
+    ]
+
+    for query, (method, args) in make_queries(memory).items():
+        expected, memory_ms, memory_mb = measure(getattr(memory, method), repeat, *args)
+        result, sqlite_ms, sqlite_mb = measure(getattr(sqlite, method), repeat, *args)
+
+        rows.append({
+            "query": query,
+            "memory_ms": memory_ms,
+            "sqlite_ms": sqlite_ms,
+            "memory_mb": memory_mb,
+            "sqlite_mb": sqlite_mb,
+            "same": compare_results(expected, result),
+        })
+
+    sqlite.close()
+
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark the in-memory and SQLite storage backends.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--sqlite-path", default = None, help = "SQLite file to use. By default, it is next to the LGU's database.")
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    lgu = read_lgu_registry()[args.lgu]
+    sqlite_path = args.sqlite_path or get_sqlite_path(lgu)
+
+    if not os.path.exists(sqlite_path):
+        print("Writing {}".format(sqlite_path))
+        write_sqlite_database(read_database(lgu["db_path"]), sqlite_path)
+
+    print("SQLite file: {:.1f} MB".format(os.path.getsize(sqlite_path) / 1e6))
+
+    results = run_benchmark(lgu, sqlite_path, args.repeat)
+
+    print(results.round(3).to_string(index = False))
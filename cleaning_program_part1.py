@@ -3,6 +3,8 @@ import numpy as np
 import re
 import os
 
+from barangay_gazetteer import tidy_names
+
 def my_mkdir(subdir_str):
     """Make a subdirectory if it doesn't exist yet."""
     if not os.path.exists("./{}".format(subdir_str)):
@@ -103,12 +105,8 @@ if __name__ == "__main__":
             # Set the sheet's columns to the uniformly formatted labels in the data dictionary.
             data[sheet].columns = data.dictionary.index
 
-            # Make the barangay names uniformly formatted.
-            data[sheet]["Index/Barangay"] = (
-                data[sheet]["Index/Barangay"]
-                .str.strip()
-                .str.title()
-            )
+            # Make the barangay names uniformly formatted, the same way as in the gazetteer.
+            data[sheet]["Index/Barangay"] = tidy_names(data[sheet]["Index/Barangay"])
 
             # Edit the sheet.
             data[sheet] = (
@@ -1,7 +1,18 @@
 #%%
+import os
+
 import pandas as pd
 import numpy as np
-import geopandas as gpd
+
+from lgu_registry import read_lgu_registry
+from barangay_gazetteer import read_gazetteer
+from validate_data import validate_database, raise_for_errors
+from app_data import write_database
+
+#%%
+# LGU whose data is being cleaned, as a key of the LGU registry. Set it with the AGRIHANDA_LGU environment variable.
+# Its GID_2 and the path of its divided database are in the LGU registry.
+lgu = read_lgu_registry()[os.environ.get("AGRIHANDA_LGU", "butuan_city")]
 
 #%%
 combined_df = (
@@ -14,50 +25,35 @@ combined_df = (
 )
 
 combined_df
-# %%
-gdf = gpd.read_file("geodata/gadm36_PHL.gpkg")
-
-gdf
-# %%
-# Table of all barangays in Butuan City and their GIDs
-# Names are based on GADM
-def gid3_to_id(series):
-    """Take a series and convert Butuan City barangays' GID_3 strings to ID code integers."""
-    result = (
-        series
-        .str.extract(r"PHL.2.2.([0-9]+)_1", expand = False)
-        .astype("int64")
-    )
-    return result
+#%%
+# Read a CSV containing the GID of each barangay.
+# Names here are based on the output hierarchical_label_data.csv, not GADM.
+# They are used as aliases, for names that the gazetteer cannot match, such as former names.
+brgy_gids_df = pd.read_csv("./cleaning_inputs/barangay_GIDs_for_hierarchical_label_data.csv")
 
-butuan_gid_2 = "PHL.2.2_1"
+brgy_gids_dct = brgy_gids_df.set_index("orig_name").to_dict()["GID_3"]
 
-brgy_sheet = (
-    gdf
-    .loc[
-        gdf["GID_2"] == butuan_gid_2,
-        ["GID_3", "NAME_3"]
-    ]
-)
+# Index of the names of all barangays in GADM. Geometries are not read.
+gazetteer = read_gazetteer("geodata/gadm36_PHL.gpkg", aliases = brgy_gids_dct)
 
-brgy_sheet["BID"] = gid3_to_id(brgy_sheet["GID_3"])
+gazetteer
+# %%
+# Table of all barangays in the LGU and their GIDs
+# Names are based on GADM
+brgy_sheet = gazetteer.get_lgu(lgu["gid_2"])
 
 brgy_sheet
 #%%
 # Convert names to GIDs
 
-# Read a CSV containing the GID of each barangay.
-# Names here are based on the output hierarchical_label_data.csv, not GADM.
-brgy_gids_df = pd.read_csv("./cleaning_inputs/barangay_GIDs_for_hierarchical_label_data.csv")
-
-brgy_gids_dct = brgy_gids_df.set_index("orig_name").to_dict()["GID_3"]
-
-# In combined_df's index, replace barangay names with their ID codes
-new_index = gid3_to_id(
+# In combined_df's index, replace barangay names with their ID codes.
+# Names are normalized and matched in one lookup. Names that only have a fuzzy match stop the program,
+# so that no barangay gets a wrong BID. Add them to the aliases, or pass allow_fuzzy = True after checking the matches.
+new_index = gazetteer.to_bids(
     combined_df
     .index
-    .to_series()
-    .replace(brgy_gids_dct)
+    .to_series(),
+    lgu["gid_2"],
 )
 
 new_index.name = "BID"
@@ -127,12 +123,13 @@ for index, row in library_sheet.iterrows():
     # Add sheet to the dictionary of all sheets
     sid_dct[sid] = data_sheet
 #%%
-# Save all sheets to one excel file
-with pd.ExcelWriter(path = "./cleaning_outputs/divided_database.xlsx") as writer:
-
-    for sid, sheet in sid_dct.items():
-        sheet.to_excel(
-            writer,
-            sheet_name = sid,
-            index = False,
-        )
\ No newline at end of file
+# Check the sheets before saving them, so that a malformed input stops here instead of in the app.
+problems = validate_database(sid_dct)
+
+raise_for_errors(problems, "The divided database of {}".format(lgu["name"]))
+
+problems
+#%%
+# Save all sheets to the LGU's db_path: one SQLite file, with indexes on BID and on the hierarchy levels,
+# if it ends with .sqlite or .db, one excel file if it ends with .xlsx, and a folder of Parquet files otherwise.
+write_database(sid_dct, lgu["db_path"])
@@ -0,0 +1,100 @@
+"""
+Catalogue of the columns of flat_df: data type, encoding, and summary statistics of each variable.
+
+The catalogue is made once when the data is loaded, and kept by the Dataset. The pages are given it
+along with the data, and look up a variable's row instead of checking the dtype or scanning the values
+of its column on every rerun.
+Numerical columns are summarized together as one 2D array, so there is no loop over them.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import is_categorical_dtype, is_numeric_dtype
+
+def count_distinct(values):
+    """Return the number of distinct values in each column of a 2D float array. NaN is not counted."""
+
+    if values.shape[0] == 0:
+        return np.zeros(values.shape[1], dtype = int)
+
+    # After sorting, NaN is at the bottom of each column and equal values are next to each other.
+    values = np.sort(values, axis = 0)
+    valid = ~np.isnan(values)
+    starts = np.diff(values, axis = 0) != 0
+
+    return valid[0].astype(int) + (starts & valid[1:]).sum(axis = 0)
+
+def make_catalogue(flat_df):
+    """Return a DataFrame with one row for each column of flat_df, indexed by flat key.
+
+- dtype: the pandas dtype, as text.
+- data_type: "number" or "text".
+- encoding: the encoding the variable has by default: "quantitative" for numbers,
+"ordinal" for ordered categories such as Risk Category, and "nominal" for other text.
+- null_count: the number of barangays without data.
+- min and max: the range of a numerical variable. These are NaN for text.
+- distinct_count: the number of distinct values, not counting missing values.
+- categories: the categories of an ordered variable, from lowest to highest. This is None for other variables."""
+
+    dtypes = flat_df.dtypes
+    is_number = dtypes.map(is_numeric_dtype).to_numpy(dtype = bool)
+    num_cols = len(dtypes)
+
+    encoding = np.where(is_number, "quantitative", "nominal").astype(object)
+    minimum = np.full(num_cols, np.nan)
+    maximum = np.full(num_cols, np.nan)
+    distinct_count = np.zeros(num_cols, dtype = int)
+    categories = np.full(num_cols, None, dtype = object)
+
+    null_count = np.zeros(num_cols, dtype = int)
+
+    # Summarize all numerical columns at once.
+    numbers = flat_df.iloc[:, is_number].to_numpy(dtype = float)
+    with warnings.catch_warnings():
+        # Columns without any data get NaN as their min and max, with a warning that is not needed here.
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        minimum[is_number] = np.nanmin(numbers, axis = 0)
+        maximum[is_number] = np.nanmax(numbers, axis = 0)
+    null_count[is_number] = np.isnan(numbers).sum(axis = 0)
+    distinct_count[is_number] = count_distinct(numbers)
+
+    # Categorical columns are summarized from their integer codes, and other text columns from their values.
+    for position, dtype in enumerate(dtypes):
+        if is_categorical_dtype(dtype):
+            values = flat_df.iloc[:, position].array
+            codes = values.codes
+
+            null_count[position] = (codes == -1).sum()
+            distinct_count[position] = np.count_nonzero(np.bincount(codes[codes >= 0], minlength = 1))
+
+            if values.ordered:
+                encoding[position] = "ordinal"
+                categories[position] = list(values.categories)
+
+        elif dtype == object:
+            column = flat_df.iloc[:, position]
+            null_count[position] = column.isna().sum()
+            distinct_count[position] = column.nunique()
+
+    catalogue = pd.DataFrame(
+        {
+            "dtype": dtypes.astype(str).to_numpy(),
+            "data_type": np.where(is_number, "number", "text"),
+            "encoding": encoding,
+            "null_count": null_count,
+            "min": minimum,
+            "max": maximum,
+            "distinct_count": distinct_count,
+            "categories": categories,
+        },
+        index = flat_df.columns,
+    )
+
+    return catalogue
+
+def get_column_info(catalogue, label):
+    """Return the row of a catalogue for one variable, as a Series."""
+    return catalogue.loc[label]
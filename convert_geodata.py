@@ -1,47 +1,222 @@
-#%%
-# Import packages
-import pandas as pd
+"""
+Build the geodata of one or more LGUs from the national GADM GeoPackage.
+
+Only the features of the requested LGUs are read. The GeoPackage is an SQLite database,
+so the LGUs' rows are selected with an SQL filter on NAME_2 instead of reading the whole file.
+LGUs are processed in parallel. For each LGU, the following files are written:
+
+- gadm_{lgu}_barangays.gpkg: the barangays, with the original GADM names.
+- {lgu}_barangays.parquet: the same data as GeoParquet, with quantized coordinates.
+- {lgu}_topojson.json: compact, quantized TopoJSON with edited barangay names. This is necessary for an Altair map.
+
+Example:
+
+    python convert_geodata.py --lgus "Butuan City" "Cabadbaran City" --workers 4
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 import geopandas as gpd
-import json
 from pytopojson import topology
 
-#%%
-# Open geodata and convert geojson to topojson
-# This is necessary for an Altair map
-gdf = gpd.read_file("geodata/gadm36_PHL.gpkg")
+from barangay_gazetteer import strip_accents, tidy_names
+
+SOURCE_PATH = "./geodata/gadm36_PHL.gpkg"
+OUTPUT_DIR = "./geodata"
+
+# Number of steps per degree when quantizing coordinates. 1e5 steps per degree is about 1 meter.
+# This is used for both the GeoParquet and the TopoJSON files.
+QUANTIZATION = 1e5
+
+# Size in bytes of the envelope of a GeoPackage geometry, based on the envelope indicator.
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+def lgu_slug(lgu_name):
+    """Convert the name of an LGU to the form used in file names. For example, Butuan City becomes butuan_city."""
+    return lgu_name.lower().replace(" ", "_")
+
+def get_layer_info(con, layer = None):
+    """Return the table name, geometry column, and EPSG code of a layer in a GeoPackage.
+If no layer is given, the first feature layer is used."""
+
+    query = """
+        SELECT c.table_name, g.column_name, s.organization_coordsys_id
+        FROM gpkg_contents c
+        JOIN gpkg_geometry_columns g ON c.table_name = g.table_name
+        JOIN gpkg_spatial_ref_sys s ON c.srs_id = s.srs_id
+        WHERE c.data_type = 'features'
+    """
+    layers = con.execute(query).fetchall()
+
+    if layer is not None:
+        layers = [row for row in layers if row[0] == layer]
+
+    return layers[0]
+
+def gpkg_blobs_to_wkb(blobs):
+    """Strip the GeoPackage headers from geometry blobs and return the WKB geometries."""
+
+    wkb_list = []
+    for blob in blobs:
+        flags = blob[3]
+        envelope_size = ENVELOPE_SIZES[(flags >> 1) & 0b111]
+        # The header has 8 bytes (magic, version, flags, SRS ID), followed by the envelope.
+        wkb_list.append(bytes(blob[8 + envelope_size:]))
+
+    return wkb_list
+
+def read_lgu_features(source_path, lgu_name, layer = None):
+    """Read only the features of one LGU from a GADM GeoPackage."""
+
+    con = sqlite3.connect(source_path)
+    try:
+        table_name, geom_col, epsg = get_layer_info(con, layer)
+
+        # Filter the rows with SQL so that the rest of the country is never read.
+        query = 'SELECT * FROM "{}" WHERE NAME_2 = ?'.format(table_name)
+        df = pd.read_sql_query(query, con, params = (lgu_name,))
+    finally:
+        con.close()
+
+    geometry = gpd.GeoSeries.from_wkb(
+        gpkg_blobs_to_wkb(df[geom_col]),
+        crs = "EPSG:{}".format(epsg),
+    )
+
+    gdf = gpd.GeoDataFrame(
+        df.drop(columns = [geom_col, "fid"], errors = "ignore"),
+        geometry = geometry,
+    )
+
+    return gdf
+
+def quantize(gdf, quantization = QUANTIZATION):
+    """Snap the coordinates of the geometries to a grid with the given number of steps per degree."""
+
+    gdf = gdf.copy()
+
+    try:
+        # Shapely 2 has vectorized geometry functions.
+        from shapely import set_precision
+        geometries = np.asarray(gdf.geometry.values)
+    except ImportError:
+        # With Shapely 1.8, GeoPandas stores geometries as PyGEOS arrays.
+        from pygeos import set_precision
+        geometries = gdf.geometry.values.data
+
+    gdf["geometry"] = gpd.GeoSeries(
+        set_precision(geometries, 1 / quantization),
+        index = gdf.index,
+        crs = gdf.crs,
+    )
+
+    return gdf
+
+def get_topojson_quantization(gdf, quantization = QUANTIZATION):
+    """Return the quantization parameter of pytopojson that gives the given number of steps per degree.
+pytopojson's parameter is the number of grid points across the whole bounding box, so it depends on the
+extent of the LGU: a small LGU needs fewer points than the whole country for the same precision."""
+
+    min_x, min_y, max_x, max_y = gdf.total_bounds
+    extent = max(max_x - min_x, max_y - min_y)
+
+    # pytopojson needs at least 2 points.
+    return max(int(np.ceil(extent * quantization)) + 1, 2)
+
+def edit_barangay_names(names):
+    """Edit GADM barangay names to match the names used in the Sparta data."""
+    return (
+        strip_accents(tidy_names(names)) # Title case, and regular letters such as n instead of ñ
+        .str.replace(" Poblacion", "", regex = False) # Delete Poblacion from barangay names
+    )
+
+def build_lgu(source_path, lgu_name, output_dir = OUTPUT_DIR, layer = None, quantization = QUANTIZATION):
+    """Build all geodata files of one LGU. Return a dict of timings in seconds."""
+
+    timings = {"lgu": lgu_name}
+    slug = lgu_slug(lgu_name)
+
+    start = time.perf_counter()
+    gdf = read_lgu_features(source_path, lgu_name, layer)
+    timings["read"] = time.perf_counter() - start
+    timings["num_features"] = len(gdf)
+
+    # Save the LGU's geodata to a GPKG file.
+    # Do not edit barangay names' spelling.
+    start = time.perf_counter()
+    gdf.to_file(os.path.join(output_dir, "gadm_{}_barangays.gpkg".format(slug)), driver = "GPKG")
+    timings["gpkg"] = time.perf_counter() - start
+
+    # Save a GeoParquet file with quantized coordinates.
+    start = time.perf_counter()
+    quantize(gdf, quantization).to_parquet(os.path.join(output_dir, "{}_barangays.parquet".format(slug)))
+    timings["geoparquet"] = time.perf_counter() - start
+
+    # Convert geojson to quantized topojson, with edited barangay names.
+    start = time.perf_counter()
+    topo_gdf = gdf.copy()
+    topo_gdf["NAME_3"] = edit_barangay_names(topo_gdf["NAME_3"])
+
+    geo_dct = json.loads(topo_gdf.to_json())
+
+    tpg = topology.Topology()
+    topojson = tpg({"barangay_geodata": geo_dct}, quantization = get_topojson_quantization(gdf, quantization))
+
+    with open(os.path.join(output_dir, "{}_topojson.json".format(slug)), "w") as f:
+        # Write compact JSON without indentation or spaces.
+        json.dump(topojson, f, separators = (",", ":"))
+    timings["topojson"] = time.perf_counter() - start
+
+    return timings
 
-gdf = (
-    gdf
-    .loc[gdf["NAME_2"] == "Butuan City"] # Get all Butuan City barangays
-)
+def build_lgus(source_path, lgu_names, output_dir = OUTPUT_DIR, layer = None, quantization = QUANTIZATION, workers = None):
+    """Build the geodata of several LGUs in parallel. Return a DataFrame of timings."""
 
-gdf["NAME_3"] = (
-    gdf["NAME_3"]
-    .str.title() # Title case
-    .str.replace(" Poblacion", "", regex = False) # Delete Poblacion from barangay names
-    .str.replace("ñ", "n", regex = False) # Use regular letter n
-)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-geo_str = gdf.to_json()
-geo_dct = json.loads(geo_str)
+    n = len(lgu_names)
 
-tpg = topology.Topology()
-topojson = tpg({"barangay_geodata": geo_dct})
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        all_timings = list(executor.map(
+            build_lgu,
+            [source_path] * n,
+            lgu_names,
+            [output_dir] * n,
+            [layer] * n,
+            [quantization] * n,
+        ))
 
-with open("./geodata/barangay_topojson.json", "w") as f:
-    json.dump(topojson, f, indent = 4)
+    return pd.DataFrame(all_timings)
 
-#%%
-# Open data again but save as GPKG
-# Do not edit barangay names' spelling
+if __name__ == "__main__":
 
-gdf2 = gpd.read_file("geodata/gadm36_PHL.gpkg")
+    parser = argparse.ArgumentParser(description = "Build the geodata of LGUs from the national GADM GeoPackage.")
+    parser.add_argument("--lgus", nargs = "+", default = ["Butuan City"], help = "Names of the LGUs (NAME_2 in GADM).")
+    parser.add_argument("--source", default = SOURCE_PATH, help = "Path of the national GADM GeoPackage.")
+    parser.add_argument("--layer", default = None, help = "Layer of the GeoPackage. By default, the first feature layer is used.")
+    parser.add_argument("--output-dir", default = OUTPUT_DIR)
+    parser.add_argument("--quantization", type = float, default = QUANTIZATION, help = "Number of grid steps per degree.")
+    parser.add_argument("--workers", type = int, default = None, help = "Number of processes. By default, one per CPU.")
+    args = parser.parse_args()
 
-gdf2 = (
-    gdf2
-    .loc[gdf2["NAME_2"] == "Butuan City"] # Get all Butuan City barangays
-)
+    start = time.perf_counter()
+    timings = build_lgus(
+        args.source,
+        args.lgus,
+        output_dir = args.output_dir,
+        layer = args.layer,
+        quantization = args.quantization,
+        workers = args.workers,
+    )
+    total = time.perf_counter() - start
 
-# Save the Butuan City geodata to a GPKG file
-gdf2.to_file("./geodata/gadm_butuan_city_barangays.gpkg")
\ No newline at end of file
+    print(timings.to_string(index = False))
+    print("Total time: {:.2f} s".format(total))
@@ -0,0 +1,73 @@
+"""
+Read-only container for the data of one LGU, shared by all sessions of a process.
+"""
+
+import pandas as pd
+import geopandas as gpd
+
+from column_catalogue import make_catalogue
+from shared_data import split_frame, build_frame
+
+def freeze_frame(df):
+    """Return a DataFrame with the data of df, whose numerical and categorical arrays are read-only.
+Writing to these values afterwards raises a ValueError instead of changing the data.
+
+The frame is rebuilt from its columns' arrays with pandas' public constructors, like a frame attached
+from shared memory, so its columns are grouped by type. Text columns and geometries are not frozen,
+because pandas cannot compare read-only text arrays."""
+
+    if isinstance(df, gpd.GeoDataFrame):
+        frozen = freeze_frame(pd.DataFrame(df.drop(columns = df.geometry.name)))
+        return gpd.GeoDataFrame(frozen, geometry = df.geometry, crs = df.crs)
+
+    arrays = []
+    spec = split_frame(df, arrays)
+
+    for num, array in enumerate(arrays):
+        # Arrays that are views of df, such as categorical codes, are copied, so that df cannot change them.
+        if not array.flags.owndata:
+            array = array.copy()
+        array.setflags(write = False)
+        arrays[num] = array
+
+    return build_frame(spec, arrays)
+
+def view_frame(df):
+    """Return a DataFrame that shares the arrays of df.
+
+Columns can be added to or removed from the view without changing df. No values are copied,
+including text and geometries, so only the numerical and categorical values are protected from writes."""
+    return df.copy(deep = False)
+
+class Dataset:
+    """The data of one LGU: mi_df, flat_df, db, gdf, and the column catalogue of flat_df.
+
+A Dataset is loaded once per process and shared by all sessions. Its numerical and categorical
+arrays are read-only, and sessions get views of its DataFrames from views(), so one session
+cannot change the data of another by accident. If frozen is True, the arrays are already read-only,
+as for data attached from shared memory, and the frames are used as they are."""
+
+    def __init__(self, mi_df, flat_df, db, gdf, frozen = False):
+        if not frozen:
+            mi_df = freeze_frame(mi_df)
+            flat_df = freeze_frame(flat_df)
+            db = {sheet_name: freeze_frame(sheet) for sheet_name, sheet in db.items()}
+            gdf = freeze_frame(gdf)
+
+        self.mi_df = mi_df
+        self.flat_df = flat_df
+        self.db = db
+        self.gdf = gdf
+
+        # The catalogue is made once, and passed to the pages along with the views.
+        self.catalogue = make_catalogue(flat_df)
+
+    def views(self):
+        """Return views of mi_df, flat_df, db, and gdf, in the same form as load_data()."""
+
+        return (
+            view_frame(self.mi_df),
+            view_frame(self.flat_df),
+            {sheet_name: view_frame(sheet) for sheet_name, sheet in self.db.items()},
+            view_frame(self.gdf),
+        )
@@ -0,0 +1,226 @@
+"""
+Persistent cache of derived artifacts on local disk, so that the app starts warm after a restart.
+
+Streamlit's caches are kept in memory, so they are empty after every redeploy or restart. This cache
+keeps artifacts such as the assembled DataFrames, the variable search index, the GeoJSON, rendered
+heatmaps, and histogram bins in pickle files. Each entry is keyed by the hash of the content it was
+made from (data files or DataFrames) and by the code version, which is a hash of the app's source
+files and the versions of Python, NumPy, and pandas. Changing the data or the code therefore never
+returns a stale entry; the old entries are simply not used anymore, and are evicted later.
+
+Entries are written to a temporary file which is then renamed, so other processes never read a
+partial entry. When the cache is larger than its size limit, the least recently used entries are
+deleted. Reading an entry counts as using it.
+
+Example:
+
+    python disk_cache.py info
+    python disk_cache.py clear
+    AGRIHANDA_DISK_CACHE_MAX_MB=200 streamlit run app_main.py
+"""
+
+import argparse
+import functools
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Folder of the cache entries.
+DISK_CACHE_DIR = os.environ.get("AGRIHANDA_DISK_CACHE_DIR", os.path.join(APP_DIR, "disk_cache"))
+
+# Largest total size of the entries. When it is exceeded, the least recently used entries are deleted.
+DISK_CACHE_MAX_BYTES = int(float(os.environ.get("AGRIHANDA_DISK_CACHE_MAX_MB", 500)) * 1e6)
+
+# If this is 0, artifacts are always made again and nothing is written to disk.
+USE_DISK_CACHE = os.environ.get("AGRIHANDA_DISK_CACHE", "1") == "1"
+
+ENTRY_SUFFIX = ".pickle"
+
+@functools.lru_cache(maxsize = None)
+def get_code_version():
+    """Return a hash of the app's source files and of the versions of Python, NumPy, and pandas.
+Entries made by other code, or pickled by other library versions, are not used."""
+
+    digest = hashlib.sha256()
+    digest.update("{} {} {}".format(sys.version, np.__version__, pd.__version__).encode())
+
+    for path in sorted(glob.glob(os.path.join(APP_DIR, "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize = 1024)
+def hash_file(path, mtime_ns, size):
+    """Return the SHA-256 of a file's contents. The file is only read again when its modification time or size changes."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def hash_files(paths):
+    """Return a hash of the contents of files and folders, such as an LGU's database and geodata.
+The files in a folder are hashed in order of their names."""
+
+    digest = hashlib.sha256()
+
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths = sorted(
+                os.path.join(folder, file_name)
+                for folder, _, file_names in os.walk(path)
+                for file_name in file_names
+            )
+        else:
+            file_paths = [path]
+
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            digest.update(os.path.relpath(file_path, path).encode())
+            digest.update(hash_file(file_path, stat.st_mtime_ns, stat.st_size).encode())
+
+    return digest.hexdigest()
+
+def hash_frames(*frames):
+    """Return a hash of the contents of DataFrames or Series, including their labels and dtypes."""
+
+    digest = hashlib.sha256()
+
+    for frame in frames:
+        digest.update(pd.util.hash_pandas_object(frame, index = True).to_numpy().tobytes())
+        if isinstance(frame, pd.DataFrame):
+            digest.update(repr(list(frame.columns)).encode())
+            digest.update(repr(list(frame.dtypes.astype(str))).encode())
+        else:
+            digest.update(repr((frame.name, str(frame.dtype))).encode())
+
+    return digest.hexdigest()
+
+def get_entry_path(name, content_hash, cache_dir = DISK_CACHE_DIR):
+    """Return the path of the entry of an artifact made from content with the given hash by the current code."""
+
+    key = hashlib.sha256("{} {} {}".format(name, content_hash, get_code_version()).encode()).hexdigest()
+    return os.path.join(cache_dir, "{}-{}{}".format(name, key[:32], ENTRY_SUFFIX))
+
+def read_entry(path):
+    """Return the artifact stored in an entry, or None if there is no usable entry."""
+
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except Exception:
+        # A missing entry, or one that cannot be unpickled, is a miss. The entry is replaced when the artifact is written again.
+        return None
+
+    # Mark the entry as recently used, so that it is evicted last.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return value
+
+def write_entry(path, value):
+    """Write an artifact to an entry. The entry appears all at once, or not at all if writing fails."""
+
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok = True)
+
+    # The temporary file is in the same folder, so renaming it does not copy the data.
+    fd, temp_path = tempfile.mkstemp(dir = folder, suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def list_entries(cache_dir = DISK_CACHE_DIR):
+    """Return a DataFrame of the entries in the cache with their size and last use, oldest first."""
+
+    rows = []
+    if os.path.isdir(cache_dir):
+        for entry in os.scandir(cache_dir):
+            if not entry.name.endswith(ENTRY_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Another process evicted the entry in the meantime.
+                continue
+            rows.append({"path": entry.path, "bytes": stat.st_size, "last_used": stat.st_mtime})
+
+    return pd.DataFrame(rows, columns = ["path", "bytes", "last_used"]).sort_values("last_used", ignore_index = True)
+
+def evict(max_bytes = DISK_CACHE_MAX_BYTES, cache_dir = DISK_CACHE_DIR):
+    """Delete the least recently used entries until the cache is at most max_bytes. Return the number deleted."""
+
+    entries = list_entries(cache_dir)
+
+    # Bytes that would remain if each entry and all older ones were deleted.
+    remaining = entries["bytes"].sum() - entries["bytes"].cumsum()
+    to_delete = entries.loc[(remaining + entries["bytes"]) > max_bytes, "path"]
+
+    for path in to_delete:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    return len(to_delete)
+
+def cached(name, content_hash, make, *args):
+    """Return make(*args), reading it from the disk cache if an entry for name and content_hash exists.
+Otherwise, the artifact is made, written to the cache, and the cache is trimmed to its size limit."""
+
+    if not USE_DISK_CACHE:
+        return make(*args)
+
+    path = get_entry_path(name, content_hash)
+
+    value = read_entry(path)
+    if value is not None:
+        return value
+
+    value = make(*args)
+
+    try:
+        write_entry(path, value)
+        evict()
+    except OSError:
+        # A full or read-only disk only means that the artifact is not cached.
+        pass
+
+    return value
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Show or clear the disk cache of derived artifacts.")
+    parser.add_argument("command", choices = ["info", "clear"])
+    args = parser.parse_args()
+
+    entries = list_entries()
+
+    if args.command == "info":
+        entries["artifact"] = entries["path"].map(lambda path: os.path.basename(path).split("-")[0])
+        print("{}: {} entries, {:.2f} MB of {:.0f} MB".format(
+            DISK_CACHE_DIR, len(entries), entries["bytes"].sum() / 1e6, DISK_CACHE_MAX_BYTES / 1e6,
+        ))
+        if len(entries) > 0:
+            print(entries.groupby("artifact")["bytes"].agg(["count", "sum"]).to_string())
+
+    elif args.command == "clear":
+        print("Deleted {} entries.".format(evict(max_bytes = 0)))
@@ -0,0 +1,183 @@
+"""
+Export the barangay summaries of all barangays to one file.
+
+For every barangay, element, and hazard, the file has the key categories, key scores,
+and percentiles shown in the Barangay Data Summaries feature. These are computed for all
+barangays at once, instead of one barangay at a time. The heatmaps of the barangays can
+also be saved as PNG images, rendered in parallel processes.
+
+Example:
+
+    python export_summaries.py barangay_summaries.csv
+    python export_summaries.py barangay_summaries.parquet --lgu butuan_city --heatmaps ./heatmaps --workers 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from app_data import load_data
+from app_barangay_summary import make_hierarchical, make_heatmap_frames, make_heatmap, cat_list, all_score_labels
+from lgu_registry import read_lgu_registry
+
+# Scores that are specific to a hazard, and scores that are the same for all hazards under one element.
+HAZARD_SCORES = [
+    "Likelihood Of Occurrence",
+    "Exposure Score",
+    "Degree Of Impact Score",
+    "Severity Of Consequence Score",
+    "Vulnerability Score",
+    "Risk Score",
+]
+GENERAL_SCORES = [
+    "Sensitivity Score",
+    "Adaptive Capacity Score",
+]
+
+def select_details(orig_df, details, all_hazards):
+    """Return the columns of orig_df whose Detail is in details, with the Sector and Aspect levels dropped.
+If all_hazards is True, only the All Hazards columns are returned, without the Hazard level."""
+
+    detail_level = orig_df.columns.get_level_values("Detail")
+    hazard_level = orig_df.columns.get_level_values("Hazard")
+
+    mask = detail_level.isin(details) & ((hazard_level == "All Hazards") == all_hazards)
+    wide = orig_df.loc[:, mask]
+
+    drop_levels = ["Sector", "Disaster Risk Aspect"]
+    if all_hazards:
+        drop_levels.append("Hazard")
+    wide.columns = wide.columns.droplevel(drop_levels)
+
+    return wide
+
+def add_percentiles(scores):
+    """Take a wide DataFrame of scores. Return a DataFrame with the scores, their percentiles, and
+the number of barangays with each score, using the same definition as get_brgy_percentile()."""
+
+    scores = scores.astype(float)
+
+    # The percentile of a score is the share of barangays with a lower or equal score.
+    # With method = "max", tied scores get the highest rank, which is this count.
+    num_brgys = scores.notna().sum()
+    percentiles = (scores.rank(method = "max") / num_brgys * 100).round(2)
+    counts = percentiles.notna() * num_brgys
+
+    return pd.concat(
+        {"Score": scores, "Percentile": percentiles, "Number of Barangays": counts.where(percentiles.notna())},
+        axis = 1,
+        names = ["Measure"],
+    )
+
+def to_long(wide, id_levels):
+    """Stack the given column levels of a wide DataFrame into the rows.
+Columns of scores and percentiles are named like "Risk Score" and "Risk Score Percentile"."""
+
+    long = wide.stack(id_levels)
+
+    if isinstance(long.columns, pd.MultiIndex):
+        long.columns = [
+            score_name if measure == "Score" else "{} {}".format(score_name, measure)
+            for measure, score_name in long.columns
+        ]
+
+    return long
+
+def make_summary_table(orig_df):
+    """Return a DataFrame of the key categories, key scores, and percentiles
+of every barangay, element, and hazard."""
+
+    id_levels = ["Element", "Hazard"]
+
+    # Key categories
+    categories = to_long(select_details(orig_df, cat_list, all_hazards = False), id_levels)
+
+    # Barangays only have a summary for an element and hazard if these categories are known,
+    # like in get_eh_categories().
+    categories = categories.dropna(subset = ["Vulnerability Category", "Risk Category"])
+
+    # Scores that are specific to a hazard
+    hazard_scores = add_percentiles(select_details(orig_df, HAZARD_SCORES, all_hazards = False))
+    hazard_scores = to_long(hazard_scores, id_levels)
+
+    # Scores that are the same for all hazards. These are joined to every hazard of the element.
+    general_scores = add_percentiles(select_details(orig_df, GENERAL_SCORES, all_hazards = True))
+    general_scores = to_long(general_scores, ["Element"])
+
+    summary = (
+        categories
+        .join(hazard_scores, how = "left")
+        .join(general_scores, on = [orig_df.index.name, "Element"], how = "left")
+    )
+
+    # Order the columns like in the app. Scores that are missing from the data are left empty.
+    score_cols = [
+        score_name if measure == "Score" else "{} {}".format(score_name, measure)
+        for score_name in all_score_labels
+        for measure in ["Score", "Percentile", "Number of Barangays"]
+    ]
+    summary = summary.reindex(columns = cat_list + score_cols)
+
+    return summary.reset_index()
+
+def render_heatmap(barangay, eh_combos, path):
+    """Save the heatmap of one barangay's element-hazard combinations as a PNG image."""
+
+    eh_display, eh_grid = make_heatmap_frames(eh_combos)
+    chart = make_heatmap(eh_display, eh_grid)
+
+    with open(path, "wb") as f:
+        f.write(chart.getvalue())
+
+    return path
+
+def render_heatmaps(summary, output_dir, workers = None):
+    """Save the heatmaps of all barangays in a folder, using a pool of processes. Return the paths."""
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    heatmap_cols = ["Element", "Hazard", "Vulnerability Category", "Risk Category"]
+
+    barangays = []
+    frames = []
+    paths = []
+    for barangay, group in summary.groupby("(Barangay)", sort = False):
+        barangays.append(barangay)
+        frames.append(group[heatmap_cols].reset_index(drop = True))
+        paths.append(os.path.join(output_dir, "{}.png".format(barangay.lower().replace(" ", "_"))))
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(render_heatmap, barangays, frames, paths))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Export the barangay summaries of all barangays.")
+    parser.add_argument("output", help = "Output CSV or Parquet file.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--heatmaps", default = None, help = "Folder where the heatmaps of the barangays are saved.")
+    parser.add_argument("--workers", type = int, default = None, help = "Number of processes for the heatmaps. By default, one per CPU.")
+    args = parser.parse_args()
+
+    lgu = read_lgu_registry()[args.lgu]
+    mi_df, flat_df, db, gdf = load_data(lgu["db_path"], lgu["geo_path"])
+
+    start = time.perf_counter()
+
+    orig_df = make_hierarchical(flat_df, mi_df)
+    summary = make_summary_table(orig_df)
+
+    if args.output.endswith(".parquet"):
+        summary.to_parquet(args.output, index = False)
+    else:
+        summary.to_csv(args.output, index = False)
+
+    print("Exported {} rows in {:.2f} s".format(len(summary), time.perf_counter() - start))
+
+    if args.heatmaps is not None:
+        start = time.perf_counter()
+        paths = render_heatmaps(summary, args.heatmaps, args.workers)
+        print("Saved {} heatmaps in {:.2f} s".format(len(paths), time.perf_counter() - start))
@@ -0,0 +1,293 @@
+"""
+Generate synthetic data with the same shape as the real data, for testing how the app scales.
+
+The output is a divided database (an Excel file, a folder of Parquet files, or a SQLite file) with
+library, barangay_id, and per-SID sheets, as well as a GeoPackage of barangay polygons.
+
+Example:
+
+    python generate_synthetic_data.py --barangays 2000 --elements 3 --hazards 5 --details 20 --output ./synthetic_data
+    python generate_synthetic_data.py --barangays 2000 --vintages 3 --output ./synthetic_data
+    AGRIHANDA_LGU_REGISTRY=./synthetic_data/lgus.json streamlit run app_main.py
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from app_data import write_database
+from risk_engine import score_to_category, risk_to_category
+
+# Names used for the first elements and hazards. Later ones are numbered.
+ELEMENT_NAMES = ["Crops", "Fisheries", "Livestock"]
+HAZARD_NAMES = ["Drought", "Flood", "Rain-Induced Landslide", "Sea Level Rise", "Storm Surge"]
+
+GEO_AREAS = ["Lowland", "Upland", "Coastal"]
+MAGNITUDES = ["Low", "Moderate", "High"]
+
+# Coordinates of Butuan City. The grid of synthetic barangays starts here.
+ORIGIN = (125.4, 8.8)
+CELL_SIZE = 0.01
+
+def make_names(base_names, n, prefix):
+    """Return n names, starting with the given base names and numbering the rest."""
+    return [
+        base_names[i] if i < len(base_names) else "{} {}".format(prefix, i + 1)
+        for i in range(n)
+    ]
+
+def generate_database(n_barangays, n_elements = 3, n_hazards = 5, n_details = 5, coverage = 0.8, seed = 0):
+    """Generate a dict of DataFrames shaped like divided_database.xlsx.
+
+Each element covers a random subset of barangays. The derived scores follow the formulas
+described in the Barangay Data Summaries feature."""
+
+    rng = np.random.default_rng(seed)
+
+    bids = np.arange(1, n_barangays + 1)
+
+    brgy_sheet = pd.DataFrame({
+        "GID_3": ["PHL.99.1.{}_1".format(bid) for bid in bids],
+        "NAME_3": ["Barangay {}".format(bid) for bid in bids],
+        "BID": bids,
+    })
+
+    library_rows = []
+    sheets = {}
+
+    def add_sheet(element, hazard, aspect, sheet):
+        sid = str(len(library_rows))
+        library_rows.append({
+            "Sector": "Agriculture",
+            "Element": element,
+            "Hazard": hazard,
+            "Disaster Risk Aspect": aspect,
+            "SID": sid,
+        })
+        sheets[sid] = sheet
+
+    def extra_details(n_rows, kind):
+        """Make the extra detail columns of a sheet."""
+        if kind == "yes_no":
+            return {
+                "Resource_Description_ITEM {}".format(i + 1): rng.choice(["Yes", "No"], size = n_rows)
+                for i in range(n_details)
+            }
+        else:
+            return {
+                "Detail {}".format(i + 1): rng.gamma(2, 50, size = n_rows).round(2)
+                for i in range(n_details)
+            }
+
+    for element in make_names(ELEMENT_NAMES, n_elements, "Element"):
+
+        # Barangays where data on this element is available.
+        n_covered = max(1, int(n_barangays * coverage))
+        element_bids = np.sort(rng.choice(bids, size = n_covered, replace = False))
+        n_rows = len(element_bids)
+
+        # Sheets under All Hazards
+        adaptive_capacity = rng.integers(1, 6, size = (n_rows, 3)).mean(axis = 1)
+        sensitivity = rng.integers(1, 6, size = (n_rows, 5)).mean(axis = 1)
+
+        add_sheet(element, "All Hazards", "Adaptive Capacity", pd.DataFrame({
+            "BID": element_bids,
+            "Adaptive Capacity Score": adaptive_capacity,
+            **extra_details(n_rows, "yes_no"),
+        }))
+        add_sheet(element, "All Hazards", "Exposure", pd.DataFrame({
+            "BID": element_bids,
+            "Area Of Agricultural Lands (Hectares)": rng.gamma(2, 100, size = n_rows).round(2),
+            **extra_details(n_rows, "number"),
+        }))
+        add_sheet(element, "All Hazards", "Sensitivity", pd.DataFrame({
+            "BID": element_bids,
+            "Sensitivity Score": sensitivity,
+            **extra_details(n_rows, "number"),
+        }))
+
+        for hazard in make_names(HAZARD_NAMES, n_hazards, "Hazard"):
+
+            # Each hazard affects a subset of the element's barangays.
+            hazard_mask = rng.random(n_rows) < 0.8
+            hazard_mask[0] = True
+            hazard_bids = element_bids[hazard_mask]
+            n_hazard_rows = len(hazard_bids)
+
+            exposure = rng.integers(0, 6, size = n_hazard_rows).astype(float)
+            degree_of_impact = ((exposure + sensitivity[hazard_mask]) / 2).round(1)
+            vulnerability = degree_of_impact / adaptive_capacity[hazard_mask]
+            likelihood = rng.integers(1, 6, size = n_hazard_rows)
+            severity = rng.integers(1, 6, size = n_hazard_rows)
+            risk = severity * likelihood
+
+            add_sheet(element, hazard, "Degree of Impact", pd.DataFrame({
+                "BID": hazard_bids,
+                "Degree Of Impact Category": score_to_category(degree_of_impact),
+                "Degree Of Impact Score": degree_of_impact,
+            }))
+            add_sheet(element, hazard, "Exposure", pd.DataFrame({
+                "BID": hazard_bids,
+                "Exposure Score": exposure,
+                "Geographical Area Or Ecosystem": rng.choice(GEO_AREAS, size = n_hazard_rows),
+                **extra_details(n_hazard_rows, "number"),
+            }))
+            add_sheet(element, hazard, "Hazard", pd.DataFrame({
+                "BID": hazard_bids,
+                "Likelihood Of Occurrence": likelihood,
+                "Magnitude Or Depth": rng.choice(MAGNITUDES, size = n_hazard_rows),
+            }))
+            add_sheet(element, hazard, "Overall Risk", pd.DataFrame({
+                "BID": hazard_bids,
+                "Risk Category": risk_to_category(risk),
+                "Risk Score": risk,
+                "Severity Of Consequence Score": severity,
+                "Vulnerability Category": score_to_category(vulnerability),
+                "Vulnerability Score": vulnerability,
+            }))
+
+    db = {
+        "library": pd.DataFrame(library_rows),
+        "barangay_id": brgy_sheet,
+    }
+    db.update(sheets)
+
+    return db
+
+def generate_update(db, change_fraction = 0.1, seed = 1):
+    """Return a copy of a database where the Likelihood of Occurrence changed in some barangays, like in a yearly update.
+The Risk Scores and Risk Categories of those barangays are updated to match. Other sheets are the same objects as in db."""
+
+    rng = np.random.default_rng(seed)
+
+    new_db = dict(db)
+    library = db["library"]
+
+    for (element, hazard), rows in library.groupby(["Element", "Hazard"], sort = False):
+        if hazard == "All Hazards":
+            continue
+
+        sids = dict(zip(rows["Disaster Risk Aspect"], rows["SID"]))
+        hazard_sheet = db[sids["Hazard"]].copy()
+        risk_sheet = db[sids["Overall Risk"]].copy()
+
+        changed = rng.random(len(hazard_sheet)) < change_fraction
+        hazard_sheet.loc[changed, "Likelihood Of Occurrence"] = rng.integers(1, 6, size = changed.sum())
+
+        # Both sheets have one row per barangay affected by the hazard, in the same order.
+        risk = risk_sheet["Severity Of Consequence Score"] * hazard_sheet["Likelihood Of Occurrence"]
+        risk_sheet["Risk Score"] = risk
+        risk_sheet["Risk Category"] = risk_to_category(risk)
+
+        new_db[sids["Hazard"]] = hazard_sheet
+        new_db[sids["Overall Risk"]] = risk_sheet
+
+    return new_db
+
+def generate_geodata(brgy_sheet):
+    """Generate a GeoDataFrame of square barangay polygons in a grid, with GADM-style columns."""
+
+    n_barangays = len(brgy_sheet)
+    n_columns = int(np.ceil(np.sqrt(n_barangays)))
+
+    positions = np.arange(n_barangays)
+    min_x = ORIGIN[0] + (positions % n_columns) * CELL_SIZE
+    min_y = ORIGIN[1] + (positions // n_columns) * CELL_SIZE
+
+    gdf = gpd.GeoDataFrame(
+        {
+            "GID_0": "PHL",
+            "NAME_0": "Philippines",
+            "GID_1": "PHL.99_1",
+            "NAME_1": "Synthetic Province",
+            "GID_2": "PHL.99.1_1",
+            "NAME_2": "Synthetic City",
+            "GID_3": brgy_sheet["GID_3"].to_numpy(),
+            "NAME_3": brgy_sheet["NAME_3"].to_numpy(),
+        },
+        geometry = [
+            box(x, y, x + CELL_SIZE, y + CELL_SIZE)
+            for x, y in zip(min_x, min_y)
+        ],
+        crs = "EPSG:4326",
+    )
+
+    return gdf
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Generate synthetic data shaped like the app's data.")
+    parser.add_argument("--barangays", type = int, default = 1000, help = "Number of barangays.")
+    parser.add_argument("--elements", type = int, default = 3, help = "Number of agricultural elements.")
+    parser.add_argument("--hazards", type = int, default = 5, help = "Number of hazards per element.")
+    parser.add_argument("--details", type = int, default = 5, help = "Number of extra detail columns per sheet.")
+    parser.add_argument("--coverage", type = float, default = 0.8, help = "Fraction of barangays with data on each element.")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--vintages", type = int, default = 1, help = "Number of vintages. Each later vintage changes the risk of some barangays.")
+    parser.add_argument("--format", choices = ["parquet", "xlsx", "sqlite"], default = "parquet")
+    parser.add_argument("--output", default = "./synthetic_data", help = "Folder where the data is saved.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    db = generate_database(
+        args.barangays,
+        n_elements = args.elements,
+        n_hazards = args.hazards,
+        n_details = args.details,
+        coverage = args.coverage,
+        seed = args.seed,
+    )
+
+    if args.format == "xlsx":
+        db_path = os.path.join(args.output, "divided_database.xlsx")
+    elif args.format == "sqlite":
+        db_path = os.path.join(args.output, "divided_database.sqlite")
+    else:
+        db_path = os.path.join(args.output, "divided_database")
+
+    write_database(db, db_path)
+
+    gdf = generate_geodata(db["barangay_id"])
+    geo_path = os.path.join(args.output, "barangays.gpkg")
+    gdf.to_file(geo_path)
+
+    # Write an LGU registry so that the app can load the synthetic data.
+    # Paths in the registry are relative to the output folder.
+    registry = {
+        "synthetic_city": {
+            "name": "Synthetic City",
+            "gid_2": "PHL.99.1_1",
+            "db_path": os.path.basename(db_path),
+            "geo_path": os.path.basename(geo_path),
+        },
+    }
+
+    # Write each later vintage to its own folder, based on the previous vintage.
+    if args.vintages > 1:
+        registry["synthetic_city"]["vintage"] = "Vintage 1"
+        registry["synthetic_city"]["vintages"] = []
+
+        for vintage_num in range(2, args.vintages + 1):
+            db = generate_update(db, seed = args.seed + vintage_num)
+            vintage_dir = "vintage_{}".format(vintage_num)
+            if not os.path.exists(os.path.join(args.output, vintage_dir)):
+                os.makedirs(os.path.join(args.output, vintage_dir))
+
+            vintage_path = os.path.join(vintage_dir, os.path.basename(db_path))
+            write_database(db, os.path.join(args.output, vintage_path))
+            registry["synthetic_city"]["vintages"].append({"name": "Vintage {}".format(vintage_num), "db_path": vintage_path})
+
+    registry_path = os.path.join(args.output, "lgus.json")
+    with open(registry_path, "w") as f:
+        json.dump(registry, f, indent = 4)
+
+    print("Database saved to {}".format(db_path))
+    print("Geodata saved to {}".format(geo_path))
+    print("LGU registry saved to {}".format(registry_path))
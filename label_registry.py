@@ -0,0 +1,75 @@
+"""
+Registry of the hierarchy labels of the variables.
+
+Each level of the hierarchy (Sector, Element, Hazard, Disaster Risk Aspect, Detail) stores its labels
+once, as the categories of a categorical column in mi_df. Each variable is then a row of integer codes.
+The flattened column keys of flat_df and the column MultiIndex used by make_hierarchical()
+are both built from these codes, and label lookups compare codes instead of strings.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+def encode_labels(mi_df):
+    """Return a copy of mi_df where each level is a categorical column.
+The categories are in order of first appearance, so options keep the order of the data."""
+
+    return pd.DataFrame(
+        {level: pd.Categorical(mi_df[level], categories = pd.unique(mi_df[level])) for level in mi_df.columns},
+        index = mi_df.index,
+    )
+
+def get_codes(mi_df):
+    """Return a 2D array with the integer codes of each variable's labels, one column per level."""
+    return np.column_stack([mi_df[level].cat.codes.to_numpy() for level in mi_df.columns])
+
+def encode_label(mi_df, level, label):
+    """Return the integer code of a label at one level, or -1 if the label is not in the registry."""
+
+    categories = mi_df[level].cat.categories
+    return categories.get_loc(label) if label in categories else -1
+
+def make_flat_keys(mi_df):
+    """Return the flattened column keys of the variables in mi_df, such as "Agriculture/Crops/Flood/Overall Risk/Risk Score".
+
+Keys are built by decoding each level once, then joining the labels.
+The strings are interned, so every copy of the same key refers to one string object."""
+
+    level_labels = [mi_df[level].cat.categories.to_numpy()[mi_df[level].cat.codes.to_numpy()] for level in mi_df.columns]
+
+    flat_keys = []
+    for labels in zip(*level_labels):
+        # The Barangay variable is a special case. Its column is named (Barangay).
+        key = labels[0] if labels[0] == "(Barangay)" else "/".join(labels)
+        flat_keys.append(sys.intern(key))
+
+    return flat_keys
+
+def make_column_index(mi_df):
+    """Return a MultiIndex of the variables in mi_df, built directly from the integer codes."""
+
+    column_index = pd.MultiIndex(
+        levels = [mi_df[level].cat.categories for level in mi_df.columns],
+        codes = [mi_df[level].cat.codes.to_numpy() for level in mi_df.columns],
+        names = list(mi_df.columns),
+    )
+
+    # Drop labels that are not used by these variables, such as the labels of the (Barangay) row.
+    return column_index.remove_unused_levels()
+
+def find_siblings(mi_df, flat_key, level):
+    """Return the flat keys of the variables that have the same labels as flat_key at every level except one.
+For example, with level = "Hazard", the Risk Score of Crops gives the Risk Score of Crops for every hazard."""
+
+    flat_keys = make_flat_keys(mi_df)
+    codes = get_codes(mi_df)
+
+    row = codes[flat_keys.index(flat_key)]
+
+    # Compare the codes of all other levels at once.
+    other_levels = [num for num, name in enumerate(mi_df.columns) if name != level]
+    matches = (codes[:, other_levels] == row[other_levels]).all(axis = 1)
+
+    return [key for key, match in zip(flat_keys, matches) if match]
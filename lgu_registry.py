@@ -0,0 +1,72 @@
+"""
+Functions for the registry of LGUs (local government units) served by the app.
+
+Each LGU has its own partition of the data: a divided database and a GeoPackage of its barangays.
+The registry is a JSON file. Paths in the registry are relative to the folder of the registry file.
+
+An LGU can have several vintages of its data, such as yearly updates. The database in db_path is the
+base vintage, named by "vintage". Later vintages are listed under "vintages", each with a name and a db_path:
+
+    "vintages": [{"name": "2022", "db_path": "./cleaning_outputs/2022/divided_database.xlsx"}]
+"""
+
+import json
+import os
+
+import numpy as np
+
+REGISTRY_PATH = os.environ.get("AGRIHANDA_LGU_REGISTRY", "./lgus.json")
+
+# Keys in an LGU's entry that hold paths.
+PATH_KEYS = ["db_path", "geo_path", "open_data_maps"]
+
+# Name of the vintage in db_path if the registry does not name it.
+BASE_VINTAGE = "Base"
+
+def read_lgu_registry(registry_path = REGISTRY_PATH):
+    """Read the LGU registry into a dict where keys are LGU keys and values are dicts of LGU settings."""
+
+    with open(registry_path) as f:
+        registry = json.load(f)
+
+    base_dir = os.path.dirname(registry_path)
+
+    for lgu_key, lgu in registry.items():
+        lgu["key"] = lgu_key
+        for path_key in PATH_KEYS:
+            if path_key in lgu:
+                lgu[path_key] = os.path.join(base_dir, lgu[path_key])
+        for vintage in lgu.get("vintages", []):
+            vintage["db_path"] = os.path.join(base_dir, vintage["db_path"])
+
+    return registry
+
+def get_vintage_names(lgu):
+    """Return the names of an LGU's data vintages, starting with the base vintage."""
+    return [lgu.get("vintage", BASE_VINTAGE)] + [vintage["name"] for vintage in lgu.get("vintages", [])]
+
+def get_vintage_db_path(lgu, vintage = None):
+    """Return the path of the database of one of an LGU's vintages. If vintage is None, the base vintage's is returned."""
+
+    for entry in lgu.get("vintages", []):
+        if entry["name"] == vintage:
+            return entry["db_path"]
+
+    return lgu["db_path"]
+
+def get_map_view(lgu, gdf):
+    """Return the center and zoom level of the LGU's map.
+If these are not in the registry, they are computed from the bounds of the LGU's barangays."""
+
+    min_x, min_y, max_x, max_y = gdf.total_bounds
+
+    center = lgu.get("center", {
+        "lat": (min_y + max_y) / 2,
+        "lon": (min_x + max_x) / 2,
+    })
+
+    # Each zoom level halves the number of degrees shown on the map.
+    extent = max(max_x - min_x, max_y - min_y, 1e-6)
+    zoom = lgu.get("zoom", float(np.clip(np.log2(360 / extent), 3, 15)))
+
+    return center, zoom
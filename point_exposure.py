@@ -0,0 +1,154 @@
+"""
+Attach barangay risk profiles to geo-tagged points, such as farm parcels.
+
+Points are read in chunks from a CSV file (with longitude and latitude columns) or a GeoParquet file.
+Each chunk is joined to the barangay polygons through a spatial index, then joined to the
+barangay data, and written to the output file before the next chunk is read.
+
+Example:
+
+    python point_exposure.py farm_parcels.csv farm_parcel_risk.csv --lgu butuan_city
+    python point_exposure.py farm_parcels.parquet farm_parcel_risk.parquet --details "Risk Score" "Risk Category"
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app_data import load_data
+from lgu_registry import read_lgu_registry
+from spatial_index import BarangayIndex
+from label_registry import make_flat_keys
+
+# Details attached to each point by default, for every element and hazard.
+DEFAULT_DETAILS = [
+    "Risk Score",
+    "Risk Category",
+    "Vulnerability Score",
+    "Vulnerability Category",
+]
+
+CHUNKSIZE = 50_000
+
+def make_profile_table(mi_df, flat_df, details = DEFAULT_DETAILS):
+    """Return a DataFrame indexed by barangay, with the flat_df columns whose Detail is in details."""
+
+    profile_cols = make_flat_keys(mi_df.loc[mi_df["Detail"].isin(details)])
+
+    profile_df = flat_df.set_index("(Barangay)")[profile_cols]
+
+    return profile_df
+
+class ExposureEngine:
+    """Attach barangay profiles to points. The spatial index and the profile table are built once."""
+
+    def __init__(self, mi_df, flat_df, gdf, details = DEFAULT_DETAILS):
+        self.barangay_index = BarangayIndex(gdf)
+
+        profile_df = make_profile_table(mi_df, flat_df, details)
+
+        # Align the profiles with the polygons of the index, so that a point's profile can be
+        # taken by position. The last row is empty, for points outside of every barangay.
+        self.profile_cols = profile_df.columns
+        aligned = profile_df.reindex(self.barangay_index.names).reset_index(drop = True)
+        self.profile_values = aligned.reindex(range(len(aligned) + 1))
+
+        # Arrow schema of the profile columns, used so that every chunk written to Parquet has the same schema.
+        self.profile_schema = pa.Schema.from_pandas(self.profile_values, preserve_index = False)
+
+    def attach(self, lons, lats):
+        """Return a DataFrame with the barangay and the profile of each point."""
+
+        positions = self.barangay_index.locate_positions(lons, lats)
+
+        # Points outside of every barangay (position -1) get the empty last row.
+        positions = np.where(positions >= 0, positions, len(self.profile_values) - 1)
+
+        result = self.profile_values.take(positions).reset_index(drop = True)
+
+        names = np.append(self.barangay_index.names, None)
+        result.insert(0, "(Barangay)", names[positions])
+
+        return result
+
+def read_point_chunks(input_path, chunksize = CHUNKSIZE, lon_col = "lon", lat_col = "lat"):
+    """Yield (chunk, longitudes, latitudes) for each chunk of points in a CSV or GeoParquet file."""
+
+    if input_path.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(input_path)
+
+        for batch in parquet_file.iter_batches(batch_size = chunksize):
+            chunk = batch.to_pandas()
+
+            # GeoParquet stores geometries as WKB.
+            points = gpd.GeoSeries.from_wkb(chunk.pop("geometry"))
+            yield chunk, points.x.to_numpy(), points.y.to_numpy()
+
+    else:
+        for chunk in pd.read_csv(input_path, chunksize = chunksize):
+            yield chunk, chunk[lon_col].to_numpy(), chunk[lat_col].to_numpy()
+
+def run_exposure(engine, input_path, output_path, chunksize = CHUNKSIZE, lon_col = "lon", lat_col = "lat"):
+    """Attach profiles to all points in input_path and write them to output_path chunk by chunk.
+Return the number of points processed."""
+
+    num_points = 0
+    parquet_writer = None
+    schema = None
+
+    try:
+        for chunk_num, (chunk, lons, lats) in enumerate(read_point_chunks(input_path, chunksize, lon_col, lat_col)):
+
+            profiles = engine.attach(lons, lats)
+            result = pd.concat([chunk.reset_index(drop = True), profiles], axis = 1)
+
+            if output_path.endswith(".parquet"):
+                if parquet_writer is None:
+                    schema = pa.schema(
+                        list(pa.Schema.from_pandas(chunk, preserve_index = False))
+                        + [pa.field("(Barangay)", pa.string())]
+                        + list(engine.profile_schema)
+                    )
+                    parquet_writer = pq.ParquetWriter(output_path, schema)
+                parquet_writer.write_table(pa.Table.from_pandas(result, schema = schema, preserve_index = False))
+            else:
+                result.to_csv(
+                    output_path,
+                    mode = "w" if chunk_num == 0 else "a",
+                    header = (chunk_num == 0),
+                    index = False,
+                )
+
+            num_points += len(chunk)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    return num_points
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Attach barangay risk profiles to geo-tagged points.")
+    parser.add_argument("input", help = "CSV file with longitude and latitude columns, or a GeoParquet file of points.")
+    parser.add_argument("output", help = "Output CSV or Parquet file.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--details", nargs = "+", default = DEFAULT_DETAILS, help = "Details to attach for every element and hazard.")
+    parser.add_argument("--lon-col", default = "lon")
+    parser.add_argument("--lat-col", default = "lat")
+    parser.add_argument("--chunksize", type = int, default = CHUNKSIZE)
+    args = parser.parse_args()
+
+    lgu = read_lgu_registry()[args.lgu]
+    mi_df, flat_df, db, gdf = load_data(lgu["db_path"], lgu["geo_path"])
+
+    start = time.perf_counter()
+    engine = ExposureEngine(mi_df, flat_df, gdf, args.details)
+    num_points = run_exposure(engine, args.input, args.output, args.chunksize, args.lon_col, args.lat_col)
+    total = time.perf_counter() - start
+
+    print("Processed {} points in {:.2f} s".format(num_points, total))
@@ -0,0 +1,115 @@
+"""
+Profile the memory allocated by each page of the app when it reruns.
+
+Each page is run once to fill the caches, then rerun several times under tracemalloc,
+the way Streamlit reruns the script on every interaction. The peak is the most memory
+that was allocated at once during a rerun, which includes temporary copies of frames.
+The pages run without a browser, so every widget has its default value. A script run
+context is set up like Streamlit's, since st.cache_data and st.cache_resource only store
+results while a script is running.
+
+Example:
+
+    python profile_pages.py --lgu butuan_city --reruns 3
+    AGRIHANDA_LGU_REGISTRY=./synthetic_data/lgus.json python profile_pages.py --lgu synthetic_city --top 5
+"""
+
+import argparse
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx
+from streamlit.runtime.state import SafeSessionState, SessionState
+from streamlit.runtime.uploaded_file_manager import UploadedFileManager
+
+from app_data import get_dataset
+from lgu_registry import read_lgu_registry
+from app_map import map_feature
+from app_barangay_summary import barangay_summary_feature
+from app_graphing import graphing_feature
+from app_select_variable import selection_help_page
+
+# Pages that can run without a session. Each one gets the data like app_main.py does.
+PAGES = {
+    "Map": lambda lgu, catalogue, mi_df, flat_df, db, gdf: map_feature(mi_df, flat_df, db, gdf, catalogue, lgu),
+    "Barangay Data Summaries": lambda lgu, catalogue, mi_df, flat_df, db, gdf: barangay_summary_feature(mi_df, flat_df, db, lgu),
+    "Graphing Tool": lambda lgu, catalogue, mi_df, flat_df, db, gdf: graphing_feature(mi_df, flat_df, catalogue),
+    "Help: Variable Selection": lambda lgu, catalogue, mi_df, flat_df, db, gdf: selection_help_page(mi_df, flat_df, catalogue),
+}
+
+def make_script_run_ctx():
+    """Attach a script run context to the current thread, so that the caches work and pages
+can use the session state. Messages that would go to the browser are dropped."""
+
+    ctx = ScriptRunContext(
+        session_id = "profile",
+        _enqueue = lambda msg: None,
+        query_string = "",
+        session_state = SafeSessionState(SessionState()),
+        uploaded_file_mgr = UploadedFileManager(),
+        page_script_hash = "",
+        user_info = {"email": "profile@example.com"},
+    )
+    add_script_run_ctx(threading.current_thread(), ctx)
+
+    return ctx
+
+def rerun_page(page, lgu, ctx):
+    """Run a page the way app_main.py does on a rerun, including getting the data."""
+    ctx.reset()
+    dataset = get_dataset(lgu["key"])
+    PAGES[page](lgu, dataset.catalogue, *dataset.views())
+
+def profile_page(page, lgu, ctx, reruns = 3, top = 0):
+    """Rerun a page under tracemalloc. Return a dict with the median peak and time of the reruns,
+and print the lines that allocated the most memory in the last rerun if top > 0."""
+
+    # Fill the caches, so that only reruns are measured.
+    rerun_page(page, lgu, ctx)
+
+    peaks = []
+    times = []
+
+    for i in range(reruns):
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        rerun_page(page, lgu, ctx)
+
+        times.append(time.perf_counter() - start)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak)
+
+        if i == reruns - 1 and top > 0:
+            snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    if top > 0:
+        print("Top allocations of {}:".format(page))
+        for stat in snapshot.statistics("lineno")[:top]:
+            print("    {}".format(stat))
+
+    return {
+        "page": page,
+        "peak_mb": pd.Series(peaks).median() / 1e6,
+        "seconds": pd.Series(times).median(),
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Profile the memory allocated by each page of the app when it reruns.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--pages", nargs = "+", default = list(PAGES.keys()), choices = list(PAGES.keys()))
+    parser.add_argument("--reruns", type = int, default = 3)
+    parser.add_argument("--top", type = int, default = 0, help = "Number of allocation sites to print for each page.")
+    args = parser.parse_args()
+
+    lgu = read_lgu_registry()[args.lgu]
+    ctx = make_script_run_ctx()
+
+    results = pd.DataFrame([profile_page(page, lgu, ctx, args.reruns, args.top) for page in args.pages])
+
+    print(results.round(3).to_string(index = False))
@@ -0,0 +1,314 @@
+"""
+Recompute the derived scores and categories of every barangay, element, and hazard from their components.
+
+The formulas are the ones described in the Barangay Data Summaries feature:
+
+- Degree of Impact Score = mean(Exposure Score, Sensitivity Score)
+- Vulnerability Score = Degree of Impact Score / Adaptive Capacity Score
+- Risk Score = Severity of Consequence Score x Likelihood of Occurrence
+
+The component columns of flat_df are stored as 2D NumPy arrays with one row per barangay
+and one column per element-hazard combination, so all scores are computed at once.
+Adaptive Capacity Scores can be changed to see how the results would change ("what-if" analysis).
+
+Some values in the source data do not follow these formulas exactly. For example, some
+Degree of Impact Scores are rounded, and Risk Categories were not always assigned by score alone.
+RiskEngine.compare() counts the values that differ from the recomputed ones.
+
+Example:
+
+    python risk_engine.py --lgu butuan_city --adaptive-capacity-change 0.5
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app_data import load_data, SCORE_CATEGORIES, RISK_CATEGORIES
+from lgu_registry import read_lgu_registry
+
+# Upper bounds of the categories. A score equal to a bound belongs to the lower category.
+SCORE_BOUNDS = [1, 2, 3, 4]
+RISK_BOUNDS = [4, 9, 16]
+
+# Location of each component and result in the hierarchy, as (hazard, aspect, detail).
+# A hazard of None means the hazard of the element-hazard combination.
+INPUTS = {
+    "exposure": (None, "Exposure", "Exposure Score"),
+    "sensitivity": ("All Hazards", "Sensitivity", "Sensitivity Score"),
+    "adaptive_capacity": ("All Hazards", "Adaptive Capacity", "Adaptive Capacity Score"),
+    "likelihood": (None, "Hazard", "Likelihood Of Occurrence"),
+    "severity": (None, "Overall Risk", "Severity Of Consequence Score"),
+}
+OUTPUTS = {
+    "degree_of_impact": (None, "Degree of Impact", "Degree Of Impact Score"),
+    "degree_of_impact_category": (None, "Degree of Impact", "Degree Of Impact Category"),
+    "vulnerability": (None, "Overall Risk", "Vulnerability Score"),
+    "vulnerability_category": (None, "Overall Risk", "Vulnerability Category"),
+    "risk": (None, "Overall Risk", "Risk Score"),
+    "risk_category": (None, "Overall Risk", "Risk Category"),
+}
+
+def to_category(scores, bounds, categories):
+    """Convert an array of scores to an object array of category names. Missing scores become None."""
+
+    scores = np.asarray(scores, dtype = float)
+
+    # For each score, count the bounds that are lower than it. This is the position of its category.
+    positions = np.searchsorted(bounds, scores, side = "left")
+
+    labels = np.array(categories, dtype = object)[np.minimum(positions, len(categories) - 1)]
+    labels[np.isnan(scores)] = None
+
+    return labels
+
+def score_to_category(scores):
+    """Convert Degree of Impact or Vulnerability scores to categories."""
+    return to_category(scores, SCORE_BOUNDS, SCORE_CATEGORIES)
+
+def risk_to_category(scores):
+    """Convert Risk Scores to risk categories."""
+    return to_category(scores, RISK_BOUNDS, RISK_CATEGORIES)
+
+def divide(numerators, denominators):
+    """Divide arrays. Division by 0 gives NaN instead of infinity."""
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return numerators / np.where(denominators == 0, np.nan, denominators)
+
+# Dependency graph of the derived results. Each result lists the components and results it is computed from.
+# Results are listed so that each one comes after the results it depends on.
+DEPENDENCIES = {
+    "degree_of_impact": ["exposure", "sensitivity"],
+    "degree_of_impact_category": ["degree_of_impact"],
+    "vulnerability": ["degree_of_impact", "adaptive_capacity"],
+    "vulnerability_category": ["vulnerability"],
+    "risk": ["severity", "likelihood"],
+    "risk_category": ["risk"],
+}
+
+# Formula of each derived result. Each formula takes a dict of arrays.
+FORMULAS = {
+    "degree_of_impact": lambda values: (values["exposure"] + values["sensitivity"]) / 2,
+    "degree_of_impact_category": lambda values: score_to_category(values["degree_of_impact"]),
+    "vulnerability": lambda values: divide(values["degree_of_impact"], values["adaptive_capacity"]),
+    "vulnerability_category": lambda values: score_to_category(values["vulnerability"]),
+    "risk": lambda values: values["severity"] * values["likelihood"],
+    "risk_category": lambda values: risk_to_category(values["risk"]),
+}
+
+def get_dependents(changed):
+    """Return the derived results that depend on any of the changed names, directly or indirectly,
+in the order they should be computed."""
+
+    affected = set(changed)
+    dependents = []
+
+    for name, dependencies in DEPENDENCIES.items():
+        if affected.intersection(dependencies):
+            affected.add(name)
+            dependents.append(name)
+
+    return dependents
+
+def compute_scores(values, names = None):
+    """Compute derived results from a dict of component arrays. Return a dict of result arrays.
+By default, all results are computed. Otherwise, only the given results are computed."""
+
+    values = dict(values)
+    results = {}
+
+    for name in DEPENDENCIES:
+        if names is None or name in names:
+            values[name] = results[name] = FORMULAS[name](values)
+
+    return results
+
+class RiskEngine:
+    """Component scores of all barangays as arrays, for recomputing derived scores.
+
+Arrays have one row per barangay and one column per element-hazard combination.
+Adaptive Capacity is also kept per element, since it is the same for all hazards."""
+
+    def __init__(self, mi_df, flat_df):
+        self.barangays = flat_df["(Barangay)"].to_numpy()
+
+        variables = mi_df.loc[mi_df["Sector"] != "(Barangay)"]
+
+        # Element-hazard combinations, in the order of the library
+        self.combos = (
+            variables
+            .loc[variables["Hazard"] != "All Hazards", ["Sector", "Element", "Hazard"]]
+            .drop_duplicates()
+            .reset_index(drop = True)
+        )
+
+        self.elements = self.combos[["Sector", "Element"]].drop_duplicates().reset_index(drop = True)
+
+        # Position of each combination's element in self.elements
+        self.combo_elements = (
+            self.combos
+            .merge(self.elements.reset_index(), on = ["Sector", "Element"], how = "left")["index"]
+            .to_numpy()
+        )
+
+        self.flat_df = flat_df
+        self.inputs = {name: self.get_array(location) for name, location in INPUTS.items()}
+
+        # Adaptive Capacity Scores per element. These are the values changed in what-if analysis.
+        element_labels = [
+            self.make_label(sector, element, *INPUTS["adaptive_capacity"])
+            for sector, element in self.elements.itertuples(index = False)
+        ]
+        self.adaptive_capacity = self.get_columns(element_labels)
+        self.adaptive_capacity.columns = self.elements["Element"]
+
+        # Results without any changes. Scenarios are recomputed from these.
+        self.baseline = self.compute()
+
+    def make_label(self, sector, element, hazard, aspect, detail):
+        """Return the flat_df label of a variable."""
+        return "/".join([sector, element, hazard, aspect, detail])
+
+    def combo_labels(self, location):
+        """Return the flat_df labels of a variable for every element-hazard combination."""
+
+        hazard, aspect, detail = location
+
+        return [
+            self.make_label(sector, element, combo_hazard if hazard is None else hazard, aspect, detail)
+            for sector, element, combo_hazard in self.combos.itertuples(index = False)
+        ]
+
+    def get_columns(self, labels):
+        """Return the flat_df columns with the given labels as floats. Missing columns are filled with NaN."""
+        return self.flat_df.reindex(columns = labels).astype(float).reset_index(drop = True)
+
+    def get_array(self, location):
+        """Return a 2D array of a variable for every barangay and element-hazard combination."""
+        return self.get_columns(self.combo_labels(location)).to_numpy()
+
+    def compute(self, adaptive_capacity = None):
+        """Compute all derived scores and categories. Return a dict of 2D arrays.
+
+adaptive_capacity is an optional DataFrame shaped like self.adaptive_capacity,
+with changed Adaptive Capacity Scores."""
+
+        inputs = dict(self.inputs)
+
+        if adaptive_capacity is not None:
+            inputs["adaptive_capacity"] = np.asarray(adaptive_capacity, dtype = float)[:, self.combo_elements]
+
+        return compute_scores(inputs)
+
+    def change_inputs(self, changes):
+        """Apply a scenario's changes to the component arrays. Return a dict of only the changed arrays.
+
+changes is a sequence of (component, element, barangays, amount) tuples. The amount is added
+to the component in the given barangays, for every hazard of the element.
+If barangays is empty, the change applies to all barangays."""
+
+        changed_inputs = {}
+
+        for component, element, barangays, amount in changes:
+            array = changed_inputs.get(component, self.inputs[component]).copy()
+
+            rows = np.isin(self.barangays, barangays) if len(barangays) > 0 else np.ones(len(self.barangays), dtype = bool)
+            cols = (self.combos["Element"] == element).to_numpy()
+
+            array[rows[:, None] & cols[None, :]] += amount
+            changed_inputs[component] = array
+
+        return changed_inputs
+
+    def compute_changes(self, base_results, changed_inputs):
+        """Recompute the results after some components changed. Return a dict of result arrays.
+
+Only the results that depend on the changed components are recomputed, and only in the
+element-hazard combinations where a component changed. Other arrays are shared with base_results."""
+
+        # Element-hazard combinations where any component changed. NaN values are equal to each other here.
+        changed_cols = np.zeros(len(self.combos), dtype = bool)
+        for name, array in changed_inputs.items():
+            unchanged = (array == self.inputs[name]) | (np.isnan(array) & np.isnan(self.inputs[name]))
+            changed_cols |= ~unchanged.all(axis = 0)
+
+        results = dict(base_results)
+        dependents = get_dependents(changed_inputs)
+
+        if not changed_cols.any() or not dependents:
+            return results
+
+        values = {name: array[:, changed_cols] for name, array in self.inputs.items()}
+        values.update({name: array[:, changed_cols] for name, array in base_results.items()})
+        values.update({name: array[:, changed_cols] for name, array in changed_inputs.items()})
+
+        for name, new_values in compute_scores(values, dependents).items():
+            array = base_results[name].copy()
+            array[:, changed_cols] = new_values
+            results[name] = array
+
+        return results
+
+    def to_frame(self, results):
+        """Convert the results of compute() to a DataFrame with the same column labels as flat_df."""
+
+        frames = {}
+        for name, array in results.items():
+            for label, col in zip(self.combo_labels(OUTPUTS[name]), array.T):
+                frames[label] = col
+
+        result_df = pd.DataFrame(frames, index = self.flat_df.index)
+        result_df.insert(0, "(Barangay)", self.barangays)
+
+        return result_df
+
+    def compare(self, results, tolerance = 0.01):
+        """Compare recomputed results to the values in flat_df.
+Return a DataFrame with the number of values compared and the number that differ, per result."""
+
+        rows = []
+        for name, array in results.items():
+            stored = self.flat_df.reindex(columns = self.combo_labels(OUTPUTS[name])).to_numpy()
+
+            # Only compare values that are present in the data and could be recomputed.
+            known = pd.notna(stored) & pd.notna(array)
+
+            if name.endswith("_category"):
+                differs = known & (stored != array)
+            else:
+                differs = known & (np.abs(stored.astype(float) - array.astype(float)) > tolerance)
+
+            rows.append({"result": name, "compared": int(known.sum()), "differ": int(differs.sum())})
+
+        return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Recompute derived scores and categories, optionally with changed Adaptive Capacity Scores.")
+    parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    parser.add_argument("--adaptive-capacity-change", type = float, default = 0, help = "Amount added to every Adaptive Capacity Score.")
+    args = parser.parse_args()
+
+    lgu = read_lgu_registry()[args.lgu]
+    mi_df, flat_df, db, gdf = load_data(lgu["db_path"], lgu["geo_path"])
+
+    start = time.perf_counter()
+    engine = RiskEngine(mi_df, flat_df)
+    print("Engine built in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    results = engine.compute()
+    print("Scores recomputed in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+    print(engine.compare(results).to_string(index = False))
+
+    if args.adaptive_capacity_change != 0:
+        start = time.perf_counter()
+        what_if = engine.compute(engine.adaptive_capacity + args.adaptive_capacity_change)
+        print("What-if scores computed in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+        # Count the barangay-element-hazard combinations whose category changed.
+        for name in ["vulnerability_category", "risk_category"]:
+            changed = pd.notna(results[name]) & (results[name] != what_if[name])
+            print("{} changed for {} combinations".format(name, int(changed.sum())))
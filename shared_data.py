@@ -0,0 +1,366 @@
+"""
+Share the data of LGUs between processes through shared memory.
+
+A loader process assembles an LGU's data once and publishes it. The numerical columns of mi_df,
+flat_df, the database sheets, and the geodata are copied into one shared memory block, along with
+integer codes for their categorical and text columns and the geometries as WKB. Only small metadata
+(column names, dtypes, categories, and unique strings) is pickled into a second block. App processes
+attach to the blocks and build their DataFrames on top of the shared arrays with pandas' public
+constructors. Numerical columns and categorical columns are not copied. Text columns and geometries
+are rebuilt from their codes and WKB. The shared arrays are read-only, so no process can change the
+data seen by the others.
+
+The numerical columns of each dtype are shared as one 2D array, which pandas uses as one block.
+So that pandas does not copy them into blocks again, the columns of an attached DataFrame are
+grouped by type: text, then categorical, then numerical columns. Code that needs the columns in
+the order of mi_df matches them by label, like make_hierarchical().
+
+The loader keeps the data published until it is stopped.
+
+Example:
+
+    python shared_data.py publish --lgus butuan_city
+    AGRIHANDA_SHARED_DATA=1 streamlit run app_main.py
+    python shared_data.py measure --lgu butuan_city --workers 1 4 16
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import signal
+import struct
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from pandas.api.types import is_categorical_dtype
+
+from lgu_registry import read_lgu_registry
+
+# Prefix of the names of the shared memory blocks.
+SHM_PREFIX = "agrihanda"
+
+# Offsets of arrays in the data block are multiples of this number of bytes.
+ALIGNMENT = 64
+
+# Size of the header of the metadata block, which holds the length of the pickled metadata.
+HEADER = struct.Struct("<Q")
+
+# Shared memory blocks attached by this process. They must stay open while their arrays are used.
+_attached = {}
+
+def block_names(lgu_key):
+    """Return the names of the data block and the metadata block of an LGU."""
+    return "{}_{}_data".format(SHM_PREFIX, lgu_key), "{}_{}_meta".format(SHM_PREFIX, lgu_key)
+
+def split_frame(df, arrays):
+    """Split a DataFrame into arrays that can be shared, and a spec for rebuilding it.
+
+Numerical columns are grouped by dtype into 2D arrays with one row per column, the way pandas stores them.
+Categorical and text columns are stored as integer codes. The geometries of a GeoDataFrame are stored as WKB.
+The arrays are appended to arrays, and the spec refers to them by their position in that list.
+Other columns are kept in the spec itself."""
+
+    spec = {
+        "index": df.index,
+        "numbers": [],
+        "categoricals": [],
+        "texts": [],
+        "others": [],
+        "geometry": None,
+    }
+
+    positions_by_dtype = {}
+
+    for position, (col, dtype) in enumerate(df.dtypes.items()):
+        column = df.iloc[:, position]
+
+        if isinstance(df, gpd.GeoDataFrame) and col == df.geometry.name:
+            # The WKB of all geometries is stored as one array of bytes, with the offset where each one starts.
+            wkb = column.to_wkb().to_numpy()
+            offsets = np.cumsum([0] + [len(value) for value in wkb])
+            spec["geometry"] = (col, df.crs, len(arrays))
+            arrays.append(offsets)
+            arrays.append(np.frombuffer(b"".join(wkb), dtype = np.uint8))
+        elif is_categorical_dtype(dtype):
+            spec["categoricals"].append((col, dtype, len(arrays)))
+            arrays.append(column.cat.codes.to_numpy())
+        elif dtype.kind in "biuf":
+            positions_by_dtype.setdefault(dtype, []).append(position)
+        elif dtype == object:
+            # Text columns are stored as integer codes and their unique values, which are kept in the spec.
+            codes, uniques = pd.factorize(column)
+            spec["texts"].append((col, np.append(uniques.to_numpy(dtype = object), np.nan), len(arrays)))
+            arrays.append(codes)
+        else:
+            spec["others"].append((col, column.to_numpy()))
+
+    for dtype, positions in positions_by_dtype.items():
+        spec["numbers"].append((df.columns[positions], len(arrays)))
+        arrays.append(np.ascontiguousarray(df.iloc[:, positions].to_numpy(dtype = dtype).T))
+
+    return spec
+
+def build_frame(spec, arrays):
+    """Build a DataFrame from a spec made by split_frame() and the arrays it refers to.
+The numerical columns and categorical codes are views of the arrays, not copies.
+The columns are grouped by type: text, then categorical, then numerical, then other columns."""
+
+    index = spec["index"]
+    parts = []
+
+    # Text columns are rebuilt in each process as one 2D array, but the strings are shared by all rows
+    # with the same value. The last unique value is missing, for the code -1. These arrays stay writable,
+    # because comparisons of read-only object arrays fail in some versions of pandas.
+    if len(spec["texts"]) > 0:
+        texts = np.column_stack([uniques.take(arrays[array_num]) for col, uniques, array_num in spec["texts"]])
+        parts.append(pd.DataFrame(texts, index = index, columns = [col for col, uniques, array_num in spec["texts"]], copy = False))
+
+    for col, dtype, array_num in spec["categoricals"]:
+        parts.append(pd.DataFrame({col: pd.Categorical.from_codes(arrays[array_num], dtype = dtype)}, index = index, copy = False))
+
+    # The transpose of an array with one row per column is used by pandas as one block, without copying it.
+    for columns, array_num in spec["numbers"]:
+        parts.append(pd.DataFrame(arrays[array_num].T, index = index, columns = columns, copy = False))
+
+    for col, values in spec["others"]:
+        parts.append(pd.DataFrame({col: values}, index = index))
+
+    if len(parts) == 0:
+        df = pd.DataFrame(index = index)
+    else:
+        df = pd.concat(parts, axis = 1, copy = False)
+
+    if spec["geometry"] is not None:
+        # Geometries are GEOS objects, which cannot be shared, so each process decodes the shared WKB.
+        col, crs, array_num = spec["geometry"]
+        offsets, wkb = arrays[array_num], arrays[array_num + 1]
+        geometry = gpd.GeoSeries.from_wkb(
+            [wkb[start:end].tobytes() for start, end in zip(offsets[:-1], offsets[1:])],
+            index = index,
+            crs = crs,
+        )
+        df = gpd.GeoDataFrame(df, geometry = geometry.rename(col), crs = crs)
+
+    return df
+
+def publish_data(lgu_key, mi_df, flat_df, db, gdf):
+    """Copy an LGU's data into shared memory. Return the data block and the metadata block.
+The blocks exist until they are unlinked, so the caller must keep them and unlink them when done."""
+
+    arrays = []
+    meta = {
+        "mi_df": split_frame(mi_df, arrays),
+        "flat_df": split_frame(flat_df, arrays),
+        "db": {sheet_name: split_frame(sheet, arrays) for sheet_name, sheet in db.items()},
+        "gdf": split_frame(gdf, arrays),
+    }
+
+    # Place the arrays one after another in the data block.
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append((offset, array.dtype, array.shape))
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    meta["layout"] = layout
+
+    data_name, meta_name = block_names(lgu_key)
+
+    data_shm = SharedMemory(name = data_name, create = True, size = max(offset, 1))
+    for array, (offset, dtype, shape) in zip(arrays, layout):
+        np.ndarray(shape, dtype = dtype, buffer = data_shm.buf, offset = offset)[...] = array
+
+    meta_bytes = pickle.dumps(meta, protocol = pickle.HIGHEST_PROTOCOL)
+    meta_shm = SharedMemory(name = meta_name, create = True, size = HEADER.size + len(meta_bytes))
+    HEADER.pack_into(meta_shm.buf, 0, len(meta_bytes))
+    meta_shm.buf[HEADER.size:HEADER.size + len(meta_bytes)] = meta_bytes
+
+    return data_shm, meta_shm
+
+def open_block(name):
+    """Attach to an existing shared memory block without registering it with the resource tracker.
+
+Python's resource tracker deletes the blocks registered by a process when the process exits.
+Only the loader process should delete the blocks, so app processes attach without registering."""
+
+    try:
+        return SharedMemory(name = name, track = False)
+    except TypeError:
+        # The track argument was added in Python 3.13.
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return SharedMemory(name = name)
+        finally:
+            resource_tracker.register = register
+
+def attach_data(lgu_key):
+    """Return mi_df, flat_df, db, and gdf of an LGU that was published in shared memory.
+
+The numerical and categorical data are read-only views of the shared block, so attaching
+does not copy them. Raise FileNotFoundError if the LGU was not published."""
+
+    data_name, meta_name = block_names(lgu_key)
+
+    if lgu_key not in _attached:
+        _attached[lgu_key] = (open_block(data_name), open_block(meta_name))
+    data_shm, meta_shm = _attached[lgu_key]
+
+    meta_length, = HEADER.unpack_from(meta_shm.buf, 0)
+    meta = pickle.loads(meta_shm.buf[HEADER.size:HEADER.size + meta_length])
+
+    arrays = []
+    for offset, dtype, shape in meta["layout"]:
+        array = np.ndarray(shape, dtype = dtype, buffer = data_shm.buf, offset = offset)
+        array.setflags(write = False)
+        arrays.append(array)
+
+    mi_df = build_frame(meta["mi_df"], arrays)
+    flat_df = build_frame(meta["flat_df"], arrays)
+    db = {sheet_name: build_frame(spec, arrays) for sheet_name, spec in meta["db"].items()}
+    gdf = build_frame(meta["gdf"], arrays)
+
+    return mi_df, flat_df, db, gdf
+
+def read_memory_usage():
+    """Return the RSS, PSS, and private memory of this process in MB, from /proc/self/smaps_rollup.
+PSS counts shared pages divided by the number of processes that use them."""
+
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ["Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"]:
+                usage[parts[0][:-1]] = int(parts[1]) / 1024
+
+    return {
+        "rss_mb": usage["Rss"],
+        "pss_mb": usage["Pss"],
+        "private_mb": usage["Private_Clean"] + usage["Private_Dirty"],
+    }
+
+def measure_worker(mode, lgu_key, pickle_path, barrier, queue):
+    """Get the data like one app process would, read all of it, and report the memory used.
+The data_ values are the memory added by getting the data, after the modules were imported."""
+
+    before = read_memory_usage()
+
+    if mode == "shared":
+        mi_df, flat_df, db, gdf = attach_data(lgu_key)
+    else:
+        # st.cache_data keeps the pickled data and unpickles a copy for each caller.
+        with open(pickle_path, "rb") as f:
+            mi_df, flat_df, db, gdf = pickle.load(f)
+
+    # Read every value, so that all pages of the data are mapped in this process.
+    flat_df.sum(numeric_only = True)
+    for sheet in db.values():
+        sheet.sum(numeric_only = True)
+
+    # Wait until all workers hold the data, then measure.
+    barrier.wait()
+    after = read_memory_usage()
+    queue.put({
+        "rss_mb": after["rss_mb"],
+        "pss_mb": after["pss_mb"],
+        "data_rss_mb": after["rss_mb"] - before["rss_mb"],
+        "data_private_mb": after["private_mb"] - before["private_mb"],
+    })
+    barrier.wait()
+
+def measure_workers(mode, lgu_key, n_workers, pickle_path):
+    """Run n_workers processes that each get the data, and return the mean of their memory usage."""
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(n_workers)
+    queue = context.Queue()
+
+    workers = [
+        context.Process(target = measure_worker, args = (mode, lgu_key, pickle_path, barrier, queue))
+        for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    usages = [queue.get() for worker in workers]
+
+    for worker in workers:
+        worker.join()
+
+    result = pd.DataFrame(usages).mean().round(1).to_dict()
+    result["total_pss_mb"] = round(sum(usage["pss_mb"] for usage in usages), 1)
+
+    return result
+
+if __name__ == "__main__":
+
+    # app_data imports this module, so it is only imported when this module runs as a script.
+    from app_data import load_data, load_lgu_data
+
+    parser = argparse.ArgumentParser(description = "Publish LGU data in shared memory, or measure the memory used by app processes.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    publish_parser = subparsers.add_parser("publish", help = "Publish the data of LGUs until stopped.")
+    publish_parser.add_argument("--lgus", nargs = "+", default = ["butuan_city"], help = "Keys of the LGUs in the LGU registry.")
+
+    measure_parser = subparsers.add_parser("measure", help = "Compare the memory of workers that copy the data and workers that attach to it.")
+    measure_parser.add_argument("--lgu", default = "butuan_city", help = "Key of the LGU in the LGU registry.")
+    measure_parser.add_argument("--workers", type = int, nargs = "+", default = [1, 4, 16])
+    measure_parser.add_argument("--pickle-path", default = "./shared_data_benchmark.pkl", help = "Temporary file with the pickled data.")
+
+    args = parser.parse_args()
+
+    registry = read_lgu_registry()
+
+    if args.command == "publish":
+        blocks = []
+        try:
+            for lgu_key in args.lgus:
+                lgu = registry[lgu_key]
+                data_shm, meta_shm = publish_data(lgu_key, *load_lgu_data(lgu))
+                blocks += [data_shm, meta_shm]
+                print("Published {} ({:.1f} MB of arrays, {:.1f} MB of metadata)".format(lgu_key, data_shm.size / 1e6, meta_shm.size / 1e6))
+
+            print("Press Ctrl+C to stop.")
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            while True:
+                time.sleep(3600)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    else:
+        lgu = registry[args.lgu]
+        data = load_data(lgu["db_path"], lgu["geo_path"])
+
+        with open(args.pickle_path, "wb") as f:
+            pickle.dump(data, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+        data_shm, meta_shm = publish_data(args.lgu, *data)
+        print("Pickled data: {:.1f} MB. Shared arrays: {:.1f} MB. Metadata: {:.1f} MB.".format(
+            os.path.getsize(args.pickle_path) / 1e6, data_shm.size / 1e6, meta_shm.size / 1e6,
+        ))
+
+        try:
+            rows = []
+            for n_workers in args.workers:
+                for mode in ["copy", "shared"]:
+                    result = measure_workers(mode, args.lgu, n_workers, args.pickle_path)
+                    rows.append({"workers": n_workers, "mode": mode, **result})
+
+            print(pd.DataFrame(rows).to_string(index = False))
+
+        finally:
+            for shm in [data_shm, meta_shm]:
+                shm.close()
+                shm.unlink()
+            os.remove(args.pickle_path)
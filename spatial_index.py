@@ -0,0 +1,57 @@
+"""
+Spatial index over barangay polygons, for finding the barangay that contains a point.
+"""
+
+import numpy as np
+import geopandas as gpd
+
+def geopandas_version():
+    """Return the major and minor version of GeoPandas as a tuple of integers."""
+    return tuple(int(part) for part in gpd.__version__.split(".")[:2])
+
+class BarangayIndex:
+    """STRtree index over the polygons of an LGU's barangays. It is built once and can be queried many times."""
+
+    def __init__(self, gdf, name_col = "NAME_3"):
+        self.gdf = gdf.reset_index(drop = True)
+        self.names = self.gdf[name_col].to_numpy()
+
+        # GeoPandas builds an STRtree over the geometries the first time sindex is used.
+        self.sindex = self.gdf.sindex
+
+    def query_points(self, points):
+        """Return two arrays: the positions of the points, and the positions of the polygons that contain them."""
+
+        # In older versions of GeoPandas, queries with many geometries use query_bulk().
+        if geopandas_version() < (0, 12):
+            return self.sindex.query_bulk(points, predicate = "intersects")
+        else:
+            return self.sindex.query(points, predicate = "intersects")
+
+    def locate_positions(self, lons, lats):
+        """Return the position of the barangay containing each point, or -1 if no barangay contains it."""
+
+        points = gpd.points_from_xy(lons, lats, crs = self.gdf.crs)
+        point_idx, polygon_idx = self.query_points(points)
+
+        positions = np.full(len(points), -1, dtype = np.int64)
+
+        # If a point is on the border of two barangays, keep the first barangay.
+        positions[point_idx[::-1]] = polygon_idx[::-1]
+
+        return positions
+
+    def locate_many(self, lons, lats):
+        """Return an array with the name of the barangay containing each point, or None if no barangay contains it."""
+
+        positions = self.locate_positions(lons, lats)
+
+        names = np.full(len(positions), None, dtype = object)
+        found = positions >= 0
+        names[found] = self.names[positions[found]]
+
+        return names
+
+    def locate(self, lon, lat):
+        """Return the name of the barangay containing a point, or None if no barangay contains it."""
+        return self.locate_many([lon], [lat])[0]
@@ -0,0 +1,117 @@
+"""
+The divided database stored in a SQLite file.
+
+Each sheet (library, barangay_id, and one sheet per SID) is a table with the same name and columns.
+Two more tables describe the data, so that it can be queried without assembling flat_df:
+
+- variables: one row for each variable, with its flat key, its position among the columns of flat_df,
+its SID, its dtype in flat_df, and its labels at each level of the hierarchy. The levels are indexed.
+- barangays: the barangays with data in at least one sheet, with their position among the rows of
+flat_df, their BID, and their name.
+
+Every table of a sheet is indexed on BID.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from barangay_gazetteer import bids_to_names
+
+# Levels of the hierarchy, in order.
+LEVELS = ["Sector", "Element", "Hazard", "Disaster Risk Aspect", "Detail"]
+
+# Tables that are not sheets of the divided database.
+META_TABLES = ["variables", "barangays"]
+
+def quote(name):
+    """Quote a table or column name for SQL."""
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+def is_sqlite_path(db_path):
+    """Return True if db_path is a SQLite database, by its extension."""
+    return os.path.splitext(db_path)[1] in [".sqlite", ".db"]
+
+def make_variables_table(db):
+    """Return the variables table: the flat key, position, SID, dtype, and hierarchy labels of each variable.
+The dtype is the one the variable's column has in flat_df before text is encoded. Integer columns of
+sheets without data on every barangay get missing values in flat_df, so they are floats there."""
+
+    num_barangays = len(make_barangays_table(db))
+
+    rows = []
+    for _, row in db["library"].iterrows():
+        sid = str(row["SID"])
+        sheet = db[sid]
+        is_complete = sheet["BID"].nunique() == num_barangays
+
+        for detail in sheet.columns:
+            if detail == "BID":
+                continue
+            dtype = sheet[detail].dtype
+            if dtype.kind in "iub" and not is_complete:
+                dtype = np.dtype(float) if dtype.kind != "b" else np.dtype(object)
+            labels = [row["Sector"], row["Element"], row["Hazard"], row["Disaster Risk Aspect"], detail]
+            rows.append(["/".join(labels), sid, str(dtype)] + labels)
+
+    variables = pd.DataFrame(rows, columns = ["flat_key", "SID", "dtype"] + LEVELS)
+
+    # Position 0 of flat_df is (Barangay).
+    variables.insert(0, "position", range(1, len(variables) + 1))
+
+    return variables
+
+def make_barangays_table(db):
+    """Return the barangays with data in at least one sheet, in the order of the rows of flat_df.
+Like the merges in make_flat_df(), this is the order in which each BID first appears in the sheets."""
+
+    sids = db["library"]["SID"].astype(str)
+    bids = pd.unique(pd.concat([db[sid]["BID"] for sid in sids], ignore_index = True))
+
+    barangays = pd.DataFrame({"position": range(len(bids)), "BID": bids})
+    barangays["NAME_3"] = bids_to_names(barangays["BID"], db["barangay_id"])
+
+    return barangays
+
+def write_sqlite_database(db, db_path):
+    """Write the sheets of a divided database to a SQLite file, with the variables and barangays tables and the indexes.
+An existing file is replaced."""
+
+    # Write to a temporary file first, so that readers never see a half-written database.
+    temp_path = db_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    with sqlite3.connect(temp_path) as con:
+        for sheet_name, sheet in db.items():
+            sheet.to_sql(str(sheet_name), con, index = False)
+            if "BID" in sheet.columns:
+                con.execute("CREATE INDEX {} ON {} (BID)".format(quote("bid_" + str(sheet_name)), quote(sheet_name)))
+
+        make_variables_table(db).to_sql("variables", con, index = False)
+        con.execute("CREATE UNIQUE INDEX variables_flat_key ON variables (flat_key)")
+        for level in LEVELS:
+            con.execute("CREATE INDEX {} ON variables ({})".format(quote("variables_" + level), quote(level)))
+
+        make_barangays_table(db).to_sql("barangays", con, index = False)
+
+    con.close()
+    os.replace(temp_path, db_path)
+
+def list_sheets(con):
+    """Return the names of the sheets in a SQLite database: library, barangay_id, then the SIDs in order."""
+
+    sids = pd.read_sql("SELECT SID FROM library", con)["SID"].astype(str).tolist()
+    return ["library", "barangay_id"] + sids
+
+def read_sqlite_database(db_path):
+    """Read all sheets of a SQLite database into a dict of DataFrames, like read_database()."""
+
+    with sqlite3.connect(db_path) as con:
+        db = {sheet_name: pd.read_sql("SELECT * FROM {}".format(quote(sheet_name)), con) for sheet_name in list_sheets(con)}
+
+    con.close()
+
+    return db
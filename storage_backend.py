@@ -0,0 +1,182 @@
+"""
+Storage backends for the data of an LGU, with one interface for the queries of features.
+
+MemoryBackend holds the assembled flat_df in memory, like the app. SQLiteBackend keeps the divided
+database in a SQLite file (see sqlite_database.py) and only reads the columns and rows that a query
+needs, using the indexes on BID and on the levels of the hierarchy. Both backends return the same
+DataFrames, so either one can be used, and benchmark_storage.py compares them.
+
+No feature of the app uses the backends yet. The app reads a SQLite database in full with
+read_database(), like the other formats, and builds the whole flat_df.
+"""
+
+import sqlite3
+import threading
+
+import pandas as pd
+
+from app_data import BRGY_DCT, encode_columns, load_lgu_data
+from label_registry import encode_labels, make_flat_keys
+from sqlite_database import LEVELS, is_sqlite_path, quote
+
+class MemoryBackend:
+    """Backend that answers queries from the assembled mi_df and flat_df."""
+
+    def __init__(self, mi_df, flat_df, db):
+        self.mi_df = mi_df
+        self.flat_df = flat_df
+        self.db = db
+
+    def get_variables(self):
+        """Return mi_df, with the labels of each variable at each level of the hierarchy."""
+        return self.mi_df
+
+    def get_barangays(self):
+        """Return the names of the barangays, in the order of the rows of flat_df."""
+        return self.flat_df["(Barangay)"].tolist()
+
+    def find_variables(self, levels):
+        """Return the flat keys of the variables whose labels match a dict of levels, such as {"Hazard": "Flood"}."""
+
+        variables = self.mi_df.iloc[1:]
+        for level, label in levels.items():
+            variables = variables.loc[variables[level] == label]
+
+        return make_flat_keys(variables)
+
+    def get_columns(self, labels, barangays = None):
+        """Return a DataFrame with the (Barangay) column and the columns of the given flat keys.
+If barangays is given, only the rows of those barangays are returned."""
+
+        columns = self.flat_df[["(Barangay)"] + list(labels)]
+
+        if barangays is not None:
+            columns = columns.loc[columns["(Barangay)"].isin(barangays)]
+
+        return columns.reset_index(drop = True)
+
+    def get_sheet(self, sheet_name):
+        """Return one sheet of the divided database."""
+        return self.db[sheet_name]
+
+    def close(self):
+        pass
+
+# Largest number of sheets that are joined in one query. SQLite allows 64 tables in a join, including the barangays table.
+MAX_JOINED_SHEETS = 60
+
+class SQLiteBackend:
+    """Backend that answers queries from a SQLite database, reading only the tables, columns, and rows needed."""
+
+    def __init__(self, db_path):
+        # The connection is shared by the threads of the app, one query at a time.
+        self.con = sqlite3.connect(db_path, check_same_thread = False)
+        self.lock = threading.Lock()
+
+        # The list of barangays is small, so it is kept in memory.
+        self.barangays = self.query("SELECT BID, NAME_3 FROM barangays ORDER BY position")
+
+    def query(self, sql, params = ()):
+        with self.lock:
+            return pd.read_sql(sql, self.con, params = params)
+
+    def get_variables(self):
+        """Return mi_df, with the labels of each variable at each level of the hierarchy."""
+
+        variables = self.query("SELECT {} FROM variables ORDER BY position".format(", ".join(quote(level) for level in LEVELS)))
+        mi_df = pd.concat([pd.DataFrame([BRGY_DCT]), variables], ignore_index = True)
+
+        return encode_labels(mi_df)
+
+    def get_barangays(self):
+        """Return the names of the barangays, in the order of the rows of flat_df."""
+        return self.barangays["NAME_3"].tolist()
+
+    def find_variables(self, levels):
+        """Return the flat keys of the variables whose labels match a dict of levels, such as {"Hazard": "Flood"}."""
+
+        conditions = " AND ".join("{} = ?".format(quote(level)) for level in levels) or "1"
+        sql = "SELECT flat_key FROM variables WHERE {} ORDER BY position".format(conditions)
+
+        return self.query(sql, tuple(levels.values()))["flat_key"].tolist()
+
+    def get_columns(self, labels, barangays = None):
+        """Return a DataFrame with the (Barangay) column and the columns of the given flat keys.
+If barangays is given, only the rows of those barangays are returned."""
+
+        labels = list(labels)
+
+        placeholders = ", ".join("?" for _ in labels)
+        variables = self.query(
+            "SELECT flat_key, SID, Detail, dtype FROM variables WHERE flat_key IN ({})".format(placeholders),
+            tuple(labels),
+        ).set_index("flat_key").loc[lambda df: ~df.index.duplicated()]
+
+        unknown = set(labels) - set(variables.index)
+        if unknown:
+            raise KeyError("Unknown variables: {}".format(sorted(unknown)))
+
+        variables = variables.loc[labels]
+
+        bid_filter = ""
+        bid_params = ()
+        if barangays is not None:
+            bids = self.barangays.loc[self.barangays["NAME_3"].isin(barangays), "BID"]
+            bid_filter = " WHERE b.BID IN ({})".format(", ".join("?" for _ in range(len(bids))))
+            bid_params = tuple(int(bid) for bid in bids)
+
+        # The sheets are joined to the barangays table by SQLite, using the indexes on BID.
+        # SQLite joins at most 64 tables at once, so many sheets are joined in groups.
+        sids = variables["SID"].unique().tolist()
+        parts = []
+        # Without any variables, one query still gets the (Barangay) column.
+        for i in range(0, max(len(sids), 1), MAX_JOINED_SHEETS):
+            group = sids[i:i + MAX_JOINED_SHEETS]
+            aliases = {sid: "t{}".format(j) for j, sid in enumerate(group)}
+            group_variables = variables.loc[variables["SID"].isin(group)]
+
+            sql = "SELECT {} FROM barangays AS b {}{} ORDER BY b.position".format(
+                ", ".join(["b.NAME_3"] + [
+                    "{}.{}".format(aliases[sid], quote(detail))
+                    for sid, detail in zip(group_variables["SID"], group_variables["Detail"])
+                ]),
+                " ".join("LEFT JOIN {} AS {} ON {}.BID = b.BID".format(quote(sid), alias, alias) for sid, alias in aliases.items()),
+                bid_filter,
+            )
+            part = self.query(sql, bid_params)
+            part.columns = ["(Barangay)"] + group_variables.index.tolist()
+            parts.append(part if i == 0 else part.drop(columns = "(Barangay)"))
+
+        columns = pd.concat(parts, axis = 1)[["(Barangay)"] + labels]
+
+        # Numbers get the same dtypes as in flat_df, and text columns get the same categorical types.
+        numeric = variables.loc[variables["dtype"] != "object", "dtype"]
+        columns = columns.astype(numeric.to_dict())
+
+        return encode_columns(columns)
+
+    def get_sheet(self, sheet_name):
+        """Return one sheet of the divided database."""
+        return self.query("SELECT * FROM {}".format(quote(sheet_name)))
+
+    def close(self):
+        self.con.close()
+
+def open_backend(lgu, kind = None):
+    """Open a storage backend for the data of an LGU. kind is "memory" or "sqlite".
+By default, LGUs whose db_path is a SQLite file use the SQLite backend, and others use the memory backend."""
+
+    if kind is None:
+        kind = "sqlite" if is_sqlite_path(lgu["db_path"]) else "memory"
+
+    if kind == "memory":
+        mi_df, flat_df, db, gdf = load_lgu_data(lgu)
+        return MemoryBackend(mi_df, flat_df, db)
+
+    elif kind == "sqlite":
+        if not is_sqlite_path(lgu["db_path"]):
+            raise ValueError("The database of {} is not a SQLite file: {}".format(lgu["name"], lgu["db_path"]))
+        return SQLiteBackend(lgu["db_path"])
+
+    else:
+        raise ValueError("Unknown storage backend: {}".format(kind))
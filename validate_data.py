@@ -0,0 +1,357 @@
+"""
+Validate a divided database before it is used by the app.
+
+A malformed input workbook would otherwise only show up as a KeyError or as missing values in the app.
+The checks are:
+
+- structure: the library and barangay_id sheets exist and have the expected columns.
+- library: SIDs are unique, every SID in the library has a sheet with a BID column, and no two
+library rows have the same hierarchy labels.
+- barangays: BIDs are unique in barangay_id and in each sheet, and every BID of a sheet is in barangay_id.
+- ranges: scores, percentages, and other numbers are within their ranges.
+- vocabularies: category columns, such as Risk Category, and Yes/No columns only have the allowed values.
+
+Each problem is an error or a warning. Errors are problems that break the app. Numbers outside their
+range are warnings, since some values in the source data do not follow the formulas exactly.
+The checks are vectorized over the columns of each sheet, so they take a fraction of a second and run
+at the end of cleaning_program_part2.py and when the app loads an LGU.
+
+Example:
+
+    python validate_data.py
+    AGRIHANDA_LGU_REGISTRY=./synthetic_data/lgus.json python validate_data.py --lgus synthetic_city
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from app_data import read_database, SCORE_CATEGORIES, RISK_CATEGORIES, MAX_CACHED_LGUS, MAX_CACHED_VINTAGES
+from lgu_registry import read_lgu_registry, get_vintage_names, get_vintage_db_path
+from sqlite_database import LEVELS
+from disk_cache import cached, hash_files
+
+# Columns that each sheet must have.
+REQUIRED_COLUMNS = {
+    "library": LEVELS[:-1] + ["SID"],
+    "barangay_id": ["GID_3", "NAME_3", "BID"],
+}
+
+# Ranges of numerical variables, as (pattern of the Detail label, lowest value, highest value, must be numerical).
+# The first matching pattern is used. Variables that do not have to be numerical are only checked if they are.
+RANGES = [
+    (r"^Likelihood Of Occurrence$", 0, 6, True),
+    (r"^Vulnerability Score$", 0, np.inf, True),
+    (r"^Risk Score$", 0, 30, True),
+    (r"Score$", 0, 5, True),
+    (r"^(?:Percentage Of|% Of)|Percentage$", 0, 1, True),
+    # Counts, areas, and outputs.
+    (r".", 0, np.inf, False),
+]
+
+# Allowed values of text variables, as (pattern of the Detail label, values, must be text).
+# Variables that do not have to be text are only checked if they are.
+VOCABULARIES = [
+    (r"^(?:Degree Of Impact|Vulnerability) Category$", SCORE_CATEGORIES, True),
+    (r"^Risk Category$", RISK_CATEGORIES, True),
+    (r"^Geographical Area Or Ecosystem$", ["Coastal", "Lowland", "Upland"], True),
+    (r"^Magnitude Or Depth$", ["Slight", "Low", "Moderate", "High", "Severe"], True),
+    # Items of list variables, such as Dominant Livestock_CHICKEN, are Yes/No columns.
+    # Numerical variables of each item, such as Bangus_Ave Output Per Hectare (Php), are checked as numbers.
+    (r"_(?!Score$)[^_]+$", ["No", "Yes"], False),
+]
+
+PROBLEM_COLUMNS = ["severity", "check", "sheet", "column", "count", "message"]
+
+def make_problem(severity, check, sheet, column, count, message):
+    """Return a dict describing one problem."""
+    return {"severity": severity, "check": check, "sheet": sheet, "column": column, "count": int(count), "message": message}
+
+def match_patterns(labels, patterns):
+    """Return the position of the first pattern that matches each label, or -1 if none matches."""
+
+    labels = pd.Index(labels, dtype = object).astype(str)
+    positions = np.full(len(labels), -1)
+
+    # Go from the last pattern to the first, so that earlier patterns overwrite later ones.
+    for i in reversed(range(len(patterns))):
+        positions[labels.str.contains(patterns[i], regex = True)] = i
+
+    return positions
+
+def get_sids(db):
+    """Return the SIDs in the library as text, like the names of the sheets."""
+    return db["library"]["SID"].astype(str)
+
+def check_structure(db):
+    """Check that the library and barangay_id sheets exist and have the required columns."""
+
+    problems = []
+
+    for sheet_name, columns in REQUIRED_COLUMNS.items():
+        if sheet_name not in db:
+            problems.append(make_problem("error", "structure", sheet_name, None, 1, "The sheet is missing."))
+            continue
+
+        missing = [col for col in columns if col not in db[sheet_name].columns]
+        if len(missing) > 0:
+            problems.append(make_problem("error", "structure", sheet_name, None, len(missing), "Missing columns: {}".format(missing)))
+
+    return problems
+
+def check_library(db):
+    """Check that every SID in the library is unique and has a sheet with a BID column and data."""
+
+    problems = []
+    library = db["library"]
+    sids = get_sids(db)
+
+    duplicated = sids.loc[sids.duplicated()]
+    if len(duplicated) > 0:
+        problems.append(make_problem("error", "library", "library", "SID", len(duplicated), "Duplicated SIDs: {}".format(duplicated.unique().tolist())))
+
+    # Rows with the same labels would give their variables the same flat keys.
+    duplicated_labels = library.duplicated(REQUIRED_COLUMNS["library"][:-1])
+    if duplicated_labels.any():
+        problems.append(make_problem("error", "library", "library", None, duplicated_labels.sum(), "Rows with the same hierarchy labels: SIDs {}".format(sids[duplicated_labels].tolist())))
+
+    missing_labels = library[REQUIRED_COLUMNS["library"][:-1]].isna().any(axis = 1)
+    if missing_labels.any():
+        problems.append(make_problem("error", "library", "library", None, missing_labels.sum(), "Rows with missing hierarchy labels: SIDs {}".format(sids[missing_labels].tolist())))
+
+    missing_sheets = sids.loc[~sids.isin(db.keys())]
+    if len(missing_sheets) > 0:
+        problems.append(make_problem("error", "library", "library", "SID", len(missing_sheets), "SIDs without a sheet: {}".format(missing_sheets.tolist())))
+
+    for sid in sids.loc[sids.isin(db.keys())].unique():
+        sheet = db[sid]
+        if "BID" not in sheet.columns:
+            problems.append(make_problem("error", "library", sid, "BID", 1, "The sheet has no BID column."))
+        elif len(sheet) == 0 or len(sheet.columns) == 1:
+            problems.append(make_problem("warning", "library", sid, None, 1, "The sheet has no data."))
+
+    extra_sheets = [sheet_name for sheet_name in db if sheet_name not in REQUIRED_COLUMNS and sheet_name not in set(sids)]
+    if len(extra_sheets) > 0:
+        problems.append(make_problem("warning", "library", None, None, len(extra_sheets), "Sheets that are not in the library: {}".format(extra_sheets)))
+
+    return problems
+
+def check_barangays(db):
+    """Check that BIDs are unique in barangay_id and in each sheet, and that every BID of a sheet is in barangay_id."""
+
+    problems = []
+    barangays = db["barangay_id"]
+
+    for col in ["BID", "GID_3"]:
+        values = barangays[col]
+        if values.isna().any():
+            problems.append(make_problem("error", "barangays", "barangay_id", col, values.isna().sum(), "Missing {} values.".format(col)))
+        duplicated = values.loc[values.duplicated() & values.notna()]
+        if len(duplicated) > 0:
+            problems.append(make_problem("error", "barangays", "barangay_id", col, len(duplicated), "Duplicated values: {}".format(duplicated.unique()[:10].tolist())))
+
+    # The BIDs of all sheets are checked at once.
+    sids = [sid for sid in get_sids(db).unique() if sid in db and "BID" in db[sid].columns]
+    if len(sids) == 0:
+        return problems
+
+    # Sheets are numbered, so that each row is identified by two numbers: its sheet and its BID.
+    sheet_codes = np.repeat(np.arange(len(sids)), [len(db[sid]) for sid in sids])
+    bids = pd.Series(np.concatenate([pd.to_numeric(db[sid]["BID"], errors = "coerce").to_numpy(dtype = float) for sid in sids]))
+
+    is_missing = bids.isna().to_numpy()
+    # BIDs are whole numbers, so a pair of sheet and BID can be packed into one number.
+    keys = pd.Series(sheet_codes * (np.nan_to_num(bids.abs().max()) + 1) + bids)
+    is_duplicated = keys.duplicated().to_numpy() & ~is_missing
+    is_unknown = ~bids.isin(barangays["BID"]).to_numpy() & ~is_missing
+
+    for check_mask, message in [
+        (is_missing, "Rows without a BID, or with a BID that is not a number."),
+        (is_duplicated, "Duplicated BIDs: {}"),
+        (is_unknown, "BIDs that are not in barangay_id: {}"),
+    ]:
+        for code in np.unique(sheet_codes[check_mask]):
+            sheet_bids = bids[check_mask & (sheet_codes == code)]
+            examples = sheet_bids.dropna().unique()[:10].astype("int64").tolist()
+            problems.append(make_problem("error", "barangays", sids[code], "BID", len(sheet_bids), message.format(examples)))
+
+    return problems
+
+def check_values(db):
+    """Check the ranges of numerical variables and the values of text variables in every sheet."""
+
+    problems = []
+
+    sids = [sid for sid in get_sids(db).unique() if sid in db]
+    details = pd.unique(np.concatenate([db[sid].columns.to_numpy(dtype = object) for sid in sids])) if sids else []
+
+    # Match the patterns once for each distinct Detail label.
+    range_rules = dict(zip(details, match_patterns(details, [rule[0] for rule in RANGES])))
+    vocabulary_rules = dict(zip(details, match_patterns(details, [rule[0] for rule in VOCABULARIES])))
+
+    for sid in sids:
+        sheet = db[sid].drop(columns = "BID", errors = "ignore")
+        if len(sheet.columns) == 0:
+            continue
+
+        is_number = sheet.dtypes.map(pd.api.types.is_numeric_dtype).to_numpy(dtype = bool)
+
+        # A variable is checked against a vocabulary if it must be text, or if it is text. Otherwise, it is checked against a range.
+        vocabularies = np.array([vocabulary_rules[col] for col in sheet.columns])
+        must_be_text = np.array([VOCABULARIES[rule][2] if rule >= 0 else False for rule in vocabularies], dtype = bool)
+        vocabularies[is_number & ~must_be_text] = -1
+        ranges = np.where(vocabularies == -1, [range_rules[col] for col in sheet.columns], -1)
+
+        # Variables that must be numerical, but have text.
+        must_be_number = np.array([RANGES[rule][3] if rule >= 0 else False for rule in ranges], dtype = bool)
+        for col in sheet.columns[must_be_number & ~is_number]:
+            values = pd.to_numeric(sheet[col], errors = "coerce")
+            bad = sheet[col].loc[values.isna() & sheet[col].notna()]
+            problems.append(make_problem("error", "ranges", sid, col, len(bad), "Values that are not numbers: {}".format(bad.unique()[:5].tolist())))
+
+        # Ranges of all numerical variables of the sheet at once.
+        checked = is_number & (ranges >= 0)
+        if checked.any():
+            values = sheet.iloc[:, checked].to_numpy(dtype = float)
+            lows = np.array([RANGES[rule][1] for rule in ranges[checked]])
+            highs = np.array([RANGES[rule][2] for rule in ranges[checked]])
+
+            below = (values < lows).sum(axis = 0)
+            above = (values > highs).sum(axis = 0)
+
+            for col, low, high, num_below, num_above in zip(sheet.columns[checked], lows, highs, below, above):
+                if num_below + num_above > 0:
+                    problems.append(make_problem(
+                        "warning", "ranges", sid, col, num_below + num_above,
+                        "{} values below {:g} and {} values above {:g}.".format(num_below, low, num_above, high),
+                    ))
+
+        # Values of text variables. Only the distinct values of each variable are compared with the vocabulary,
+        # and the values are only counted for the few variables with values that are not allowed.
+        for rule in np.unique(vocabularies[vocabularies >= 0]):
+            allowed = np.array(VOCABULARIES[rule][1], dtype = object)
+            cols = sheet.columns[vocabularies == rule]
+            values = sheet[cols].to_numpy(dtype = object)
+
+            for col, col_values in zip(cols, values.T):
+                uniques = pd.unique(col_values)
+                bad = uniques[pd.notna(uniques) & ~np.isin(uniques, allowed)]
+                if len(bad) > 0:
+                    problems.append(make_problem(
+                        "error", "vocabularies", sid, col, np.isin(col_values, bad).sum(),
+                        "Values that are not in {}: {}".format(list(allowed), bad[:5].tolist()),
+                    ))
+
+    return problems
+
+def validate_database(db):
+    """Run all checks on a divided database. Return a DataFrame of problems, errors first.
+Each problem has a severity ("error" or "warning"), a check, a sheet, a column, a count of values, and a message."""
+
+    problems = check_structure(db)
+
+    # The other checks need the library and barangay_id sheets.
+    if len(problems) == 0:
+        problems += check_library(db)
+        problems += check_barangays(db)
+        problems += check_values(db)
+
+    return (
+        pd.DataFrame(problems, columns = PROBLEM_COLUMNS)
+        .sort_values("severity", kind = "stable")
+        .reset_index(drop = True)
+    )
+
+def make_read_problems(error):
+    """Return a DataFrame of problems with the error of a database that cannot be read,
+for example because the file or the library of a folder of Parquet files is missing."""
+    return pd.DataFrame([make_problem("error", "structure", None, None, 1, "The database cannot be read: {}".format(error))], columns = PROBLEM_COLUMNS)
+
+def raise_for_errors(problems, name = "The database"):
+    """Raise a ValueError that lists the errors in a DataFrame of problems, if there are any."""
+
+    errors = problems.loc[problems["severity"] == "error"]
+    if len(errors) > 0:
+        raise ValueError("{} has {} errors:\n{}".format(name, len(errors), errors.to_string(index = False)))
+
+def check_database(db_path):
+    """Read a database and return its problems, including a structure error if it cannot be read."""
+
+    try:
+        db = read_database(db_path)
+    except FileNotFoundError as error:
+        return make_read_problems(error)
+
+    return validate_database(db)
+
+# The problems are cached as a resource, so each vintage of each LGU is only checked once per process.
+# They are also kept in the disk cache, keyed by the database files like the assembled data,
+# so a new process does not read the database again only to check it.
+@st.cache_resource(max_entries = MAX_CACHED_LGUS * MAX_CACHED_VINTAGES)
+def get_problems(lgu_key, vintage = None):
+    """Return the problems of the database of an LGU and vintage. The database is checked as it is read,
+before it is assembled, so that malformed data is reported instead of raising an error in assemble_data()."""
+
+    db_path = get_vintage_db_path(read_lgu_registry()[lgu_key], vintage)
+
+    try:
+        db_hash = hash_files([db_path])
+    except FileNotFoundError as error:
+        return make_read_problems(error)
+
+    return cached("problems", db_hash, check_database, db_path)
+
+def get_vintage_problems(lgu_key, vintage = None):
+    """Return the problems of the databases that the data of an LGU and vintage is made from, with a vintage column.
+The base vintage is made from its own database. A later vintage is made from the store of all vintages,
+so all of their databases are checked."""
+
+    vintage_names = get_vintage_names(read_lgu_registry()[lgu_key])
+    if vintage is None or vintage == vintage_names[0]:
+        vintage_names = vintage_names[:1]
+
+    return pd.concat(
+        [get_problems(lgu_key, vintage_name).assign(vintage = vintage_name) for vintage_name in vintage_names],
+        ignore_index = True,
+    )
+
+if __name__ == "__main__":
+
+    registry = read_lgu_registry()
+
+    parser = argparse.ArgumentParser(description = "Validate the divided databases of LGUs and their vintages.")
+    parser.add_argument("--lgus", nargs = "+", default = list(registry.keys()), help = "Keys of the LGUs in the LGU registry. By default, all LGUs are validated.")
+    parser.add_argument("--warnings", action = "store_true", help = "Also print the warnings, not only their number.")
+    args = parser.parse_args()
+
+    num_errors = 0
+
+    for lgu_key in args.lgus:
+        lgu = registry[lgu_key]
+
+        for vintage in get_vintage_names(lgu):
+            start = time.perf_counter()
+            try:
+                db = read_database(get_vintage_db_path(lgu, vintage))
+            except FileNotFoundError as error:
+                problems = make_read_problems(error)
+            else:
+                start = time.perf_counter()
+                problems = validate_database(db)
+            seconds = time.perf_counter() - start
+
+            errors = problems.loc[problems["severity"] == "error"]
+            warnings = problems.loc[problems["severity"] == "warning"]
+            num_errors += len(errors)
+
+            print("{} ({}): {} errors, {} warnings, checked in {:.3f} s".format(lgu["name"], vintage, len(errors), len(warnings), seconds))
+
+            shown = problems if args.warnings else errors
+            if len(shown) > 0:
+                print(shown.to_string(index = False))
+
+    sys.exit(1 if num_errors > 0 else 0)
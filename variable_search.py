@@ -0,0 +1,107 @@
+"""
+Search for variables by text, such as "Vulnerability Score" or "radio".
+
+The labels of each level of the hierarchy are indexed by their trigrams (groups of 3 characters).
+Because mi_df stores each label once per level, only the distinct labels are indexed.
+A search scores the labels that share trigrams with the query, then adds up the scores of
+each variable's labels using the integer codes of the label registry.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+NGRAM_SIZE = 3
+
+def normalize(text):
+    """Lowercase text and replace underscores, slashes, and other punctuation with spaces."""
+    return " ".join(re.sub(r"[^0-9a-zñ]+", " ", text.lower()).split())
+
+def get_ngrams(text, n = NGRAM_SIZE):
+    """Return the set of n-grams of normalized text. The text is padded so that short words have n-grams."""
+
+    padded = " {} ".format(normalize(text))
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+class VariableIndex:
+    """Inverted n-gram index over the hierarchy labels of the variables in mi_df."""
+
+    def __init__(self, mi_df):
+        # The (Barangay) row is not searchable.
+        mi_df = mi_df.loc[mi_df["Sector"] != "(Barangay)"]
+
+        self.levels = list(mi_df.columns)
+        self.codes = np.column_stack([mi_df[level].cat.codes.to_numpy() for level in self.levels])
+        self.labels = [mi_df[level].cat.categories for level in self.levels]
+
+        # For each level, map each n-gram to an array of the codes of the labels containing it.
+        self.postings = []
+        for labels in self.labels:
+            level_postings = {}
+            for code, label in enumerate(labels):
+                for ngram in get_ngrams(label):
+                    level_postings.setdefault(ngram, []).append(code)
+
+            self.postings.append({
+                ngram: np.array(codes, dtype = np.int32)
+                for ngram, codes in level_postings.items()
+            })
+
+        # Normalized labels, for rewarding labels that contain the whole query.
+        self.normalized_labels = [[normalize(label) for label in labels] for labels in self.labels]
+
+    def score(self, query):
+        """Return an array with the score of every variable for the query.
+A score of 1 means that all n-grams of the query were found in the variable's labels."""
+
+        query_ngrams = get_ngrams(query)
+        query_text = normalize(query)
+        scores = np.zeros(len(self.codes), dtype = np.float32)
+
+        for level_num, level_postings in enumerate(self.postings):
+            # Count the query n-grams found in each label of this level.
+            label_hits = np.zeros(len(self.labels[level_num]), dtype = np.float32)
+            for ngram in query_ngrams:
+                codes = level_postings.get(ngram)
+                if codes is not None:
+                    label_hits[codes] += 1
+
+            if not label_hits.any():
+                continue
+
+            # Labels that contain the whole query get a bonus, so exact matches rank first.
+            # The bonus is larger when the query covers more of the label.
+            # Only labels with all of the query's n-grams can contain it.
+            for code in np.flatnonzero(label_hits == len(query_ngrams)):
+                label = self.normalized_labels[level_num][code]
+                if query_text in label:
+                    label_hits[code] += len(query_ngrams) * len(query_text) / len(label)
+
+            scores += label_hits[self.codes[:, level_num]]
+
+        return scores / len(query_ngrams)
+
+    def search(self, query, limit = 20, min_score = 0.5):
+        """Return the positions of the best matching variables, from best to worst,
+and their scores. Variables scoring below min_score are left out."""
+
+        if len(normalize(query)) == 0:
+            return np.array([], dtype = np.int64), np.array([])
+
+        scores = self.score(query)
+
+        # Only sort the best variables, not all of them.
+        limit = min(limit, len(scores))
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        # Sort by score, then by position, so that tied variables keep the order of the hierarchy.
+        best = best[np.lexsort((best, -scores[best]))]
+        best = best[scores[best] >= min_score]
+
+        return best, scores[best]
+
+    def get_flat_keys(self, positions):
+        """Return the flat_df keys of the variables at the given positions."""
+
+        labels = [self.labels[level_num].take(self.codes[positions, level_num]) for level_num in range(len(self.levels))]
+        return ["/".join(parts) for parts in zip(*labels)]
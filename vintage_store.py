@@ -0,0 +1,193 @@
+"""
+Storage of several vintages of an LGU's data, such as yearly updates of the Sparta data.
+
+The first vintage is kept whole. Each later vintage only keeps the flat_df columns whose
+values differ from the first vintage, and the database sheets that changed. Unchanged
+columns and sheets are read from the first vintage, so adding a vintage that changes a few
+variables costs about as much memory as those variables. The first vintage's flat_df is not
+copied: its columns are indexed by barangay only when they are used.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import is_numeric_dtype
+
+def columns_equal(a, b):
+    """Return True if two columns have the same values in the same rows. Missing values are equal."""
+
+    if a.equals(b):
+        return True
+
+    # The dtypes may differ, for example when missing rows turn integers into floats,
+    # or when two categoricals have different categories. Compare the values themselves.
+    return a.astype(object).equals(b.astype(object))
+
+def sheets_equal(a, b):
+    """Return True if two database sheets have the same columns and values. The order of the columns does not matter,
+since sheets attached from shared memory have their columns grouped by type."""
+    return set(a.columns) == set(b.columns) and a[list(b.columns)].reset_index(drop = True).equals(b.reset_index(drop = True))
+
+class Vintage:
+    """One vintage, stored as its differences from the base vintage."""
+
+    def __init__(self, name, mi_df, barangays, columns, changed, db):
+        self.name = name
+        self.mi_df = mi_df
+        # Barangays (rows) and flat keys (columns) of the vintage's flat_df, in order.
+        self.barangays = barangays
+        self.columns = columns
+        # Columns that are new or differ from the base vintage, indexed by barangay.
+        self.changed = changed
+        # Database sheets. Unchanged sheets are the same objects as the base vintage's.
+        self.db = db
+
+class VintageStore:
+    """Vintages of one LGU's data: a base snapshot plus the changed columns of each later vintage."""
+
+    def __init__(self, base_name, mi_df, flat_df, db, gdf):
+        self.base_name = base_name
+        # The base flat_df is kept as it is, and shares its arrays with the Dataset it came from.
+        self.base = flat_df
+        self.base_barangays = pd.Index(flat_df["(Barangay)"])
+
+        # The geodata is the same for all vintages.
+        self.gdf = gdf
+
+        base_vintage = Vintage(
+            base_name,
+            mi_df,
+            self.base_barangays,
+            [col for col in flat_df.columns if col != "(Barangay)"],
+            pd.DataFrame(index = self.base_barangays),
+            db,
+        )
+        self.vintages = {base_name: base_vintage}
+
+    @property
+    def names(self):
+        return list(self.vintages.keys())
+
+    def add_vintage(self, name, mi_df, flat_df, db):
+        """Add a vintage. Only its columns and sheets that differ from the base vintage are kept."""
+
+        new = flat_df.set_index("(Barangay)")
+        base_db = self.vintages[self.base_name].db
+
+        changed_cols = []
+        for col in new.columns:
+            if col not in self.base.columns or not columns_equal(self.get_base_column(col).reindex(new.index), new[col]):
+                changed_cols.append(col)
+
+        # Share the sheets that did not change.
+        vintage_db = {}
+        for sheet_name, sheet in db.items():
+            if sheet_name in base_db and sheets_equal(base_db[sheet_name], sheet):
+                vintage_db[sheet_name] = base_db[sheet_name]
+            else:
+                vintage_db[sheet_name] = sheet
+
+        self.vintages[name] = Vintage(
+            name,
+            mi_df,
+            new.index,
+            list(new.columns),
+            new[changed_cols],
+            vintage_db,
+        )
+
+    def changed_labels(self, name):
+        """Return the flat keys of the variables of a vintage that differ from the base vintage."""
+        return list(self.vintages[name].changed.columns)
+
+    def get_base_column(self, label):
+        """Return one column of the base vintage as a Series indexed by barangay. Its values are not copied."""
+        return pd.Series(self.base[label].array, index = self.base_barangays, name = label)
+
+    def get_column(self, name, label):
+        """Return one column of a vintage as a Series indexed by barangay."""
+
+        vintage = self.vintages[name]
+
+        if label in vintage.changed.columns:
+            return vintage.changed[label]
+        elif vintage.barangays.equals(self.base_barangays):
+            return self.get_base_column(label)
+        else:
+            return self.get_base_column(label).reindex(vintage.barangays)
+
+    def get_vintage(self, name):
+        """Return mi_df, flat_df, db, and gdf of a vintage, in the same form as load_data().
+The flat_df is a new DataFrame, so changing it does not change the store. It is made once per process
+by app_data.get_vintage_dataset(), which caches it."""
+
+        vintage = self.vintages[name]
+
+        if name == self.base_name:
+            return vintage.mi_df, self.base, dict(vintage.db), self.gdf
+
+        columns = {"(Barangay)": vintage.barangays.to_numpy()}
+        for label in vintage.columns:
+            columns[label] = self.get_column(name, label).array
+
+        # The columns are copied into blocks, like the flat_df of load_data(). Otherwise, pandas
+        # would combine them into blocks each time a page selects columns from a view of the flat_df.
+        flat_df = pd.DataFrame(columns)
+
+        return vintage.mi_df, flat_df, dict(vintage.db), self.gdf
+
+    def differing_labels(self, name_a, name_b):
+        """Return the flat keys of the variables in both vintages whose values differ between them.
+Only the changed columns of the two vintages are compared, since all other columns are the base vintage's."""
+
+        vintage_a = self.vintages[name_a]
+        vintage_b = self.vintages[name_b]
+
+        candidates = set(vintage_a.changed.columns) | set(vintage_b.changed.columns)
+        common = [col for col in vintage_b.columns if col in candidates and col in vintage_a.columns]
+
+        barangays = vintage_a.barangays.union(vintage_b.barangays)
+
+        return [
+            col for col in common
+            if not columns_equal(
+                self.get_column(name_a, col).reindex(barangays),
+                self.get_column(name_b, col).reindex(barangays),
+            )
+        ]
+
+    def compare(self, name_a, name_b, label):
+        """Return a DataFrame with the values of a variable in two vintages for each barangay,
+and the change from the first vintage to the second."""
+
+        comparison_df = pd.concat(
+            {
+                name_a: self.get_column(name_a, label),
+                name_b: self.get_column(name_b, label),
+            },
+            axis = 1,
+        )
+        comparison_df.index.name = "(Barangay)"
+
+        # Only keep barangays with data in at least one vintage.
+        comparison_df = comparison_df.dropna(how = "all")
+
+        if is_numeric_dtype(comparison_df[name_a]) and is_numeric_dtype(comparison_df[name_b]):
+            comparison_df["Change"] = comparison_df[name_b] - comparison_df[name_a]
+        else:
+            # Missing values are shown as "missing" instead of "nan".
+            old = comparison_df[name_a].astype(str).where(comparison_df[name_a].notna(), "missing")
+            new = comparison_df[name_b].astype(str).where(comparison_df[name_b].notna(), "missing")
+            comparison_df["Change"] = np.where(old == new, "No change", old + " to " + new)
+
+        return comparison_df.reset_index()
+
+    def memory_usage(self):
+        """Return the memory used by the flat_df data of each vintage, in bytes."""
+
+        usage = {self.base_name: int(self.base.memory_usage(deep = True).sum())}
+        for name, vintage in self.vintages.items():
+            if name != self.base_name:
+                usage[name] = int(vintage.changed.memory_usage(deep = True).sum())
+
+        return usage